@@ -14,6 +14,7 @@
 import numpy as np
 import itertools
 import warnings
+import math as m
 
 
 ###############################################################################
@@ -137,4 +138,179 @@ def GJK(poly_A, poly_B, epsilon=1e-6):
             i = 0
 
         i += 1
-    
\ No newline at end of file
+    
+
+
+###############################################################################
+# Closed form GJK
+#
+# Same algorithm as GJK above, but the closest point on the simplex is found with
+# the Voronoi region tests from Real-Time Collision Detection (5.1.5 and 5.1.6)
+# instead of solving every subset of the simplex. Vectors are plain tuples, since
+# numpy is slower than python floats for single 3d vectors.
+# It can also be started from the closest point found last time (the axis), which for
+# objects that have barely moved usually ends the search on the first iteration.
+#
+def dot(a, b):
+    return a[0]*b[0] + a[1]*b[1] + a[2]*b[2]
+
+def sub(a, b):
+    return (a[0]-b[0], a[1]-b[1], a[2]-b[2])
+
+def cross(a, b):
+    return (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+
+def lerp(a, b, t):
+    return (a[0] + (b[0]-a[0])*t, a[1] + (b[1]-a[1])*t, a[2] + (b[2]-a[2])*t)
+
+
+def closest_on_segment(a, b):
+    """
+    Closest point to the origin on the segment ab, and the points of the smallest sub simplex containing it
+    """
+    ab = sub(b, a)
+    length2 = dot(ab, ab)
+    if length2 <= 0:
+        return a, [a]
+
+    t = -dot(a, ab) / length2
+    if t <= 0:
+        return a, [a]
+    if t >= 1:
+        return b, [b]
+    return lerp(a, b, t), [a, b]
+
+
+def closest_on_triangle(a, b, c):
+    """
+    Closest point to the origin on the triangle abc, and the points of the smallest sub simplex containing it
+    """
+    ab = sub(b, a)
+    ac = sub(c, a)
+
+    #vertex region a
+    d1 = -dot(ab, a)
+    d2 = -dot(ac, a)
+    if d1 <= 0 and d2 <= 0:
+        return a, [a]
+
+    #vertex region b
+    d3 = -dot(ab, b)
+    d4 = -dot(ac, b)
+    if d3 >= 0 and d4 <= d3:
+        return b, [b]
+
+    #edge region ab
+    vc = d1*d4 - d3*d2
+    if vc <= 0 and d1 >= 0 and d3 <= 0:
+        return lerp(a, b, d1 / (d1 - d3)), [a, b]
+
+    #vertex region c
+    d5 = -dot(ab, c)
+    d6 = -dot(ac, c)
+    if d6 >= 0 and d5 <= d6:
+        return c, [c]
+
+    #edge region ac
+    vb = d5*d2 - d1*d6
+    if vb <= 0 and d2 >= 0 and d6 <= 0:
+        return lerp(a, c, d2 / (d2 - d6)), [a, c]
+
+    #edge region bc
+    va = d3*d6 - d5*d4
+    if va <= 0 and (d4 - d3) >= 0 and (d5 - d6) >= 0:
+        return lerp(b, c, (d4 - d3) / ((d4 - d3) + (d5 - d6))), [b, c]
+
+    #inside the face
+    total = va + vb + vc
+    if total == 0:
+        #degenerate triangle, so it's really just a segment
+        return min((closest_on_segment(a, b), closest_on_segment(a, c), closest_on_segment(b, c)), key=lambda res: dot(res[0], res[0]))
+
+    v = vb / total
+    w = vc / total
+    return (a[0] + ab[0]*v + ac[0]*w, a[1] + ab[1]*v + ac[1]*w, a[2] + ab[2]*v + ac[2]*w), [a, b, c]
+
+
+def closest_on_tetrahedron(a, b, c, d, tol=1e-12):
+    """
+    Closest point to the origin on the tetrahedron abcd, and the points of the smallest sub simplex containing it
+    Returns the origin and all 4 points if the origin is inside
+    """
+    best = None
+    inside = True
+    for p0, p1, p2, other in ((a, b, c, d), (a, c, d, b), (a, d, b, c), (b, d, c, a)):
+        normal = cross(sub(p1, p0), sub(p2, p0))
+        side_origin = -dot(p0, normal)
+        side_other = dot(sub(other, p0), normal)
+
+        #flat tetrahedrons have no inside, so every face needs checking
+        if abs(side_other) > tol and side_origin*side_other >= 0:
+            continue
+
+        inside = False
+        res = closest_on_triangle(p0, p1, p2)
+        if best is None or dot(res[0], res[0]) < dot(best[0], best[0]):
+            best = res
+
+    if inside:
+        return (0.0, 0.0, 0.0), [a, b, c, d]
+    return best
+
+
+def closest_on_simplex(simplex):
+    """
+    Closest point to the origin on a simplex of 1 to 4 points, and the points of the smallest sub simplex containing it
+    """
+    if len(simplex) == 1:
+        return simplex[0], simplex
+    if len(simplex) == 2:
+        return closest_on_segment(*simplex)
+    if len(simplex) == 3:
+        return closest_on_triangle(*simplex)
+    return closest_on_tetrahedron(*simplex)
+
+
+def support_point_fast(direction, poly_A, poly_B):
+    """
+    Support point of the minkowski difference A-B, only using the xyz columns
+    """
+    direction = np.array(direction)
+    a = poly_A[np.argmax(poly_A[:, :3] @ direction), :3]
+    b = poly_B[np.argmax(poly_B[:, :3] @ -direction), :3]
+    return tuple((a - b).tolist())
+
+
+###############################################################################
+# Test two convex shapes for intersection.
+# Returns whether they intersect, the distance between them, and a separating axis
+# (the closest point of A-B to the origin), which can be passed back in as axis next time.
+# The axis is None if they intersect.
+# If the axis passed in still separates the shapes, that's returned straight away, and the
+# distance is only a lower bound.
+#
+def GJK_closed_form(poly_A, poly_B, axis=None, epsilon=1e-6, max_iterations=12):
+    if axis is None:
+        p = support_point_fast((1.0, 1.0, 1.0), poly_A, poly_B)
+    else:
+        #if the point of A-B furthest back along the old axis is still in front of the origin, the axis still separates them
+        p = support_point_fast((-axis[0], -axis[1], -axis[2]), poly_A, poly_B)
+        separation = dot(p, axis)
+        if separation > 0:
+            return False, separation / m.sqrt(dot(axis, axis)), axis
+    simplex = [p]
+
+    for i in range(max_iterations):
+        next = support_point_fast((-p[0], -p[1], -p[2]), poly_A, poly_B)
+        dp = dot(p, p) - dot(next, p)
+
+        if dp < epsilon * epsilon:
+            return False, m.sqrt(dot(p, p)), p
+
+        simplex.append(next)
+        p, simplex = closest_on_simplex(simplex)
+
+        if dot(p, p) < epsilon * epsilon:
+            return True, 0., None
+
+    return False, m.sqrt(dot(p, p)), p
@@ -0,0 +1,92 @@
+"""
+Compare ray throughput of the octree and the BVH on the level
+Run from anywhere with: python benchmarks/bench_accel.py
+"""
+import os
+import sys
+import time
+import random as r
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame as p
+p.font.init()
+
+import global_values as g
+import models
+
+RAY_COUNT = 2000
+SEED = 100
+
+def get_rays(model_instance:models.ModelInstance, count:int) -> list[tuple[p.Vector3, p.Vector3]]:
+    """
+    Random rays starting near the level's vertices, so most of them start inside the cave
+    """
+    r.seed(SEED)
+    rays = []
+    for i in range(count):
+        vertex = model_instance.transformed_vertex_array[r.randrange(len(model_instance.transformed_vertex_array))]
+        origin = p.Vector3(vertex[0], vertex[1], vertex[2]) + p.Vector3(r.uniform(-2,2), r.uniform(-2,2), r.uniform(-2,2))
+        direction = p.Vector3(r.uniform(-1,1), r.uniform(-1,1), r.uniform(-1,1))
+        rays.append( (origin, direction) )
+    return rays
+
+def time_rays(model_instance:models.ModelInstance, rays) -> tuple[float, list]:
+    """
+    Shoot every ray at one instance, returns the time taken and the results
+    """
+    #only test against this instance, rays find instances through the broad phase so the others are taken out of it while timing
+    others = [other for other in g.model_instances if other is not model_instance]
+    for other in others:
+        g.spatial_hash.remove(other)
+
+    results = []
+    start = time.perf_counter()
+    for origin, direction in rays:
+        ray = models.Ray(origin.x, origin.y, origin.z, direction, max_dist=1000)
+        results.append(ray.res is not None and ray.xyz)
+    elapsed = time.perf_counter() - start
+
+    for other in others:
+        g.spatial_hash.insert(other)
+    return elapsed, results
+
+def main():
+    level_model = models.load('level.ply')
+    #time building the trees, not loading them from the accel cache or moving the bvh that comes with the model file
+    level_model.cache_key = None
+    level_model.bvh = None
+
+    octree_level = models.ModelInstance((15, -10, 20), 'level', octree_depth=4)
+    bvh_level = models.ModelInstance((15, -10, 20), 'level', accel='bvh')
+
+    start = time.perf_counter()
+    octree_level.generate_AABB()
+    octree_build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bvh_level.generate_BVH()
+    bvh_build = time.perf_counter() - start
+
+    rays = get_rays(octree_level, RAY_COUNT)
+
+    octree_time, octree_results = time_rays(octree_level, rays)
+    bvh_time, bvh_results = time_rays(bvh_level, rays)
+
+    mismatches = 0
+    for a, b in zip(octree_results, bvh_results):
+        if bool(a) != bool(b) or (a and (a - b).magnitude() > 1e-6):
+            mismatches += 1
+
+    print(f'{len(octree_level.faces)} faces, {RAY_COUNT} rays')
+    print(f'octree: build {octree_build*1000:.1f}ms, {RAY_COUNT/octree_time:.0f} rays/s')
+    print(f'bvh:    build {bvh_build*1000:.1f}ms, {RAY_COUNT/bvh_time:.0f} rays/s ({len(bvh_level.bvh.node_lb)} nodes)')
+    print(f'speedup {octree_time/bvh_time:.2f}x, {mismatches} mismatched hits')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,450 @@
+"""
+Micro-benchmarks of the collision and ray primitives, each fast path timed against the code it replaced on the level
+Every fast path is also checked against its reference on the same seeded inputs, and the differences are counted
+Run from anywhere with: python benchmarks/bench_collision.py [--seed 100]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import warnings
+import math as m
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pygame as p
+p.font.init()
+import numpy as np
+
+import global_values as g
+import models
+import gameobjects
+import intersections
+import GJK
+
+LEVEL_POSITION = (15, -10, 20)
+OCTREE_DEPTH = 4
+
+RAY_COUNT = 500
+#rays and faces for the single face tests
+FACE_RAY_COUNT = 40
+FACE_COUNT = 200
+TRIANGLE_PAIR_COUNT = 5000
+GJK_PAIR_COUNT = 1000
+MOVE_COUNT = 300
+#standard deviation of each axis of a move, fast enough to go through walls, and about the player's top speed at 60fps
+FAST_MOVE_SCALE = 2.0
+PLAYER_MOVE_SCALE = 0.1
+
+def measure(function, ops:int, repeats:int=3) -> tuple[float, float, object]:
+    """
+    Time a function (best of repeats), then run it again to find the most memory it has allocated at once
+    Returns ops per second, peak KB and what the function returned
+    """
+    best = m.inf
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return ops/best, peak/1024, result
+
+def compare(name:str, ops:int, reference, fast, check) -> tuple:
+    """
+    Measure a reference and fast path, and count how many of their results check says don't match
+    """
+    reference_rate, reference_peak, reference_result = measure(reference, ops)
+    fast_rate, fast_peak, fast_result = measure(fast, ops)
+    return (name, reference_rate, fast_rate, reference_peak, fast_peak, check(reference_result, fast_result), ops)
+
+def original_colliding_ray(face:models.Face, ray:models.Ray, points:list[p.Vector3]) -> p.Vector3|None:
+    """
+    Face.colliding_ray as it was before the batched paths, so they're checked against the original behaviour rather than themselves
+    points are the instance's transformed vertices
+    """
+    edge1 = points[face.vertex_indices[1]] - points[face.vertex_indices[0]]
+    edge2 = points[face.vertex_indices[2]] - points[face.vertex_indices[0]]
+
+    h = ray.direction.cross(edge2)
+    a = edge1.dot(h)
+
+    if (a > -ray.epsilon and a < ray.epsilon):
+        return None
+
+    f = 1.0 / a
+    s = ray.origin - points[face.vertex_indices[0]]
+    u = f * s.dot(h)
+
+    if (u < 0.0 or u > 1.0):
+        return None
+
+    q = s.cross(edge1)
+    v = f * ray.direction.dot(q)
+
+    if (v < 0.0 or u + v > 1.0):
+        return None
+
+    t = f * edge2.dot(q)
+
+    if (t > ray.epsilon):
+        return ray.origin + (ray.direction * t)
+    return None
+
+def original_colliding_triangle(face:models.Face, points:list[p.Vector3], p0:p.Vector3, p1:p.Vector3, p2:p.Vector3) -> bool:
+    """
+    Face.colliding_triangle as it was before the batched paths, see original_colliding_ray
+    """
+    def get_other_index(arr):
+        epsilon = 0.000_000_001
+        if (arr[0] * arr[1]) > epsilon :
+            return 2
+        if (arr[0] * arr[2])  > epsilon :
+            return 1
+        if (arr[1] * arr[2])  > epsilon :
+            return 0
+
+        warnings.warn(f'get_other_index first check failed with {arr}, epsilon: {epsilon}')
+
+        #more precise check
+        if (arr[0] <= 0 and arr[1] <= 0 and arr[2] > 0) or (arr[0] > 0 and arr[1] > 0 and arr[2] < 0) :
+            return 2
+        if (arr[0] <= 0 and arr[2] <= 0 and arr[2] > 0) or (arr[0] > 0 and arr[2] > 0 and arr[1] < 0) :
+            return 1
+        if (arr[1] <= 0 and arr[2] <= 0 and arr[0] > 0) or (arr[1] > 0 and arr[2] > 0 and arr[0] < 0) :
+            return 0
+
+        warnings.warn(f'get_other_index second check failed!')
+
+        #just guess and hope it doesn't lead to an error, hopefully we never get here
+        return 0
+
+    def get_projection(po1, po2, po3, d0, d1, d2):
+        #project onto plane intersection line
+        proj0 = D.dot(po1)
+        proj1 = D.dot(po2)
+        proj2 = D.dot(po3)
+        i = get_other_index([d0, d1, d2])
+        proj = [proj0, proj1, proj2]
+        #rearrange vertices
+
+        if i != 0:
+            temp = proj0
+            proj[0] = proj[i]
+            proj[i] = temp
+
+            d = [d0, d1, d2]
+            temp = d0
+            d[0] = d[i]
+            d[i] = temp
+            d0, d1, d2 = d
+
+        t1 = proj[0] + (proj[1] - proj[0]) * (d0 / (d0 - d1) )
+        t2 = proj[0] + (proj[2] - proj[0]) * (d0 / (d0 - d2) )
+        return t1, t2
+
+    a0, a1, a2 = (points[i] for i in face.vertex_indices)
+
+    #check SAT
+    edge1 = a2 - a0
+    edge2 = a1 - a0
+
+    normal1 = (edge1).cross(edge2)
+    d1 = (-normal1).dot(a0)
+
+    sides1 = [normal1.dot(point) + d1 for point in (p0, p1, p2)]
+
+    #check if we are on the same side
+    if not any(sides1):
+        return False
+    if (sides1[0] < 0) and (sides1[1] < 0) and (sides1[2] < 0):
+        return False
+    if (sides1[0] > 0) and (sides1[1] > 0) and (sides1[2] > 0):
+        return False
+
+    #now the other way around
+    edge1 = p2 - p0
+    edge2 = p1 - p0
+
+    normal2 = (edge1).cross(edge2)
+    d2 = (-normal2).dot(p0)
+
+    sides2 = [normal2.dot(point) + d2 for point in (a0, a1, a2)]
+
+    #check if we are on the same side
+    if not any(sides2):
+        return False
+    if (sides2[0] < 0) and (sides2[1] < 0) and (sides2[2] < 0):
+        return False
+    if (sides2[0] > 0) and (sides2[1] > 0) and (sides2[2] > 0):
+        return False
+
+    #get intersection of planes
+    D = normal1.cross(normal2)
+
+    #triangle1
+    t1, t2 = get_projection(a0, a1, a2, *sides2)
+    #triangle2
+    t3, t4 = get_projection(p0, p1, p2, *sides1)
+
+    if t2 < t1:
+        t1, t2 = t2, t1
+    if t4 < t3:
+        t3, t4 = t4, t3
+
+    if (t1 <= t2 <= t3 <= t4) or (t3 <= t4 <= t1 <= t2):
+        return False
+
+    return True
+
+def get_points(model_instance:models.ModelInstance) -> list[p.Vector3]:
+    """
+    The transformed vertices of an instance as vectors, for the original methods
+    """
+    return [p.Vector3(vertex) for vertex in model_instance.transformed_vertex_array[:, :3].tolist()]
+
+def get_rays(rng:np.random.Generator, count:int) -> tuple[np.ndarray, np.ndarray, list[models.Ray]]:
+    """
+    Random rays starting near the level's vertices, so most of them start inside the cave
+    The Ray objects are made before any instances exist, so making them doesn't cast them
+    """
+    points = g.models['level'].point_array + np.array(LEVEL_POSITION)
+    origins = points[rng.integers(len(points), size=count)] + rng.uniform(-2, 2, (count, 3))
+    directions = rng.uniform(-1, 1, (count, 3))
+
+    rays = [models.Ray(*origin, p.Vector3(*direction), max_dist=1000) for origin, direction in zip(origins.tolist(), directions.tolist())]
+    return origins, directions, rays
+
+def bench_face_rays(rng:np.random.Generator, level:models.ModelInstance, rays:list[models.Ray]) -> tuple:
+    """
+    The original Face.colliding_ray against intersections.rays_triangles, every ray against every face
+    """
+    face_indices = rng.choice(len(level.faces), FACE_COUNT, replace=False)
+    faces = [level.faces[i] for i in face_indices.tolist()]
+    points = get_points(level)
+    rays = rays[:FACE_RAY_COUNT]
+
+    origins = np.array([[ray.origin.x, ray.origin.y, ray.origin.z] for ray in rays])
+    directions = np.array([[ray.direction.x, ray.direction.y, ray.direction.z] for ray in rays])
+    triangles = tuple(array[face_indices] for array in level.get_face_data().ray_triangles)
+
+    def reference():
+        return [[original_colliding_ray(face, ray, points) for face in faces] for ray in rays]
+
+    def fast():
+        return intersections.rays_triangles(origins, directions, triangles)
+
+    def check(reference_hits, t):
+        mismatches = 0
+        for i, ray in enumerate(rays):
+            for j, hit in enumerate(reference_hits[i]):
+                if (hit is None) != (not np.isfinite(t[i, j])):
+                    mismatches += 1
+                elif hit is not None and (hit - (ray.origin + ray.direction*t[i, j])).magnitude() > 1e-6:
+                    mismatches += 1
+        return mismatches
+
+    return compare('Face.colliding_ray', FACE_RAY_COUNT*FACE_COUNT, reference, fast, check)
+
+def bench_face_triangles(rng:np.random.Generator, level:models.ModelInstance) -> tuple:
+    """
+    The original Face.colliding_triangle against intersections.triangles_colliding, for triangles scattered around level faces
+    """
+    face_indices = rng.integers(len(level.faces), size=TRIANGLE_PAIR_COUNT)
+    face_data = level.get_face_data()
+    centres = (face_data.v0[face_indices] + face_data.v1[face_indices] + face_data.v2[face_indices]) / 3
+    #about as big as the faces, so roughly half of them touch
+    sizes = np.linalg.norm(face_data.e1[face_indices], axis=1)[:, None]
+    others = centres[:, None, :] + rng.uniform(-1, 1, (TRIANGLE_PAIR_COUNT, 3, 3))*sizes[:, None]
+
+    faces = [level.faces[i] for i in face_indices.tolist()]
+    points = get_points(level)
+    other_vectors = [tuple(p.Vector3(vertex) for vertex in triangle) for triangle in others.tolist()]
+
+    def reference():
+        return [original_colliding_triangle(face, points, *vectors) for face, vectors in zip(faces, other_vectors)]
+
+    def fast():
+        b0, b1, b2 = others[:, 0], others[:, 1], others[:, 2]
+        normals = np.cross(b1 - b0, b2 - b0)
+        planes = normals[:, 0]*b0[:, 0] + normals[:, 1]*b0[:, 1] + normals[:, 2]*b0[:, 2]
+        return intersections.triangles_colliding(face_data.get_triangles(face_indices), (b0, b1, b2, normals, planes))
+
+    def check(reference_results, colliding):
+        return int(np.count_nonzero(np.array(reference_results, dtype=bool) != colliding))
+
+    return compare('Face.colliding_triangle', TRIANGLE_PAIR_COUNT, reference, fast, check)
+
+def bench_GJK(rng:np.random.Generator) -> tuple:
+    """
+    GJK.GJK against GJK.GJK_closed_form, for a sphere and a cube at random offsets
+    """
+    sphere = g.models['sphere1'].point_array
+    cube = g.models['cube2'].point_array
+    offsets = rng.uniform(-3, 3, (GJK_PAIR_COUNT, 3))
+    pairs = [(sphere, cube + offset) for offset in offsets]
+
+    def reference():
+        return [GJK.GJK(a, b)[0] for a, b in pairs]
+
+    def fast():
+        return [GJK.GJK_closed_form(a, b)[0] for a, b in pairs]
+
+    def check(reference_results, fast_results):
+        return sum(1 for a, b in zip(reference_results, fast_results) if bool(a) != bool(b))
+
+    return compare('GJK.GJK', GJK_PAIR_COUNT, reference, fast, check)
+
+def bench_octree_rays(level:models.ModelInstance, rays:list[models.Ray]) -> tuple:
+    """
+    The recursive AABB octree against LinearOctree, for the faces each ray could hit
+    """
+    #build the old tree the way generate_AABB used to
+    root = models.AABB(level.bounding_AABB.lb, level.bounding_AABB.rt)
+    root.generate_children(0, level.octree_depth)
+    for i, face in enumerate(level.faces):
+        root.colliding_AABB_recursive(face.generate_AABB(level), i)
+
+    fracs = [(ray.origin.x, ray.origin.y, ray.origin.z,
+              1.0/ray.direction.x if ray.direction.x else 0,
+              1.0/ray.direction.y if ray.direction.y else 0,
+              1.0/ray.direction.z if ray.direction.z else 0) for ray in rays]
+
+    def reference():
+        return [root.get_faces_to_test_recursive_ray_with_frac(*frac) for frac in fracs]
+
+    def fast():
+        return [level.octree.query_ray_with_frac(*frac) for frac in fracs]
+
+    def check(reference_results, fast_results):
+        return sum(1 for a, b in zip(reference_results, fast_results) if set(a) != set(b.tolist()))
+
+    return compare('AABB.get_faces_to_test_recursive_ray_with_frac', len(rays), reference, fast, check)
+
+def check_hits(reference_results:list, hit_points:list) -> int:
+    """
+    Count the rays where one path hit and the other didn't, or they hit different places
+    """
+    mismatches = 0
+    for (face, hit), point in zip(reference_results, hit_points):
+        if (face is None) != (point is None):
+            mismatches += 1
+        elif face is not None and (hit - point).magnitude() > 1e-6:
+            mismatches += 1
+    return mismatches
+
+def bench_instance_rays(octree_level:models.ModelInstance, bvh_level:models.ModelInstance, origins:np.ndarray, directions:np.ndarray, rays:list[models.Ray]) -> list[tuple]:
+    """
+    ModelInstance.colliding_ray with the octree (the reference), against the bvh and against cast_rays
+    """
+    def reference():
+        return [octree_level.colliding_ray(ray) for ray in rays]
+
+    def bvh_rays():
+        return [bvh_level.colliding_ray(ray)[1] for ray in rays]
+
+    def batch_rays():
+        hit_points, t, ids = models.cast_rays(origins, directions, max_dist=1000)
+        return [p.Vector3(*point) if np.isfinite(distance) else None for point, distance in zip(hit_points.tolist(), t.tolist())]
+
+    return [compare('ModelInstance.colliding_ray (bvh)', len(rays), reference, bvh_rays, check_hits),
+            compare('ModelInstance.colliding_ray (cast_rays)', len(rays), reference, batch_rays, check_hits)]
+
+def bench_move(rng:np.random.Generator, model_name:str='cube2', continuous:bool=True) -> list[tuple]:
+    """
+    GameObj.move with the per face narrow phase (the reference) against the filtered and batched one,
+    and plain bisection against continuous collision, for fast moves and at the player's speed
+    Only the level should be an instance when this runs
+    """
+    start = p.Vector3(20, 0, 20)
+    fast_moves = [p.Vector3(*vec) for vec in rng.normal(0, FAST_MOVE_SCALE, (MOVE_COUNT, 3)).tolist()]
+    player_moves = [p.Vector3(*vec) for vec in rng.normal(0, PLAYER_MOVE_SCALE, (MOVE_COUNT, 3)).tolist()]
+    obj = gameobjects.GameObj(start, model_name)
+
+    def run_moves(continuous:bool=False, moves:list[p.Vector3]=fast_moves) -> list[tuple]:
+        obj.continuous_collision = continuous
+        obj.xyz = start
+        obj.update_matrices()
+        obj.update_vertex_array()
+
+        positions = []
+        for vec in moves:
+            #like a frame of the game, where update moves the loose box before the object moves
+            obj.generate_loose_AABB()
+            obj.move(vec)
+            positions.append( (tuple(obj.xyz), bool(obj.is_colliding())) )
+        return positions
+
+    def reference():
+        min_filter_pairs = intersections.MIN_FILTER_PAIRS
+        intersections.MIN_FILTER_PAIRS = m.inf
+        try:
+            return run_moves()
+        finally:
+            intersections.MIN_FILTER_PAIRS = min_filter_pairs
+
+    def check_same(reference_results, fast_results):
+        return sum(1 for a, b in zip(reference_results, fast_results) if a != b)
+
+    def check_not_colliding(reference_results, fast_results):
+        #the paths differ on purpose, so just check continuous moves never end up inside anything
+        return sum(1 for position, colliding in fast_results if colliding)
+
+    results = [compare(f'GameObj.move {model_name} (filtered narrow phase)', MOVE_COUNT, reference, run_moves, check_same)]
+    if continuous:
+        results.append(compare(f'GameObj.move {model_name} (continuous, fast)', MOVE_COUNT, run_moves, lambda: run_moves(True), check_not_colliding))
+        results.append(compare(f'GameObj.move {model_name} (continuous, player speed)', MOVE_COUNT,
+                               lambda: run_moves(False, player_moves), lambda: run_moves(True, player_moves), check_not_colliding))
+    obj.delete()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=100)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    models.load('level.ply')
+    models.load('cube2.ply', is_convex=True)
+    models.load('sphere1.ply', is_convex=True)
+    models.load('shark.ply')
+
+    origins, directions, rays = get_rays(rng, RAY_COUNT)
+
+    octree_level = models.ModelInstance(LEVEL_POSITION, 'level', octree_depth=OCTREE_DEPTH, do_convex_check=False)
+    #only tested directly, so cast_rays and moves just see the bvh level
+    octree_level.collision_groups = set()
+    bvh_level = gameobjects.GameObj(LEVEL_POSITION, 'level', accel='bvh', do_convex_check=False)
+
+    results = [
+        bench_face_rays(rng, bvh_level, rays),
+        bench_face_triangles(rng, bvh_level),
+        bench_GJK(rng),
+        bench_octree_rays(octree_level, rays),
+        *bench_instance_rays(octree_level, bvh_level, origins, directions, rays),
+    ]
+    results += bench_move(rng)
+    #enough faces for the filtered and batched tests to be used
+    results += bench_move(rng, 'shark', continuous=False)
+
+    print(f'{len(bvh_level.faces)} level faces, seed {args.seed}')
+    print(f'{"":<48}{"ops":>7}{"ref ops/s":>12}{"fast ops/s":>12}{"speedup":>9}{"ref KB":>9}{"fast KB":>9}{"mismatches":>12}')
+    for name, reference_rate, fast_rate, reference_peak, fast_peak, mismatches, ops in results:
+        print(f'{name:<48}{ops:>7}{reference_rate:>12.0f}{fast_rate:>12.0f}{fast_rate/reference_rate:>8.1f}x{reference_peak:>9.0f}{fast_peak:>9.0f}{mismatches:>12}')
+
+    #so it can be used as a check
+    if any(result[5] for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
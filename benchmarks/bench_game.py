@@ -0,0 +1,92 @@
+"""
+Play a scripted run of the game without a window and report how long frames take
+Every run with the same frames and seed plays out the same way, so timings can be compared between changes
+Run from anywhere with: python benchmarks/bench_game.py [--frames 600] [--seed 0] [--output profile.csv|trace.json]
+Sessions recorded in the game (g.RECORD_INPUT_PATH) can be played back instead with --replay session.bin
+"""
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+#sets up pygame to run without a window, so it goes first
+import headless
+import pygame as p
+
+import global_values as g
+import inputs
+
+#button centres, see main.setup
+START_BUTTON = (450, 407)
+BEAM_BUTTON = (796, 64)
+VERTICAL_SCANNER_BUTTON = (796, 116)
+HORIZONTAL_SCANNER_BUTTON = (796, 168)
+
+#(first frame, last frame, kind, value), see inputs.ScriptedInput
+TIMELINE = [
+    #start the game
+    (0, 0, 'mouse', START_BUTTON),
+    (5, 6, 'click', None),
+
+    #vertical scanner while moving forwards and turning
+    (20, 20, 'mouse', VERTICAL_SCANNER_BUTTON),
+    (22, 23, 'click', None),
+    (30, 200, 'hold', p.K_SPACE),
+    (30, 400, 'hold', p.K_w),
+    (100, 160, 'hold', p.K_LEFT),
+    (170, 190, 'motion', (3, -1)),
+
+    #horizontal scanner while strafing
+    (205, 205, 'mouse', HORIZONTAL_SCANNER_BUTTON),
+    (210, 211, 'click', None),
+    (220, 400, 'hold', p.K_SPACE),
+    (250, 300, 'hold', p.K_a),
+    (300, 340, 'hold', p.K_RIGHT),
+
+    #beam while looking up and down
+    (405, 405, 'mouse', BEAM_BUTTON),
+    (410, 411, 'click', None),
+    (420, 560, 'hold', p.K_SPACE),
+    (420, 600, 'hold', p.K_w),
+    (450, 480, 'hold', p.K_UP),
+    (500, 540, 'hold', p.K_DOWN),
+    (560, 580, 'hold', p.K_d),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the timings to a .csv, or a Chrome trace for .json')
+    parser.add_argument('--record', help='write the scripted input to an input log')
+    parser.add_argument('--replay', help='play back an input log (with its own dt and seed) instead of the script, until it ends')
+    args = parser.parse_args()
+
+    #written by headless.shutdown
+    g.PROFILE_PATH = args.output
+    g.RECORD_INPUT_PATH = args.record
+    g.REPLAY_INPUT_PATH = args.replay
+
+    clock = headless.setup(None if args.replay else inputs.ScriptedInput(TIMELINE), args.seed)
+    profile = headless.run(clock, g.inputs.length if args.replay else args.frames)
+
+    stats = profile.get_stats()
+    print(f'{profile.frame_count} frames, seed {g.SEED}')
+    print(f'{"ms per frame":<24}{"mean":>8}{"p50":>8}{"p95":>8}{"p99":>8}{"max":>8}{"calls":>8}')
+    for name, calls, mean, p50, p95, p99, max_time in stats:
+        print(f'{name:<24}{mean:>8.3f}{p50:>8.3f}{p95:>8.3f}{p99:>8.3f}{max_time:>8.3f}{calls:>8.1f}')
+
+    print(f'{"per frame":<24}{"mean":>8}{"max":>8}')
+    for name, mean, max_count in profile.get_counts():
+        print(f'{name:<24}{mean:>8.1f}{max_count:>8}')
+
+    #if this changes between runs of the same code something isn't deterministic, if it changes after a change so did gameplay
+    print('end state', headless.get_state())
+
+    headless.shutdown()
+
+if __name__ == '__main__':
+    main()
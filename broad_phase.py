@@ -0,0 +1,145 @@
+import math as m
+
+class SpatialHash():
+    """
+    Uniform grid of cells, each holding the model instances whose loose bounding box overlaps it
+    Used as a broad phase so collision checks only look at instances that are nearby
+    Instances too big to be worth splitting into cells (e.g. the level) are kept in a separate list and always returned
+    """
+    def __init__(self, cell_size:float=8, max_cells_per_axis:int=4):
+        self.cell_size = cell_size
+        self.max_cells_per_axis = max_cells_per_axis
+
+        #(x,y,z) cell -> {id: instance}
+        self.cells:dict[tuple[int,int,int], dict] = {}
+        #instances that are too big for the grid
+        self.large:dict[int, object] = {}
+
+        #id -> cell range the instance was last put in, or None if it's in large
+        self.ranges:dict[int, tuple] = {}
+        #ids are given out in order, so sorting by them gives the same order as g.model_instances
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def get_cell_range(self, lb, rt) -> tuple[int, int, int, int, int, int]:
+        """
+        Get the inclusive range of cells a box overlaps
+        """
+        size = self.cell_size
+        return (m.floor(lb[0]/size), m.floor(lb[1]/size), m.floor(lb[2]/size),
+                m.floor(rt[0]/size), m.floor(rt[1]/size), m.floor(rt[2]/size))
+
+    def get_instance_box(self, model_instance) -> tuple[tuple, tuple]:
+        """
+        The loose bounding box of an instance at its current position
+        This is the same box as loose_bounding_AABB, but doesn't rely on that having been regenerated
+        """
+        r = model_instance.bounding_radius
+        x, y, z = model_instance.x, model_instance.y, model_instance.z
+        return (x-r, y-r, z-r), (x+r, y+r, z+r)
+
+    def insert(self, model_instance):
+        """
+        Add an instance to the hash
+        """
+        model_instance.broad_phase_id = self.next_id
+        self.next_id += 1
+        self.ranges[model_instance.broad_phase_id] = None
+        self.large[model_instance.broad_phase_id] = model_instance
+        self.update(model_instance)
+
+    def remove(self, model_instance):
+        """
+        Remove an instance from the hash
+        """
+        key = model_instance.broad_phase_id
+        if key not in self.ranges:
+            return
+
+        cell_range = self.ranges.pop(key)
+        if cell_range is None:
+            del self.large[key]
+        else:
+            self.remove_from_cells(key, cell_range)
+
+    def update(self, model_instance):
+        """
+        Move an instance to the cells it's in now
+        Nothing is done if it's still in the same cells
+        """
+        key = model_instance.broad_phase_id
+        if key not in self.ranges:
+            return
+
+        lb, rt = self.get_instance_box(model_instance)
+        cell_range = self.get_cell_range(lb, rt)
+        if (cell_range[3]-cell_range[0] >= self.max_cells_per_axis or
+            cell_range[4]-cell_range[1] >= self.max_cells_per_axis or
+            cell_range[5]-cell_range[2] >= self.max_cells_per_axis):
+            cell_range = None
+
+        old_range = self.ranges[key]
+        if cell_range == old_range:
+            return
+
+        if old_range is None:
+            del self.large[key]
+        else:
+            self.remove_from_cells(key, old_range)
+
+        self.ranges[key] = cell_range
+        if cell_range is None:
+            self.large[key] = model_instance
+            return
+
+        x1, y1, z1, x2, y2, z2 = cell_range
+        for x in range(x1, x2+1):
+            for y in range(y1, y2+1):
+                for z in range(z1, z2+1):
+                    cell = self.cells.get( (x,y,z) )
+                    if cell is None:
+                        cell = self.cells[(x,y,z)] = {}
+                    cell[key] = model_instance
+
+    def remove_from_cells(self, key:int, cell_range:tuple):
+        x1, y1, z1, x2, y2, z2 = cell_range
+        for x in range(x1, x2+1):
+            for y in range(y1, y2+1):
+                for z in range(z1, z2+1):
+                    cell = self.cells[(x,y,z)]
+                    del cell[key]
+                    if not cell:
+                        del self.cells[(x,y,z)]
+
+    def query(self, lb, rt) -> list:
+        """
+        Get every instance whose cells overlap a box, in the order they were inserted
+        This can include instances that aren't actually touching the box, so a narrow phase is still needed
+        """
+        found = dict(self.large)
+
+        x1, y1, z1, x2, y2, z2 = self.get_cell_range(lb, rt)
+        cell_count = (x2-x1+1) * (y2-y1+1) * (z2-z1+1)
+        if cell_count <= len(self.cells):
+            for x in range(x1, x2+1):
+                for y in range(y1, y2+1):
+                    for z in range(z1, z2+1):
+                        cell = self.cells.get( (x,y,z) )
+                        if cell:
+                            found.update(cell)
+        else:
+            #for big boxes (like long rays) it's quicker to go through the cells that actually have something in them
+            for (x, y, z), cell in self.cells.items():
+                if x1 <= x <= x2 and y1 <= y <= y2 and z1 <= z <= z2:
+                    found.update(cell)
+
+        return [found[key] for key in sorted(found)]
+
+    def query_instance(self, model_instance) -> list:
+        """
+        Get every instance that could be colliding with an instance at its current position
+        """
+        lb, rt = self.get_instance_box(model_instance)
+        return self.query(lb, rt)
@@ -0,0 +1,352 @@
+import numpy as np
+import math as m
+
+#everything needed to rebuild a BVH without building it again
+ARRAY_NAMES = ('face_indices', 'node_lb', 'node_rt', 'node_left', 'node_right', 'node_axis', 'node_start', 'node_count')
+
+class BVH():
+    """
+    Bounding volume hierarchy built with the surface area heuristic (SAH)
+    Unlike the octree, each face is only stored in one leaf, and empty space isn't subdivided
+    Nodes are stored in flat arrays, a node is a leaf if node_left is -1, and its faces are
+    face_indices[node_start:node_start+node_count]
+    """
+    def __init__(self, face_lbs:np.ndarray, face_rts:np.ndarray, max_leaf_size:int=4, bin_count:int=12):
+        self.max_leaf_size = max_leaf_size
+        self.bin_count = bin_count
+
+        self.face_indices = np.arange(len(face_lbs), dtype=np.int64)
+
+        self.node_lb = None
+        self.node_rt = None
+        self.node_left = None
+        self.node_right = None
+        self.node_axis = None
+        self.node_start = None
+        self.node_count = None
+
+        self.triangles = None
+
+        self.build(np.asarray(face_lbs, dtype=np.float64), np.asarray(face_rts, dtype=np.float64))
+
+    def __str__(self):
+        return f'BVH {len(self.node_lb)} nodes, {len(self.face_indices)} faces'
+
+    @classmethod
+    def from_arrays(cls, arrays:dict[str, np.ndarray], max_leaf_size:int=4, bin_count:int=12) -> 'BVH':
+        """
+        Make a BVH from the arrays of one built earlier (see get_arrays), e.g. one loaded from a cache
+        """
+        tree = cls.__new__(cls)
+        tree.max_leaf_size = max_leaf_size
+        tree.bin_count = bin_count
+        for name in ARRAY_NAMES:
+            setattr(tree, name, arrays[name])
+
+        tree.triangles = None
+        tree.generate_node_lists()
+        return tree
+
+    def get_arrays(self) -> dict[str, np.ndarray]:
+        return {name:getattr(self, name) for name in ARRAY_NAMES}
+
+    def translated(self, offset) -> 'BVH':
+        """
+        Get a copy of this BVH moved by an offset, the tree itself is shared
+        Node bounds are a min/max of face bounds, and adding the offset first gives the same min/max, so the moved bounds are still tight
+        """
+        arrays = self.get_arrays()
+        offset = np.asarray(offset, dtype=np.float64)
+        arrays['node_lb'] = self.node_lb + offset
+        arrays['node_rt'] = self.node_rt + offset
+        return BVH.from_arrays(arrays, self.max_leaf_size, self.bin_count)
+
+    @staticmethod
+    def get_area(lb:np.ndarray, rt:np.ndarray) -> np.ndarray:
+        """
+        Half the surface area of boxes, which is all SAH needs
+        """
+        diff = np.maximum(rt - lb, 0)
+        return diff[..., 0]*diff[..., 1] + diff[..., 1]*diff[..., 2] + diff[..., 2]*diff[..., 0]
+
+    def find_split(self, lbs:np.ndarray, rts:np.ndarray, centroids:np.ndarray) -> tuple[float, int, np.ndarray]:
+        """
+        Find the cheapest binned SAH split for a set of faces, checking all 3 axes at once
+        Returns the cost, the axis (-1 if the faces can't be split), and a mask of the faces that go on the left
+        """
+        face_count = len(lbs)
+        bin_count = self.bin_count
+
+        cmin = centroids.min(axis=0)
+        extent = centroids.max(axis=0) - cmin
+        can_split = extent > 0
+        if not can_split.any():
+            return m.inf, -1, None
+
+        #[face, axis]
+        bins = np.minimum(((centroids - cmin) / np.where(can_split, extent, 1) * bin_count).astype(np.int64), bin_count-1)
+
+        #give every (axis, bin) pair its own key, then sort by it so each bin's bounds is one reduceat
+        keys = (bins + np.arange(3)*bin_count).T.ravel()
+        order = np.argsort(keys, kind='stable')
+        face_order = order % face_count
+
+        bin_counts = np.bincount(keys, minlength=3*bin_count)
+        used = np.flatnonzero(bin_counts)
+        bin_starts = (np.cumsum(bin_counts) - bin_counts)[used]
+
+        bin_lb = np.full( (3*bin_count, 3), np.inf)
+        bin_rt = np.full( (3*bin_count, 3), -np.inf)
+        bin_lb[used] = np.minimum.reduceat(lbs[face_order], bin_starts)
+        bin_rt[used] = np.maximum.reduceat(rts[face_order], bin_starts)
+
+        #[axis, bin]
+        bin_counts = bin_counts.reshape(3, bin_count)
+        bin_lb = bin_lb.reshape(3, bin_count, 3)
+        bin_rt = bin_rt.reshape(3, bin_count, 3)
+
+        #sweep from both sides to get the bounds of everything left/right of each split
+        left_counts = np.cumsum(bin_counts, axis=1)[:, :-1]
+        right_counts = face_count - left_counts
+        left_area = BVH.get_area(np.minimum.accumulate(bin_lb, axis=1)[:, :-1], np.maximum.accumulate(bin_rt, axis=1)[:, :-1])
+        right_area = BVH.get_area(np.minimum.accumulate(bin_lb[:, ::-1], axis=1)[:, ::-1][:, 1:], np.maximum.accumulate(bin_rt[:, ::-1], axis=1)[:, ::-1][:, 1:])
+
+        with np.errstate(invalid='ignore'):
+            costs = left_area*left_counts + right_area*right_counts
+        costs[(left_counts == 0) | (right_counts == 0) | ~can_split[:, None]] = np.inf
+
+        best = int(np.argmin(costs))
+        axis, split = divmod(best, bin_count-1)
+        if not np.isfinite(costs[axis, split]):
+            return m.inf, -1, None
+
+        return float(costs[axis, split]), axis, bins[:, axis] <= split
+
+    def build(self, face_lbs:np.ndarray, face_rts:np.ndarray):
+        """
+        Build the tree top down, using a stack instead of recursion
+        """
+        centroids = (face_lbs + face_rts) / 2
+
+        node_lb = []
+        node_rt = []
+        node_left = []
+        node_right = []
+        node_axis = []
+        node_start = []
+        node_count = []
+
+        def add_node(start, end):
+            indices = self.face_indices[start:end]
+            if len(indices):
+                node_lb.append(face_lbs[indices].min(axis=0))
+                node_rt.append(face_rts[indices].max(axis=0))
+            else:
+                node_lb.append(np.zeros(3))
+                node_rt.append(np.zeros(3))
+            node_left.append(-1)
+            node_right.append(-1)
+            node_axis.append(0)
+            node_start.append(start)
+            node_count.append(end-start)
+            return len(node_lb)-1
+
+        stack = [(add_node(0, len(self.face_indices)), 0, len(self.face_indices))]
+        while stack:
+            node, start, end = stack.pop()
+            count = end-start
+            if count <= self.max_leaf_size:
+                continue
+
+            indices = self.face_indices[start:end]
+            cost, axis, mask = self.find_split(face_lbs[indices], face_rts[indices], centroids[indices])
+
+            #only split if it's cheaper than testing every face here
+            leaf_cost = count * BVH.get_area(node_lb[node], node_rt[node])
+            if axis == -1 or cost >= leaf_cost:
+                continue
+
+            self.face_indices[start:end] = np.concatenate([indices[mask], indices[~mask]])
+            middle = start + int(mask.sum())
+
+            left = add_node(start, middle)
+            right = add_node(middle, end)
+            node_left[node] = left
+            node_right[node] = right
+            node_axis[node] = axis
+            node_count[node] = 0
+
+            stack.append( (left, start, middle) )
+            stack.append( (right, middle, end) )
+
+        self.node_lb = np.array(node_lb, dtype=np.float64).reshape(-1, 3)
+        self.node_rt = np.array(node_rt, dtype=np.float64).reshape(-1, 3)
+        self.node_left = np.array(node_left, dtype=np.int64)
+        self.node_right = np.array(node_right, dtype=np.int64)
+        self.node_axis = np.array(node_axis, dtype=np.int64)
+        self.node_start = np.array(node_start, dtype=np.int64)
+        self.node_count = np.array(node_count, dtype=np.int64)
+
+        self.generate_node_lists()
+
+    def generate_node_lists(self):
+        """
+        Traversal is done one node at a time, where plain python values are much quicker than numpy
+        """
+        self.node_list = list(zip(self.node_lb.tolist(), self.node_rt.tolist(), self.node_left.tolist(), self.node_right.tolist(),
+                                  self.node_axis.tolist(), self.node_start.tolist(), self.node_count.tolist()))
+        self.face_index_list = self.face_indices.tolist()
+
+    def set_triangles(self, v0:np.ndarray, e1:np.ndarray, e2:np.ndarray):
+        """
+        Store the triangle data used for ray traversal, in leaf order
+        """
+        self.triangles = [tuple(v0[i]) + tuple(e1[i]) + tuple(e2[i]) for i in range(len(v0))]
+        self.triangles = [self.triangles[i] for i in self.face_index_list]
+
+    def query_AABB(self, lb, rt) -> np.ndarray:
+        """
+        Get the face indices a box could be colliding with
+        """
+        lbx, lby, lbz = lb[0], lb[1], lb[2]
+        rtx, rty, rtz = rt[0], rt[1], rt[2]
+
+        faces = []
+        stack = [0]
+        while stack:
+            node_lb, node_rt, left, right, axis, start, count = self.node_list[stack.pop()]
+
+            if (node_lb[0] > rtx or node_rt[0] < lbx or
+                node_lb[1] > rty or node_rt[1] < lby or
+                node_lb[2] > rtz or node_rt[2] < lbz):
+                continue
+
+            if left == -1:
+                faces.extend(self.face_index_list[start:start+count])
+            else:
+                stack.append(left)
+                stack.append(right)
+
+        return np.array(faces, dtype=np.int64)
+
+    def query_rays(self, origins:np.ndarray, directions:np.ndarray, max_t:float=m.inf) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get every (ray, face) pair that could be hitting, for a batch of (N,3) rays
+        The whole batch goes down the tree together, one level of (ray, node) pairs at a time
+        Returns the ray indices and face indices of the pairs
+        """
+        #avoid inf*0 giving nan in the slab test, like closest_ray
+        fracs = 1.0/np.where(directions == 0, 1e-30, directions)
+
+        rays = np.arange(len(origins), dtype=np.int64)
+        nodes = np.zeros(len(origins), dtype=np.int64)
+
+        ray_parts = []
+        face_parts = []
+        while len(rays):
+            ray_origins = origins[rays]
+            ray_fracs = fracs[rays]
+            t1 = (self.node_lb[nodes] - ray_origins)*ray_fracs
+            t2 = (self.node_rt[nodes] - ray_origins)*ray_fracs
+
+            tmin = np.minimum(t1, t2).max(axis=1)
+            tmax = np.maximum(t1, t2).min(axis=1)
+
+            hit = (tmax >= 0) & (tmin <= tmax) & (tmin <= max_t)
+            rays = rays[hit]
+            nodes = nodes[hit]
+
+            #leaves give their faces
+            leaf = self.node_left[nodes] == -1
+            starts = self.node_start[nodes[leaf]]
+            counts = self.node_count[nodes[leaf]]
+            local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            ray_parts.append(np.repeat(rays[leaf], counts))
+            face_parts.append(self.face_indices[np.repeat(starts, counts) + local])
+
+            #everything else goes on to both children
+            rays = rays[~leaf]
+            nodes = nodes[~leaf]
+            rays = np.concatenate([rays, rays])
+            nodes = np.concatenate([self.node_left[nodes], self.node_right[nodes]])
+
+        if not ray_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(ray_parts), np.concatenate(face_parts)
+
+    def closest_ray(self, ox:float, oy:float, oz:float, dx:float, dy:float, dz:float, max_t:float=m.inf, epsilon:float=1e-6) -> tuple[float, int]:
+        """
+        Find the closest face hit by a ray, using Moller-Trumbore on the leaves
+        Nodes further away than the closest hit so far are skipped
+        Returns the distance along the ray and the face index, or (inf, -1) if nothing was hit
+        """
+        #avoid inf*0 giving nan in the slab test
+        big = 1e30
+        fx = 1.0/dx if dx else big
+        fy = 1.0/dy if dy else big
+        fz = 1.0/dz if dz else big
+        direction = (dx, dy, dz)
+
+        best_t = max_t
+        best_i = -1
+
+        stack = [0]
+        while stack:
+            node_lb, node_rt, left, right, axis, start, count = self.node_list[stack.pop()]
+
+            t1 = (node_lb[0] - ox)*fx
+            t2 = (node_rt[0] - ox)*fx
+            t3 = (node_lb[1] - oy)*fy
+            t4 = (node_rt[1] - oy)*fy
+            t5 = (node_lb[2] - oz)*fz
+            t6 = (node_rt[2] - oz)*fz
+
+            tmin = max(min(t1, t2), min(t3, t4), min(t5, t6))
+            tmax = min(max(t1, t2), max(t3, t4), max(t5, t6))
+
+            if tmax < 0 or tmin > tmax or tmin > best_t:
+                continue
+
+            if left != -1:
+                #visit the near child first, so the far one can be skipped more often
+                if direction[axis] > 0:
+                    stack.append(right)
+                    stack.append(left)
+                else:
+                    stack.append(left)
+                    stack.append(right)
+                continue
+
+            for i in range(start, start+count):
+                v0x, v0y, v0z, e1x, e1y, e1z, e2x, e2y, e2z = self.triangles[i]
+
+                hx = dy*e2z - dz*e2y
+                hy = dz*e2x - dx*e2z
+                hz = dx*e2y - dy*e2x
+                a = e1x*hx + e1y*hy + e1z*hz
+                if -epsilon < a < epsilon:
+                    continue
+
+                f = 1.0/a
+                sx = ox - v0x
+                sy = oy - v0y
+                sz = oz - v0z
+                u = f*(sx*hx + sy*hy + sz*hz)
+                if u < 0.0 or u > 1.0:
+                    continue
+
+                qx = sy*e1z - sz*e1y
+                qy = sz*e1x - sx*e1z
+                qz = sx*e1y - sy*e1x
+                v = f*(dx*qx + dy*qy + dz*qz)
+                if v < 0.0 or u + v > 1.0:
+                    continue
+
+                t = f*(e2x*qx + e2y*qy + e2z*qz)
+                if epsilon < t < best_t:
+                    best_t = t
+                    best_i = self.face_index_list[i]
+
+        if best_i == -1:
+            return m.inf, -1
+        return best_t, best_i
@@ -5,6 +5,9 @@ import warnings
 
 import global_values as g
 import models
+import transforms
+import gfx
+import profiler
 
 class Camera(p.Vector3):
     def __init__(self) -> None:
@@ -16,17 +19,30 @@ class Camera(p.Vector3):
         self.near = 400
 
 
-        self.draw_points = [models.Point(0,0,0) for i in range( 2000 )]
+        #screen space points waiting to be drawn, x and y are in viewport pixels and z is depth
+        self.draw_positions = np.zeros( (2000, 3) )
+        self.draw_colours = np.zeros( (len(self.draw_positions), 3), dtype=np.uint8)
         self.draw_i = 0
+        #reused by project_points for the homogeneous coordinates
+        self.projection_buffer = np.ones( (len(self.draw_positions), 4) )
 
-        self.draw_lines = [(0,0) for i in range(1000)]
+        #pairs of indices into draw_positions
+        self.draw_lines = np.zeros( (1000, 2), dtype=np.int64)
         self.draw_line_i = 0
 
-        self.s_mat_translation = None
-        self.s_mat_rotation = None
-        self.s_mat_projection = None
-        self.s_mat_full = None
-        self.s_mat_full_inv = None
+        #(size, r, g, b) -> solid square surface, so points can all be blitted in one call
+        self.splats:dict[tuple, p.Surface] = {}
+
+        #how points are drawn, 'blit' blits a square per point in draw order,
+        #'splat' writes them all straight into the viewport's pixels, with nearer points on top
+        self.point_renderer = 'blit'
+        #depth order of the point covering each viewport pixel, used by the splat renderer
+        self.depth_buffer:np.ndarray = None
+
+        #full view matrix and its inverse, reused between frames
+        self.transform = transforms.CameraTransform()
+        self.s_mat_full:np.ndarray = self.transform.matrix
+        self.s_mat_full_inv:np.ndarray = self.transform.inverse
         self.update_matrices()
 
         super().__init__(5,0,-15)
@@ -43,16 +59,14 @@ class Camera(p.Vector3):
         return new_point
 
     def draw_point(self, point:models.Point):
-        if self.draw_i >= len(self.draw_points):
+        if self.draw_i >= len(self.draw_positions):
             return
         
-        if point.delete_timestamp * (point.delete_timestamp - p.time.get_ticks()) < 0:
+        if point.delete_timestamp * (point.delete_timestamp - g.get_ticks()) < 0:
             return
 
-        self.draw_points[self.draw_i].xyz = point.xyz
-        self.draw_points[self.draw_i].colour = point.colour
-
-        self.draw_points[self.draw_i].delete_timestamp = point.delete_timestamp
+        self.draw_positions[self.draw_i] = (point.x, point.y, point.z)
+        self.draw_colours[self.draw_i] = gfx.get_rgb(point.colour)
 
         self.draw_i += 1
 
@@ -60,23 +74,43 @@ class Camera(p.Vector3):
         """
         Combines projecting and drawing into one function to improve performance
         """
-        if self.draw_i >= len(self.draw_points):
-            return
-        
-        if point.delete_timestamp * (point.delete_timestamp - p.time.get_ticks()) < 0:
-            return
+        self.project_points(np.array([[point.x, point.y, point.z]]), [point.colour], np.array([point.delete_timestamp]))
 
-        projected = np.array([point.x, point.y, point.z, 1.0])
-        self.s_mat_full.dot(projected, out=projected)
-
-        self.draw_points[self.draw_i].x = (projected[0]/projected[3]) + g.viewport.half_w
-        self.draw_points[self.draw_i].y = (projected[1]/projected[3]) + g.viewport.half_h
-        self.draw_points[self.draw_i].z = (projected[2]/projected[3]) 
-
-        self.draw_points[self.draw_i].colour = point.colour
-        self.draw_points[self.draw_i].delete_timestamp = point.delete_timestamp
-
-        self.draw_i += 1
+    def project_points(self, positions:np.ndarray, colours, delete_timestamps:np.ndarray=None):
+        """
+        Project an (N,3) array of world points and record that we want to draw them, the batched version of project_and_draw_point
+        colours can be an (N,3) array of rgb values or a list of anything pygame accepts as a colour
+        Points whose delete timestamp has passed are skipped
+        """
+        with profiler.timer('projection'):
+            if not isinstance(colours, np.ndarray):
+                colours = np.array([gfx.get_rgb(colour) for colour in colours], dtype=np.uint8).reshape(-1, 3)
+
+            if delete_timestamps is not None:
+                current_time = g.get_ticks()
+                visible = delete_timestamps * (delete_timestamps - current_time) >= 0
+                if not visible.all():
+                    positions = positions[visible]
+                    colours = colours[visible]
+
+            count = min(len(positions), len(self.draw_positions) - self.draw_i)
+            if count <= 0:
+                return
+
+            projected = self.projection_buffer[:count]
+            projected[:, :3] = positions[:count]
+            projected[:, 3] = 1.0
+            np.matmul(projected, self.s_mat_full.T, out=projected)
+
+            start = self.draw_i
+            end = start + count
+            np.divide(projected[:, :3], projected[:, 3:], out=self.draw_positions[start:end])
+            self.draw_positions[start:end, 0] += g.viewport.half_w
+            self.draw_positions[start:end, 1] += g.viewport.half_h
+
+            self.draw_colours[start:end] = colours[:count]
+            self.draw_i = end
+            profiler.count('points projected', count)
 
     def draw_line(self, si:int, ei:int, mi:int):
         """
@@ -85,19 +119,28 @@ class Camera(p.Vector3):
         if self.draw_line_i >= len(self.draw_lines):
             return
 
-        line = (mi+ si, mi + ei)
-
-        self.draw_lines[self.draw_line_i] = line
+        self.draw_lines[self.draw_line_i] = (mi+ si, mi + ei)
         self.draw_line_i += 1
 
+    def draw_lines_array(self, line_indices:np.ndarray, mi:int):
+        """
+        Record that we want to draw an (N,2) array of lines, the batched version of draw_line
+        """
+        count = min(len(line_indices), len(self.draw_lines) - self.draw_line_i)
+        if count <= 0:
+            return
+
+        self.draw_lines[self.draw_line_i:self.draw_line_i+count] = line_indices[:count] + mi
+        self.draw_line_i += count
+
     def draw_model_instance(self, model_instance:models.ModelInstance):
         """
         Record that we want to draw an instance of a model
         """
 
         #check if we are going over limit
-        if self.draw_i + len(model_instance.points) > len(self.draw_points):
-            warnings.warn(f'Warning: drawing {model_instance.model.name} goes over point limit { len(self.draw_points) } ({self.draw_i + len(model_instance.points)})')
+        if self.draw_i + len(model_instance.points) > len(self.draw_positions):
+            warnings.warn(f'Warning: drawing {model_instance.model.name} goes over point limit { len(self.draw_positions) } ({self.draw_i + len(model_instance.points)})')
             return
         if self.draw_line_i + (len(model_instance.faces)*3) > len(self.draw_lines):
             warnings.warn(f'Warning: drawing {model_instance.model.name} goes over line limit { len(self.draw_lines) } ({self.draw_line_i + (len(model_instance.faces)*3)})')
@@ -107,12 +150,7 @@ class Camera(p.Vector3):
 
         starting_draw_index = self.draw_i
 
-        projected = np.array([1.0, 1.0, 1.0, 1.0])
-
-        for i in range(len(model.points)):
-            self.s_mat_full.dot(model_instance.transformed_vertex_array[i], out=projected)
-            projected_point = models.Point(projected[0]/projected[3] +  (g.viewport.half_w), projected[1]/projected[3] + (g.viewport.half_h), projected[2]/projected[3], model.points[i].colour)
-            self.draw_point(projected_point)
+        self.project_points(model_instance.transformed_vertex_array[:, :3], model.get_point_colours())
 
 
         #for point in model.points:
@@ -120,42 +158,146 @@ class Camera(p.Vector3):
         #    projected_point = models.Point(projected[0]/projected[3] + (g.WIDTH/2), projected[1]/projected[3] + (g.HEIGHT/2), projected[2]/projected[3], point.colour)
         #    self.draw_point(projected_point)
         
-        for face in model.faces:
-            for line_indices in face.line_index_pairs:
-                if self.draw_points[line_indices[0]+starting_draw_index].z >= 0 and self.draw_points[line_indices[1]+starting_draw_index].z >= 0:
-                    self.draw_line(line_indices[0], line_indices[1], starting_draw_index)
+        #only lines with both ends in front of the camera
+        line_indices = model.face_array[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+        depths = self.draw_positions[starting_draw_index:starting_draw_index+len(model.points), 2]
+        in_front = (depths[line_indices[:, 0]] >= 0) & (depths[line_indices[:, 1]] >= 0)
+        self.draw_lines_array(line_indices[in_front], starting_draw_index)
 
 
-    def finish_draw(self):
-        rect = p.Rect(0,0,1,1)
-        for i,point in enumerate(self.draw_points):
-            if i < self.draw_i:
-                if point[2] <= 0.01 :
-                    continue
+    def get_splat(self, size:int, red:int, green:int, blue:int) -> p.Surface:
+        """
+        Get a solid square for drawing a point
+        """
+        key = (size, red, green, blue)
+        splat = self.splats.get(key)
+        if splat is None:
+            splat = p.Surface( (size, size) )
+            splat.fill( (red, green, blue) )
+            self.splats[key] = splat
+        return splat
+
+    def get_point_rects(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the on screen squares for the points waiting to be drawn, the same squares p.Rect would give
+        Returns the indices of the visible points and their x, y and size
+        """
+        positions = self.draw_positions[:self.draw_i]
+
+        with np.errstate(invalid='ignore'):
+            #rects truncate, and the centre is set with integer division
+            sizes = np.trunc((0.02*positions[:, 2])*2)
+            xs = np.trunc(positions[:, 0] + g.viewport.x)
+            ys = np.trunc(positions[:, 1] + g.viewport.y)
+
+            #behind the near plane, too small to see or off the screen
+            visible = (positions[:, 2] > 0.01) & (sizes >= 1) & np.isfinite(xs) & np.isfinite(ys)
+            visible &= (xs + sizes >= 0) & (ys + sizes >= 0) & (xs - sizes < g.WIDTH) & (ys - sizes < g.HEIGHT)
+
+        indices = np.flatnonzero(visible)
+        sizes = sizes[indices].astype(np.int64)
+        xs = xs[indices].astype(np.int64) - sizes//2
+        ys = ys[indices].astype(np.int64) - sizes//2
+        return indices, xs, ys, sizes
+
+    def get_line_ends(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the screen space ends of the lines waiting to be drawn, skipping any that aren't finite (like Point.is_finite)
+        """
+        max_mag = 10_000
+        lines = self.draw_lines[:self.draw_line_i]
+        starts = self.draw_positions[lines[:, 0]] + (g.viewport.x, g.viewport.y, 0)
+        ends = self.draw_positions[lines[:, 1]] + (g.viewport.x, g.viewport.y, 0)
+
+        with np.errstate(invalid='ignore', over='ignore'):
+            finite = ~(np.isinf(starts).any(axis=1) | (np.linalg.norm(starts, axis=1) >= max_mag) |
+                       np.isinf(ends).any(axis=1) | (np.linalg.norm(ends, axis=1) >= max_mag))
+        return starts[finite, :2], ends[finite, :2]
+
+    def blit_points(self):
+        """
+        Draw the points as squares, later points go on top, as they did when drawn one at a time
+        """
+        #p.draw.circle(g.screen, colour, (point[0], point[1]), 0.02*point[2] )
+        indices, xs, ys, sizes = self.get_point_rects()
+        colours = self.draw_colours[indices]
+
+        g.screen.fblits([(self.get_splat(size, *colour), (x, y)) for x, y, size, colour
+                         in zip(xs.tolist(), ys.tolist(), sizes.tolist(), colours.tolist())])
 
+    def splat_points(self):
+        """
+        Draw the points as squares by writing straight into the viewport's pixels, all in one go
+        A z-buffer makes sure nearer points (larger z) go on top
+        """
+        indices, xs, ys, sizes = self.get_point_rects()
+        if not len(indices):
+            return
 
-                #p.draw.circle(g.screen, point.colour, (point[0], point[1]), 0.02*point[2] )
-                
-                rect.w = (0.02*point[2])*2
-                rect.h = (0.02*point[2])*2
-                rect.center = (point[0] + g.viewport.x, point[1] + g.viewport.y)
+        rect = g.viewport.rect
+        if self.depth_buffer is None or self.depth_buffer.shape != (rect.w, rect.h):
+            self.depth_buffer = np.empty( (rect.w, rect.h), dtype=np.int32)
+        self.depth_buffer.fill(-1)
+
+        #rank the points by depth, ties go to whichever was drawn later
+        point_count = len(indices)
+        order = np.lexsort( (indices, self.draw_positions[indices, 2]) )
+        ranks = np.empty(point_count, dtype=np.int32)
+        ranks[order] = np.arange(point_count, dtype=np.int32)
+
+        xs = xs - rect.x
+        ys = ys - rect.y
+
+        #every pixel of every square, one size at a time so each group is a simple broadcast
+        all_px = []
+        all_py = []
+        all_owners = []
+        for size in np.unique(sizes).tolist():
+            group = np.flatnonzero(sizes == size)
+            offsets = np.arange(size)
+            shape = (len(group), size, size)
+            all_px.append(np.broadcast_to(xs[group, None, None] + offsets[None, :, None], shape).ravel())
+            all_py.append(np.broadcast_to(ys[group, None, None] + offsets[None, None, :], shape).ravel())
+            all_owners.append(np.repeat(group, size*size))
+
+        px = np.concatenate(all_px)
+        py = np.concatenate(all_py)
+        owners = np.concatenate(all_owners)
+
+        inside = (px >= 0) & (px < rect.w) & (py >= 0) & (py < rect.h)
+        px = px[inside]
+        py = py[inside]
+        owners = owners[inside]
+
+        #keep the nearest point for each pixel
+        pixel_ranks = ranks[owners]
+        np.maximum.at(self.depth_buffer, (px, py), pixel_ranks)
+        nearest = self.depth_buffer[px, py] == pixel_ranks
+
+        #colours in the screen's pixel format
+        mapped = p.surfarray.map_array(g.screen, self.draw_colours[indices][None])[0]
+
+        pixels = p.surfarray.pixels2d(g.screen.subsurface(rect))
+        pixels[px[nearest], py[nearest]] = mapped[owners[nearest]]
+        del pixels
 
-                p.draw.rect(g.screen, point.colour, rect)
+    def finish_draw(self):
+        with profiler.timer('draw points'):
+            if self.point_renderer == 'splat':
+                self.splat_points()
             else:
-                break
+                self.blit_points()
         self.draw_i = 0
         
-        for i,indices in enumerate(self.draw_lines):
-            if i < self.draw_line_i:
-                start = self.draw_points[indices[0]] + g.viewport.vec
-                end = self.draw_points[indices[1]] + g.viewport.vec
-
-                if not start.is_finite() or not end.is_finite():
-                    continue
-                p.draw.line(g.screen, 'white', (start.x, start.y), (end.x, end.y), 2)
-            else:
-                break
-                
+        #lines that carry on from the one before (like the edges of a face) are drawn together as one polyline
+        starts, ends = self.get_line_ends()
+        breaks = (np.flatnonzero((starts[1:] != ends[:-1]).any(axis=1)) + 1).tolist()
+        starts = starts.tolist()
+        ends = ends.tolist()
+        for run_start, run_end in zip([0] + breaks, breaks + [len(starts)]):
+            if run_end > run_start:
+                p.draw.lines(g.screen, 'white', False, [starts[run_start]] + ends[run_start:run_end], 2)
+
         self.draw_line_i = 0
 
 
@@ -251,13 +393,26 @@ class Camera(p.Vector3):
         #unprojected = unprojected * vec.z
 
         unprojected = self.s_mat_full_inv.dot(  np.array([unprojected.x, unprojected.y, unprojected.z, 1.0]) )
-        unprojected_vec = p.Vector3(unprojected[0,0], unprojected[0,1], unprojected[0,2])
+        unprojected_vec = p.Vector3(unprojected[0], unprojected[1], unprojected[2])
 
-        w = 1/unprojected[0,3]
+        w = 1/unprojected[3]
         unprojected_vec *= w
 
         return unprojected_vec
 
+    def get_unprojected_array(self, vecs:np.ndarray) -> np.ndarray:
+        """
+        Unproject an (N,3) array of screen points in one go, the batched version of get_unprojected
+        """
+        unprojected = np.ones( (len(vecs), 4) )
+        unprojected[:, :3] = vecs
+        unprojected[:, 0] -= g.WIDTH/2
+        unprojected[:, 1] -= g.HEIGHT/2
+
+        unprojected = unprojected @ self.s_mat_full_inv.T
+
+        return unprojected[:, :3] / unprojected[:, 3:]
+
     @property
     def mat_rotate_x(self):
         mat_rotate_x = np.matrix([
@@ -292,12 +447,11 @@ class Camera(p.Vector3):
         """
         Update view matrices
         """
-        self.s_translation = self.mat_translation
-        self.s_mat_rotation= self.mat_rotate_x*self.mat_rotate_y*self.mat_rotate_z
-        self.s_mat_projection = self.mat_projection
-
-        self.s_mat_full = self.s_mat_projection * self.s_mat_rotation * self.s_translation
-        self.s_mat_full_inv = np.linalg.inv(self.s_mat_full)
+        #same as mat_projection * mat_rotate_x * mat_rotate_y * mat_rotate_z * mat_translation
+        #only recalculated if we have moved or turned
+        self.transform.update(self.ax, self.ay, self.az, self.x, self.y, self.z, self.near, self.far)
+        self.s_mat_full = self.transform.matrix
+        self.s_mat_full_inv = self.transform.inverse
 
         #right
         #r = 1#g.WIDTH/2
@@ -1,5 +1,6 @@
 import pygame as p
 import pygame.gfxdraw as pg
+import numpy as np
 import math as m
 
 import global_values as g
@@ -53,7 +54,7 @@ class Overlay(Control):
         surf = p.Surface((rect.w, rect.h))
         surf.fill(colour)
         
-        self.start_timestamp = p.time.get_ticks()
+        self.start_timestamp = g.get_ticks()
         self.time = time
 
         self.start_alpha = start_alpha
@@ -68,7 +69,7 @@ class Overlay(Control):
         
     def update(self):
         super().update()
-        frac = (p.time.get_ticks() - self.start_timestamp)/(self.time*1000)
+        frac = (g.get_ticks() - self.start_timestamp)/(self.time*1000)
         if frac >= 1:
             self.delete()
         else:
@@ -419,10 +420,10 @@ class TutorialManager():
             self.state = self.states[i]
 
         self.dirty_state = True
-        self.state_change_timestamp = p.time.get_ticks()
+        self.state_change_timestamp = g.get_ticks()
 
     def time_since_state_change(self) -> float:
-        return (p.time.get_ticks() - self.state_change_timestamp)/1000
+        return (g.get_ticks() - self.state_change_timestamp)/1000
 
     def reset(self):
         self.state = self.states[0]
@@ -516,7 +517,7 @@ class InfoBox(TextBox):
 
     @info.setter
     def info(self, val:str):
-        self.new_info_timestamp = p.time.get_ticks()
+        self.new_info_timestamp = g.get_ticks()
         self._info = val
         if 'main' in g.states:
             sounds.play_sound('info_notification')
@@ -526,7 +527,7 @@ class InfoBox(TextBox):
         """
         How many characters of the current info are being displayed
         """
-        time_diff = (p.time.get_ticks() - self.new_info_timestamp)/1000
+        time_diff = (g.get_ticks() - self.new_info_timestamp)/1000
         chars = min(len(self.info), int(time_diff*self.info_reveal_speed) )
 
         if chars != self.old_char_count:
@@ -583,6 +584,50 @@ class TwoState(Control):
     def surf(self, val):
         pass
 
+class ProfilerOverlay(Control):
+    """
+    Shows the rolling frame time percentiles of g.profiler, and which point renderer is being used (F3 switches it)
+    Only redrawn every so often, so it doesn't show up in the timings much itself
+    """
+    def __init__(self, rect:p.Rect, refresh_time:float=0.5, **kwargs):
+        self.font = g.fonts['profiler']
+        self.line_h = self.font.get_linesize()
+        #right edge of each number column, measured so it still lines up if the font isn't monospaced
+        self.name_w = self.font.size('M'*15)[0]
+        self.column_w = self.font.size('00000.00')[0]
+        self.refresh_time = refresh_time
+        self.last_refresh = -m.inf
+
+        super().__init__(rect, p.Surface((rect.w, rect.h), p.SRCALPHA), visible=False, **kwargs)
+
+    def refresh(self):
+        """
+        Render the table of timings again
+        """
+        rows = [(f'points: {g.camera.point_renderer}', '', '', '', ''), ('ms', 'p50', 'p95', 'p99', 'calls')]
+        for name, calls, mean, p50, p95, p99, max_time in g.profiler.get_stats():
+            rows.append( (name, f'{p50:.2f}', f'{p95:.2f}', f'{p99:.2f}', f'{calls:.1f}') )
+
+        rows = rows[:(self.rect.h-8) // self.line_h]
+        self.surf.fill((0, 0, 0, 0))
+        self.surf.fill((0, 0, 0, 160), (0, 0, self.name_w + self.column_w*4 + 8, len(rows)*self.line_h + 8))
+
+        y = 4
+        for name, *values in rows:
+            self.surf.blit(self.font.render(name, False, 'white'), (4, y))
+            right = 4 + self.name_w
+            for value in values:
+                right += self.column_w
+                text = self.font.render(value, False, 'white')
+                self.surf.blit(text, (right - text.get_width(), y))
+            y += self.line_h
+
+    def update(self):
+        current_time = g.get_ticks()/1000
+        if self.visible and g.profiler and current_time - self.last_refresh >= self.refresh_time:
+            self.last_refresh = current_time
+            self.refresh()
+
 class Radar(Control):
     """
     Radar which reveals the rough location of certain objects
@@ -614,8 +659,8 @@ class Radar(Control):
 
         
     def update(self):
-        if p.time.get_ticks() - self.last_refresh >= self.refresh_cooldown:
-            self.last_refresh = p.time.get_ticks()
+        if g.get_ticks() - self.last_refresh >= self.refresh_cooldown:
+            self.last_refresh = g.get_ticks()
             self.refresh()
         return super().update()
     
@@ -623,13 +668,11 @@ class Radar(Control):
         super().draw()
 
         scale = (self.rect.w/2) / self.h_range
+        size = 4*scale #obj.bounding_radius
         for obj in self.tagged_objects:
             h_diff = p.Vector2(obj.x - g.player.x, obj.z - g.player.z)*scale
             h_diff.rotate_ip(-m.degrees(g.camera.ay))
 
-
-            size = 4*scale #obj.bounding_radius
-
             if h_diff.magnitude()+size >= self.rect.w/2 - self.padding:
                 h_diff.scale_to_length(self.rect.w/2 - size - self.padding)
 
@@ -644,19 +687,38 @@ class Radar(Control):
             pg.filled_circle(g.screen, int(dx), int(dy), int(size), colour)
 
         if g.player.selected_point_spawner:
-            spawner = g.player.selected_point_spawner
-            #todo optimise
-            for i in range(spawner.point_count):
-                point = spawner.points_list[i]
-                
-                h_diff = p.Vector2(point.x - g.player.x, point.z - g.player.z)*scale
-                
-
-                if h_diff.magnitude()+size >= self.rect.w/2 - self.padding:
-                    continue
-                
-                h_diff.rotate_ip(-m.degrees(g.camera.ay))
-                dx = int(self.rect.centerx - h_diff.x)
-                dy = int(self.rect.centery - h_diff.y)
-
-                g.screen.set_at((dx,dy), point.colour)
+            self.draw_points(g.player.selected_point_spawner.points, scale, size)
+
+    def draw_points(self, points, scale:float, size:float):
+        """
+        Draw every point in a point cloud as a single pixel, all at once
+        """
+        count = points.count
+        if not count:
+            return
+
+        h_diffs = np.empty( (count, 2) )
+        h_diffs[:, 0] = points.positions[:count, 0] - g.player.x
+        h_diffs[:, 1] = points.positions[:count, 2] - g.player.z
+        h_diffs *= scale
+
+        inside = np.hypot(h_diffs[:, 0], h_diffs[:, 1])+size < self.rect.w/2 - self.padding
+        h_diffs = h_diffs[inside]
+        colours = points.colours[:count][inside]
+
+        #same rotation as Vector2.rotate_ip
+        angle = m.radians(-m.degrees(g.camera.ay))
+        cos, sin = m.cos(angle), m.sin(angle)
+        dxs = (self.rect.centerx - (h_diffs[:, 0]*cos - h_diffs[:, 1]*sin)).astype(np.int64)
+        dys = (self.rect.centery - (h_diffs[:, 0]*sin + h_diffs[:, 1]*cos)).astype(np.int64)
+
+        on_screen = (dxs >= 0) & (dxs < g.screen.get_width()) & (dys >= 0) & (dys < g.screen.get_height())
+        if not on_screen.all():
+            dxs, dys, colours = dxs[on_screen], dys[on_screen], colours[on_screen]
+            if not len(dxs):
+                return
+
+        #later points go on top, same as drawing them one by one
+        pixels = p.surfarray.pixels2d(g.screen)
+        pixels[dxs, dys] = p.surfarray.map_array(g.screen, colours[None])[0]
+        del pixels
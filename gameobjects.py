@@ -8,6 +8,9 @@ class GameObj(models.ModelInstance):
     Base class for game objects
     """
     def __init__(self, origin:p.Vector3, model_name:str, **kwargs):
+        #sweep moves against static instances before bisecting, stops fast objects going through thin walls
+        #moves shorter than the model's inner radius end up still covering where they started, so nothing fits between and they're just bisected
+        self.continuous_collision = False
         super().__init__(origin, model_name, **kwargs)
 
     def __str__(self):
@@ -17,6 +20,16 @@ class GameObj(models.ModelInstance):
         if vec.magnitude() <= 0.000_000_1:
             return 
 
+        if self.continuous_collision and vec.magnitude() >= self.model.get_inner_radius():
+            self.move_continuous(vec)
+            return
+
+        self.move_bisect(vec)
+
+    def move_bisect(self, vec:p.Vector3):
+        """
+        Move along vec, and if that ends up colliding, step back and forth by halves to get as close as we can
+        """
         step = vec.copy()
         max_steps = 4
         start_point = p.Vector3(self)
@@ -45,6 +58,42 @@ class GameObj(models.ModelInstance):
             self.update_matrices()
             self.update_vertex_array()
 
+    def move_continuous(self, vec:p.Vector3) -> float:
+        """
+        Move as far along vec as we can without hitting anything static, then check the end position once
+        Returns the fraction of vec that was moved
+        """
+        start_point = p.Vector3(self)
+
+        fraction = self.get_time_of_impact(vec)
+        if fraction > 0:
+            self += vec*fraction
+            self.update_matrices()
+            self.update_vertex_array()
+
+        #still check, for things that aren't swept against (e.g. pickups) and contacts the sweep misses
+        if not self.is_colliding():
+            return fraction
+
+        #e.g. a grazing contact, so get as close as we can like move_bisect does, but never past fraction or we could go through a thin wall
+        low = 0.0
+        high = fraction
+        for i in range(4):
+            middle = (low + high) / 2
+            self.xyz = start_point + vec*middle
+            self.update_matrices()
+            self.update_vertex_array()
+            if self.is_colliding():
+                high = middle
+            else:
+                low = middle
+
+        if low != middle:
+            self.xyz = start_point + vec*low
+            self.update_matrices()
+            self.update_vertex_array()
+        return low
+
 
     def delete(self):
         if not self.deleted:
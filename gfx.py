@@ -9,4 +9,18 @@ def li(name:str, extension:str='png'):
     """
     surf = p.image.load(os.path.join(g.DIR_GFX, name) + '.' + extension).convert_alpha()
 
-    return surf
\ No newline at end of file
+    return surf
+
+
+#colour -> (r, g, b), looking up colour names is slow so it's only done once per colour
+rgb_cache = {}
+def get_rgb(colour) -> tuple[int, int, int]:
+    """
+    Get the rgb values of anything pygame accepts as a colour
+    """
+    key = colour if isinstance(colour, str) else tuple(colour)
+    rgb = rgb_cache.get(key)
+    if rgb is None:
+        rgb = tuple(p.Color(colour))[:3]
+        rgb_cache[key] = rgb
+    return rgb
@@ -1,6 +1,8 @@
 import os
 import pygame as p
 
+import broad_phase
+
 WIDTH, HEIGHT = 900, 500
 SCREEN_RECT = p.Rect(0,0,WIDTH,HEIGHT)
 
@@ -14,22 +16,49 @@ fullscreen = False
 
 game_clock = None
 dt = 0
+#milliseconds since the game started, replaced with a fixed step clock when running headless so runs are repeatable
+get_ticks = p.time.get_ticks
 events = []
 keys = {}
+#where handle_input gets the mouse and keyboard from (see inputs), the real ones if not set
+inputs = None
+#write every frame of input to this file, so the session can be replayed (see inputs.InputRecorder)
+RECORD_INPUT_PATH = None
+#play back an input log instead of taking input, along with its dt, ticks and seed
+REPLAY_INPUT_PATH = None
+#seed for random, picked at random if not set (and recorded with the input)
+SEED = None
 
-fonts = {'info1':p.font.SysFont('consolas', 16)}
+fonts = {'info1':p.font.SysFont('consolas', 16), 'profiler':p.font.SysFont('consolas', 12)}
 
 models = {}
 
 model_instances = []
+#broad phase for collision checks between model instances
+spatial_hash = broad_phase.SpatialHash()
 hints = []
 goal = None
 
 camera = None
 player = None
 level = None
+#size of the tiles the level is split into so only the parts near the player are loaded, 0 loads the whole level as one instance
+LEVEL_TILE_SIZE = 0
+level_tiles = None
 
 point_spawners = []
+#number of processes used to cast rays against the level, 0 casts everything in this process
+#NOTE: workers are forked where possible, otherwise they import the game again (main.py has a __main__ guard for this)
+RAY_WORKERS = 0
+ray_pool = None
+#broad_phase_id -> shared_geometry.SharedGeometry of each static instance, exported for worker processes
+shared_geometry = {}
+
+#time each part of a frame (see profiler), F4 shows the timings over the 3D view
+PROFILE = False
+#where the timings are written when the game closes, a .csv of percentiles or a .json Chrome trace of every timed block
+PROFILE_PATH = None
+profiler = None
 
 controls = []
 info_box = None
@@ -0,0 +1,78 @@
+"""
+Run the game without a window or sound, with scripted input and a fixed time step
+Used by benchmarks/bench_game.py, so runs can be repeated exactly and compared
+"""
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame as p
+p.font.init()
+
+import global_values as g
+import profiler
+import main
+
+class FixedClock():
+    """
+    Stands in for p.time.get_ticks, only moving on when step is called
+    """
+    def __init__(self, start:float=0):
+        self.ticks = start
+
+    def __call__(self) -> int:
+        return int(self.ticks)
+
+    def step(self, dt:float):
+        self.ticks += dt*1000
+
+def setup(input_source, seed:int=0) -> FixedClock:
+    """
+    Load the game with input from input_source (see inputs) and a fixed clock
+    When g.REPLAY_INPUT_PATH is set, the input, clock and seed come from that log instead
+    NOTE: the game can only be set up once per process
+    """
+    g.SEED = seed
+
+    clock = FixedClock()
+    g.get_ticks = clock
+    g.inputs = input_source
+    #timings are always collected, they're what we're here for
+    g.PROFILE = True
+
+    main.setup()
+    return clock
+
+def run(clock:FixedClock, frame_count:int, dt:float=1/60) -> profiler.Profiler:
+    """
+    Run frames with a fixed dt, stopping early if the game is closed
+    """
+    g.dt = dt
+    g.running = True
+
+    for i in range(frame_count):
+        if not g.running:
+            break
+
+        g.profiler.start_frame()
+        main.run_frame()
+        g.profiler.end_frame()
+
+        clock.step(dt)
+
+    return g.profiler
+
+def shutdown():
+    """
+    Write the timings to g.PROFILE_PATH if it's set, and stop any ray workers
+    """
+    main.shutdown()
+
+def get_state() -> tuple:
+    """
+    A summary of where the game ended up, which should be the same every run with the same input and seed
+    """
+    player = g.player
+    spawner_points = sum(point_spawner.point_count for point_spawner in g.point_spawners)
+    return (round(player.x, 4), round(player.y, 4), round(player.z, 4), player.health, round(player.power, 4), len(g.model_instances), spawner_points, tuple(sorted(g.states)))
@@ -0,0 +1,203 @@
+import pygame as p
+import struct
+
+import global_values as g
+
+class KeyState():
+    """
+    The keys held down, indexed by key code like p.key.get_pressed()
+    """
+    def __init__(self, held=()):
+        self.held = frozenset(held)
+
+    def __getitem__(self, key:int) -> bool:
+        return key in self.held
+
+
+class InputFrame():
+    """
+    Everything main.handle_input reads for one frame
+    keys is anything indexed by key code, events are pygame events (or anything with the same attributes)
+    dt is the frame's time step if it should replace g.dt (when replaying), or None
+    """
+    def __init__(self, mouse_pos=(0, 0), mouse_buttons=(False, False, False), keys=KeyState(), events=(), dt:float|None=None):
+        self.mouse_pos = mouse_pos
+        self.mouse_buttons = mouse_buttons
+        self.keys = keys
+        self.events = list(events)
+        self.dt = dt
+
+
+class LiveInput():
+    """
+    Input from the real mouse and keyboard
+    """
+    def get_frame(self) -> InputFrame:
+        return InputFrame(p.mouse.get_pos(), p.mouse.get_pressed(), p.key.get_pressed(), p.event.get())
+
+
+class ScriptedInput():
+    """
+    Input from a timeline, so the same run can be played back without anyone at the keyboard
+    The timeline is a list of (first frame, last frame, kind, value), with the kinds:
+        'mouse' - move the mouse to value (x, y), it stays there afterwards
+        'click' - hold the left mouse button
+        'hold' - hold the key value
+        'press' - a KEYDOWN event for the key value on the first frame
+        'motion' - a MOUSEMOTION event moving by value (x, y) every frame
+        'quit' - a QUIT event on the first frame
+    """
+    def __init__(self, timeline:list[tuple]):
+        self.timeline = timeline
+        self.frame = 0
+        self.mouse_pos = (0, 0)
+
+    @property
+    def length(self) -> int:
+        """
+        The frame after the last one the timeline does anything on
+        """
+        return max((last for first, last, kind, value in self.timeline), default=-1) + 1
+
+    def get_frame(self) -> InputFrame:
+        mouse_left = False
+        held = set()
+        events = []
+
+        for first, last, kind, value in self.timeline:
+            if not first <= self.frame <= last:
+                continue
+
+            if kind == 'mouse':
+                self.mouse_pos = value
+            elif kind == 'click':
+                mouse_left = True
+            elif kind == 'hold':
+                held.add(value)
+            elif kind == 'press' and self.frame == first:
+                events.append(p.event.Event(p.KEYDOWN, key=value))
+            elif kind == 'motion':
+                events.append(p.event.Event(p.MOUSEMOTION, rel=value))
+            elif kind == 'quit' and self.frame == first:
+                events.append(p.event.Event(p.QUIT))
+
+        self.frame += 1
+        return InputFrame(self.mouse_pos, (mouse_left, False, False), KeyState(held), events)
+
+
+#input logs, see InputRecorder
+#magic, version, random seed, ticks when recording started
+LOG_HEADER = struct.Struct('<4sBQI')
+LOG_MAGIC = b'DDIN'
+LOG_VERSION = 2
+#dt, ticks, mouse x, mouse y, mouse buttons (bits), held keys (bits of RECORDED_KEYS), event count
+#every mouse motion is recorded, so a frame after a long level load or a window drag can have a lot of events
+LOG_FRAME = struct.Struct('<dIhhBHH')
+#kind (see LOG_EVENT_TYPES), then key, or x and y of rel
+LOG_EVENT = struct.Struct('<Bii')
+#the only events the game handles, so the only ones recorded, the kind of a logged event is its index in this
+LOG_EVENT_TYPES = (p.KEYDOWN, p.MOUSEMOTION, p.QUIT)
+
+#the only keys the game checks are held, so the only ones recorded
+RECORDED_KEYS = (p.K_w, p.K_a, p.K_s, p.K_d, p.K_LEFT, p.K_RIGHT, p.K_UP, p.K_DOWN, p.K_SPACE)
+
+class InputRecorder():
+    """
+    Passes on input from another source, writing every frame of it to a binary log along with g.dt and the ticks
+    The log starts with the random seed, so InputReplay can play the same session back
+    """
+    def __init__(self, source, path:str, seed:int):
+        self.source = source
+        self.file = open(path, 'wb')
+        self.file.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, seed, g.get_ticks()))
+
+    def get_frame(self) -> InputFrame:
+        frame = self.source.get_frame()
+
+        buttons = sum(1 << i for i, button in enumerate(frame.mouse_buttons[:3]) if button)
+        held = sum(1 << i for i, key in enumerate(RECORDED_KEYS) if frame.keys[key])
+
+        events = []
+        for ev in frame.events:
+            if ev.type not in LOG_EVENT_TYPES:
+                continue
+
+            if ev.type == p.KEYDOWN:
+                a, b = ev.key, 0
+            elif ev.type == p.MOUSEMOTION:
+                a, b = ev.rel
+            else:
+                a, b = 0, 0
+            events.append(LOG_EVENT.pack(LOG_EVENT_TYPES.index(ev.type), a, b))
+
+        mx, my = frame.mouse_pos
+        self.file.write(LOG_FRAME.pack(g.dt, g.get_ticks(), int(mx), int(my), buttons, held, len(events)))
+        self.file.write(b''.join(events))
+        return frame
+
+    def close(self):
+        self.file.close()
+
+
+class InputReplay():
+    """
+    Input from a log written by InputRecorder, including each frame's dt and ticks (use get_ticks for g.get_ticks)
+    The ticks are what g.get_ticks gave when each frame's input was read, not when its events happened,
+    so everything in a frame sees the same ticks
+    The game is sent a QUIT event after the last frame
+    """
+    def __init__(self, path:str):
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        magic, version, self.seed, self.ticks = LOG_HEADER.unpack_from(data)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError(f'{path} is not a version {LOG_VERSION} input log')
+
+        #(ticks, frame) for every frame, a frame cut short (e.g. if the game crashed while recording) is dropped
+        self.frames:list[tuple[int, InputFrame]] = []
+        offset = LOG_HEADER.size
+        while offset + LOG_FRAME.size <= len(data):
+            dt, ticks, mx, my, buttons, held, event_count = LOG_FRAME.unpack_from(data, offset)
+            offset += LOG_FRAME.size
+            if offset + event_count*LOG_EVENT.size > len(data):
+                break
+
+            events = []
+            for i in range(event_count):
+                kind, a, b = LOG_EVENT.unpack_from(data, offset)
+                offset += LOG_EVENT.size
+                if kind >= len(LOG_EVENT_TYPES):
+                    raise ValueError(f'{path} has an event of unknown kind {kind}')
+
+                event_type = LOG_EVENT_TYPES[kind]
+                if event_type == p.KEYDOWN:
+                    events.append(p.event.Event(event_type, key=a))
+                elif event_type == p.MOUSEMOTION:
+                    events.append(p.event.Event(event_type, rel=(a, b)))
+                else:
+                    events.append(p.event.Event(event_type))
+
+            mouse_buttons = tuple(bool(buttons & (1 << i)) for i in range(3))
+            keys = KeyState(key for i, key in enumerate(RECORDED_KEYS) if held & (1 << i))
+            self.frames.append( (ticks, InputFrame((mx, my), mouse_buttons, keys, events, dt)) )
+
+        self.frame = 0
+
+    @property
+    def length(self) -> int:
+        return len(self.frames)
+
+    def get_ticks(self) -> int:
+        """
+        The ticks recorded for the current frame, the same for every call until the next get_frame
+        """
+        return self.ticks
+
+    def get_frame(self) -> InputFrame:
+        if self.frame >= len(self.frames):
+            return InputFrame(events=[p.event.Event(p.QUIT)])
+
+        self.ticks, frame = self.frames[self.frame]
+        self.frame += 1
+        return frame
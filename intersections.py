@@ -0,0 +1,271 @@
+import numpy as np
+
+#rough limit on how many ray/triangle pairs we test in one numpy pass, to keep temporary arrays small
+MAX_BATCH_PAIRS = 250_000
+#from this many triangle/triangle pairs, dropping faces with faces_straddling first is quicker than testing every pair
+MIN_FILTER_PAIRS = 300
+#below this many pairs (after filtering), looping over the faces is quicker, since it stops at the first hit
+#and triangles_colliding costs a few hundred microseconds however few pairs it has (see benchmarks/bench_collision.py)
+MIN_BATCH_PAIRS = 1000
+
+def cross(a:np.ndarray, b:np.ndarray) -> np.ndarray:
+    """
+    np.cross for (N,3) arrays, rounding the same way but without its overhead, which is most of the time for small models
+    """
+    out = np.empty(np.broadcast_shapes(a.shape, b.shape))
+    out[:, 0] = a[:, 1]*b[:, 2] - a[:, 2]*b[:, 1]
+    out[:, 1] = a[:, 2]*b[:, 0] - a[:, 0]*b[:, 2]
+    out[:, 2] = a[:, 0]*b[:, 1] - a[:, 1]*b[:, 0]
+    return out
+
+def prepare_triangles(v0:np.ndarray, e1:np.ndarray, e2:np.ndarray) -> tuple:
+    """
+    Precalculate the per triangle terms used by rays_triangles
+    Only needs redoing when the triangles move
+    """
+    normals = cross(e1, e2)
+    planes = np.einsum('fk,fk->f', v0, normals)
+    return (e1, e2, normals, planes, cross(e2, v0), cross(v0, e1))
+
+def rays_triangles(origins:np.ndarray, directions:np.ndarray, triangles:tuple, epsilon:float=1e-6) -> np.ndarray:
+    """
+    Vectorised Moller-Trumbore
+    Tests every ray (N,3) against every triangle (F) and returns an (N,F) array of hit distances, with inf where there is no hit
+    The triple products are expanded so that everything is an (N,3)x(3,F) matrix multiply instead of (N,F,3) temporaries
+    """
+    e1, e2, normals, planes, e2_cross_v0, v0_cross_e1 = triangles
+
+    o_cross_d = cross(origins, directions)
+
+    a = -(directions @ normals.T)
+
+    parallel = np.abs(a) < epsilon
+    f = 1.0 / np.where(parallel, 1.0, a)
+
+    u = f * ((o_cross_d @ e2.T) - (directions @ e2_cross_v0.T))
+    v = f * (-(o_cross_d @ e1.T) - (directions @ v0_cross_e1.T))
+    t = f * ((origins @ normals.T) - planes)
+
+    miss = parallel | (u < 0.0) | (u > 1.0) | (v < 0.0) | (u + v > 1.0) | (t <= epsilon)
+    t[miss] = np.inf
+    return t
+
+def closest_rays_triangles(origins:np.ndarray, directions:np.ndarray, triangles:tuple, epsilon:float=1e-6) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the closest triangle hit by each ray
+    Returns the hit distances (inf for a miss) and the index of the triangle hit (-1 for a miss)
+    Rays are split into chunks so we never test more than MAX_BATCH_PAIRS pairs at once
+    """
+    ray_count = len(origins)
+    tri_count = len(triangles[0])
+
+    closest_t = np.full(ray_count, np.inf)
+    closest_i = np.full(ray_count, -1, dtype=np.int64)
+
+    if not ray_count or not tri_count:
+        return closest_t, closest_i
+
+    chunk = max(1, MAX_BATCH_PAIRS // tri_count)
+    for start in range(0, ray_count, chunk):
+        end = min(start + chunk, ray_count)
+        t = rays_triangles(origins[start:end], directions[start:end], triangles, epsilon)
+
+        i = np.argmin(t, axis=1)
+        closest = t[np.arange(end - start), i]
+        hit = np.isfinite(closest)
+
+        closest_t[start:end] = closest
+        closest_i[start:end] = np.where(hit, i, -1)
+
+    return closest_t, closest_i
+
+def ray_triangle_pairs(origins:np.ndarray, directions:np.ndarray, triangles:tuple, epsilon:float=1e-6) -> np.ndarray:
+    """
+    Vectorised Moller-Trumbore for pairs, ray i (N,3) against triangle i (N)
+    The same sums as rays_triangles, done row by row instead of as matrix multiplies
+    Returns an (N,) array of hit distances, with inf where there is no hit
+    """
+    e1, e2, normals, planes, e2_cross_v0, v0_cross_e1 = triangles
+
+    def dot(a, b):
+        return np.einsum('nk,nk->n', a, b)
+
+    o_cross_d = np.cross(origins, directions)
+
+    a = -dot(directions, normals)
+
+    parallel = np.abs(a) < epsilon
+    f = 1.0 / np.where(parallel, 1.0, a)
+
+    u = f * (dot(o_cross_d, e2) - dot(directions, e2_cross_v0))
+    v = f * (-dot(o_cross_d, e1) - dot(directions, v0_cross_e1))
+    t = f * (dot(origins, normals) - planes)
+
+    miss = parallel | (u < 0.0) | (u > 1.0) | (v < 0.0) | (u + v > 1.0) | (t <= epsilon)
+    t[miss] = np.inf
+    return t
+
+def closest_ray_triangle_pairs(origins:np.ndarray, directions:np.ndarray, triangles:tuple, ray_indices:np.ndarray, triangle_indices:np.ndarray, epsilon:float=1e-6) -> np.ndarray:
+    """
+    Get the closest hit of each ray, only testing the (ray, triangle) pairs given (e.g. by BVH.query_rays)
+    Returns the hit distances (inf for a miss)
+    Pairs are split into chunks of MAX_BATCH_PAIRS
+    """
+    closest_t = np.full(len(origins), np.inf)
+
+    for start in range(0, len(ray_indices), MAX_BATCH_PAIRS):
+        rays = ray_indices[start:start+MAX_BATCH_PAIRS]
+        pair_triangles = tuple(array[triangle_indices[start:start+MAX_BATCH_PAIRS]] for array in triangles)
+        t = ray_triangle_pairs(origins[rays], directions[rays], pair_triangles, epsilon)
+        np.minimum.at(closest_t, rays, t)
+
+    return closest_t
+
+def rays_spheres(origins:np.ndarray, directions:np.ndarray, centre:np.ndarray, radius:float, max_dist:float) -> np.ndarray:
+    """
+    Check which rays could hit a bounding sphere, returns a bool mask
+    Same test as ModelInstance.colliding_ray_bounding_sphere, plus a range check
+    """
+    m = origins - centre
+    b = np.einsum('nk,nk->n', m, directions)
+    mag2 = np.einsum('nk,nk->n', m, m)
+    c = mag2 - (radius * radius)
+
+    in_range = mag2 <= (max_dist + radius) ** 2
+
+    behind = (c > 0) & (b > 0)
+    discr = (b * b) - c
+
+    return in_range & ~behind & (discr >= 0)
+
+def sweep_points_triangles(points:np.ndarray, direction:np.ndarray, triangles:tuple, epsilon:float=1e-6) -> float:
+    """
+    How far (N,3) points can move along a unit direction before any of them hits a triangle
+    Returns inf if none of them do
+    """
+    if not len(points):
+        return np.inf
+
+    directions = np.broadcast_to(direction, points.shape)
+    t, _ = closest_rays_triangles(points, directions, triangles, epsilon)
+    return float(t.min())
+
+def get_other_index(d0:np.ndarray, d1:np.ndarray, d2:np.ndarray) -> np.ndarray:
+    """
+    Vectorised models.get_other_index, including its fallback checks
+    """
+    epsilon = 0.000_000_001
+
+    fallback = np.zeros(d0.shape, dtype=np.int64)
+    fallback[((d1 <= 0) & (d2 <= 0) & (d0 > 0)) | ((d1 > 0) & (d2 > 0) & (d0 < 0))] = 0
+    fallback[(d0 > 0) & (d2 > 0) & (d1 < 0)] = 1
+    fallback[((d0 <= 0) & (d1 <= 0) & (d2 > 0)) | ((d0 > 0) & (d1 > 0) & (d2 < 0))] = 2
+
+    return np.where((d0 * d1) > epsilon, 2,
+           np.where((d0 * d2) > epsilon, 1,
+           np.where((d1 * d2) > epsilon, 0, fallback)))
+
+def get_projection(dx, dy, dz, p0:np.ndarray, p1:np.ndarray, p2:np.ndarray, d0:np.ndarray, d1:np.ndarray, d2:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised models.get_projection, p0, p1 and p2 are (N,3) and everything else is (N,)
+    """
+    proj0 = dx*p0[:, 0] + dy*p0[:, 1] + dz*p0[:, 2]
+    proj1 = dx*p1[:, 0] + dy*p1[:, 1] + dz*p1[:, 2]
+    proj2 = dx*p2[:, 0] + dy*p2[:, 1] + dz*p2[:, 2]
+
+    #put the vertex that's on its own side first
+    i = get_other_index(d0, d1, d2)
+    proj0, proj1, proj2 = (np.choose(i, (proj0, proj1, proj2)), np.where(i == 1, proj0, proj1), np.where(i == 2, proj0, proj2))
+    d0, d1, d2 = (np.choose(i, (d0, d1, d2)), np.where(i == 1, d0, d1), np.where(i == 2, d0, d2))
+
+    t1 = proj0 + (proj1 - proj0) * (d0 / (d0 - d1))
+    t2 = proj0 + (proj2 - proj0) * (d0 / (d0 - d2))
+    return t1, t2
+
+def get_sides(normals:np.ndarray, planes:np.ndarray, points:np.ndarray) -> np.ndarray:
+    """
+    plane - normal.point for (N,3) normals and planes against (N,3) points
+    Written out in full so it rounds the same way as Vector3.dot
+    """
+    return planes - (normals[:, 0]*points[:, 0] + normals[:, 1]*points[:, 1] + normals[:, 2]*points[:, 2])
+
+def faces_straddling(normals:np.ndarray, planes:np.ndarray, points:np.ndarray) -> np.ndarray:
+    """
+    Get a bool mask of the (N) faces whose plane doesn't have every one of the (P,3) points strictly on one side
+    A face with every point on one side can't collide with any triangle made from those points
+    The same sums as get_sides, so this never drops a face the pair tests would find colliding
+    """
+    sides = planes[:, None] - (normals[:, None, 0]*points[None, :, 0] + normals[:, None, 1]*points[None, :, 1] + normals[:, None, 2]*points[None, :, 2])
+    return ~((sides < 0).all(axis=1) | (sides > 0).all(axis=1))
+
+def triangles_colliding(a:tuple, b:tuple) -> np.ndarray:
+    """
+    Vectorised models.triangles_colliding (Moller's interval overlap test) for N pairs of triangles
+    a and b are each (v0, v1, v2, normals, planes), all with N rows
+    Returns a bool mask of the pairs that collide
+    """
+    a0, a1, a2, normal1, plane1 = a
+    b0, b1, b2, normal2, plane2 = b
+
+    colliding = np.zeros(len(a0), dtype=bool)
+
+    #check SAT, both ways around
+    sides1 = (get_sides(normal1, plane1, b0), get_sides(normal1, plane1, b1), get_sides(normal1, plane1, b2))
+    sides2 = (get_sides(normal2, plane2, a0), get_sides(normal2, plane2, a1), get_sides(normal2, plane2, a2))
+
+    straddling = np.ones(len(a0), dtype=bool)
+    for s0, s1, s2 in (sides1, sides2):
+        all_zero = (s0 == 0) & (s1 == 0) & (s2 == 0)
+        below = (s0 < 0) & (s1 < 0) & (s2 < 0)
+        above = (s0 > 0) & (s1 > 0) & (s2 > 0)
+        straddling &= ~(all_zero | below | above)
+
+    #only the pairs that are left need the interval test
+    pairs = np.flatnonzero(straddling)
+    if not len(pairs):
+        return colliding
+
+    n1 = normal1[pairs]
+    n2 = normal2[pairs]
+    #normal1 x normal2, the direction of the planes' intersection line
+    dx = n1[:, 1]*n2[:, 2] - n1[:, 2]*n2[:, 1]
+    dy = n1[:, 2]*n2[:, 0] - n1[:, 0]*n2[:, 2]
+    dz = n1[:, 0]*n2[:, 1] - n1[:, 1]*n2[:, 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t1, t2 = get_projection(dx, dy, dz, a0[pairs], a1[pairs], a2[pairs], sides2[0][pairs], sides2[1][pairs], sides2[2][pairs])
+        t3, t4 = get_projection(dx, dy, dz, b0[pairs], b1[pairs], b2[pairs], sides1[0][pairs], sides1[1][pairs], sides1[2][pairs])
+
+    t1, t2 = np.where(t2 < t1, t2, t1), np.where(t2 < t1, t1, t2)
+    t3, t4 = np.where(t4 < t3, t4, t3), np.where(t4 < t3, t3, t4)
+
+    separate = ((t1 <= t2) & (t2 <= t3) & (t3 <= t4)) | ((t3 <= t4) & (t4 <= t1) & (t1 <= t2))
+    colliding[pairs] = ~separate
+    return colliding
+
+def first_triangles_colliding(outer:tuple, inner:tuple) -> tuple[int, int]|None:
+    """
+    Test every triangle in outer against every triangle in inner, where each is (v0, v1, v2, normals, planes)
+    Returns the (outer, inner) indices of the first colliding pair, in the same order as looping over outer
+    then inner, or None if nothing collides
+    Inner triangles are the first triangle of models.triangles_colliding
+    """
+    outer_count = len(outer[0])
+    inner_count = len(inner[0])
+    if not outer_count or not inner_count:
+        return None
+
+    chunk = max(1, MAX_BATCH_PAIRS // inner_count)
+    for start in range(0, outer_count, chunk):
+        end = min(start + chunk, outer_count)
+
+        #every pair in this chunk, outer major
+        outer_indices = np.repeat(np.arange(start, end), inner_count)
+        inner_indices = np.tile(np.arange(inner_count), end - start)
+
+        colliding = triangles_colliding(tuple(array[inner_indices] for array in inner), tuple(array[outer_indices] for array in outer))
+        hits = np.flatnonzero(colliding)
+        if len(hits):
+            return int(outer_indices[hits[0]]), int(inner_indices[hits[0]])
+
+    return None
@@ -0,0 +1,183 @@
+import numpy as np
+import pygame as p
+import os
+from collections import OrderedDict
+
+import global_values as g
+import models
+import model_cache
+import gameobjects
+import bvh
+
+def split_into_tiles(points:np.ndarray, faces:np.ndarray, tile_size:float) -> dict[str, np.ndarray]:
+    """
+    Split a model into cubic tiles, each face going in the tile its centre is in
+    Every tile gets its own vertices (relative to the tile's centre), faces and bvh, all stored one after another
+    so tile i's faces are faces[face_offsets[i]:face_offsets[i+1]], and the same for vertices and bvh nodes
+    """
+    centroids = points[faces].mean(axis=1)
+    coords = np.floor(centroids / tile_size).astype(np.int64)
+    tile_coords, tile_of_face = np.unique(coords, axis=0, return_inverse=True)
+    tile_of_face = tile_of_face.ravel()
+
+    order = np.argsort(tile_of_face, kind='stable')
+    face_offsets = np.zeros(len(tile_coords)+1, dtype=np.int64)
+    np.cumsum(np.bincount(tile_of_face, minlength=len(tile_coords)), out=face_offsets[1:])
+
+    tile_vertices = []
+    tile_faces = []
+    tile_centres = []
+    tile_lbs = []
+    tile_rts = []
+    tile_radii = []
+    tile_bvh_arrays = {name:[] for name in bvh.ARRAY_NAMES}
+    vertex_offsets = [0]
+    node_offsets = [0]
+
+    for i in range(len(tile_coords)):
+        #only keep the vertices this tile uses, renumbered from 0
+        used, local_faces = np.unique(faces[order[face_offsets[i]:face_offsets[i+1]]], return_inverse=True)
+        local_faces = local_faces.reshape(-1, 3)
+
+        lb = points[used].min(axis=0)
+        rt = points[used].max(axis=0)
+        centre = (lb + rt) / 2
+        vertices = points[used] - centre
+
+        face_vertices = vertices[local_faces]
+        tile_bvh = bvh.BVH(face_vertices.min(axis=1), face_vertices.max(axis=1))
+        for name, array in tile_bvh.get_arrays().items():
+            tile_bvh_arrays[name].append(array)
+
+        tile_vertices.append(vertices)
+        tile_faces.append(local_faces)
+        tile_centres.append(centre)
+        tile_lbs.append(lb)
+        tile_rts.append(rt)
+        tile_radii.append(models.get_bounding_radius(vertices))
+        vertex_offsets.append(vertex_offsets[-1] + len(vertices))
+        node_offsets.append(node_offsets[-1] + len(tile_bvh.node_lb))
+
+    arrays = {
+        'coords':tile_coords,
+        'centres':np.array(tile_centres).reshape(-1, 3),
+        'lbs':np.array(tile_lbs).reshape(-1, 3),
+        'rts':np.array(tile_rts).reshape(-1, 3),
+        'radii':np.array(tile_radii),
+        'vertex_offsets':np.array(vertex_offsets, dtype=np.int64),
+        'face_offsets':face_offsets,
+        'node_offsets':np.array(node_offsets, dtype=np.int64),
+        'vertices':np.concatenate(tile_vertices) if tile_vertices else np.zeros( (0, 3) ),
+        'faces':np.concatenate(tile_faces) if tile_faces else np.zeros( (0, 3), dtype=np.int64),
+    }
+    for name, tile_arrays in tile_bvh_arrays.items():
+        arrays['bvh_' + name] = np.concatenate(tile_arrays)
+
+    return arrays
+
+
+class LevelTiles():
+    """
+    A level split into tiles, so only the parts near the player are instances
+    Each loaded tile is a static GameObj with its own bvh, like the whole level would be
+    Tiles within load_radius of the player are loaded, and once more than max_tiles are loaded the least recently needed ones are removed
+    The tile arrays are cached next to the model file and memory mapped, so tiles that aren't loaded don't take up memory
+    """
+    def __init__(self, filename:str, origin, tile_size:float=32, load_radius:float=100, max_tiles:int=48):
+        self.name = filename.split('.')[0]
+        self.origin = np.array(origin, dtype=np.float64)
+        self.tile_size = tile_size
+        #the rays the player shoots go up to 100, so that's the default
+        self.load_radius = load_radius
+        self.max_tiles = max_tiles
+
+        path = os.path.join(g.DIR_MODELS, filename)
+        model_key = model_cache.get_key(path)
+        tiles_key = model_cache.get_tiles_key(model_key, tile_size)
+
+        self.arrays = model_cache.load_tiles(path, tiles_key)
+        if self.arrays is None:
+            #only needed the first time, after that the whole model is never loaded
+            _, model_arrays = models.load_arrays(path)
+            self.arrays = split_into_tiles(np.asarray(model_arrays['points']), np.asarray(model_arrays['faces']), tile_size)
+            model_cache.save_tiles(path, tiles_key, self.arrays)
+
+        #world space bounds of every tile
+        self.lbs = self.arrays['lbs'] + self.origin
+        self.rts = self.arrays['rts'] + self.origin
+
+        #tile index -> instance, least recently needed first
+        self.loaded:OrderedDict[int, gameobjects.GameObj] = OrderedDict()
+
+    def __len__(self):
+        return len(self.lbs)
+
+    def get_tiles_near(self, position, radius:float) -> np.ndarray:
+        """
+        Get the indices of the tiles whose bounds are within a radius of a position
+        """
+        position = np.array([position[0], position[1], position[2]])
+        gaps = np.maximum(np.maximum(self.lbs - position, position - self.rts), 0)
+        return np.flatnonzero(np.einsum('ij,ij->i', gaps, gaps) <= radius*radius)
+
+    def load_tile(self, i:int) -> gameobjects.GameObj:
+        """
+        Make the model and instance for a tile
+        """
+        arrays = self.arrays
+        vertex_slice = slice(arrays['vertex_offsets'][i], arrays['vertex_offsets'][i+1])
+        face_slice = slice(arrays['face_offsets'][i], arrays['face_offsets'][i+1])
+        node_slice = slice(arrays['node_offsets'][i], arrays['node_offsets'][i+1])
+
+        name = f'{self.name}_tile_{i}'
+        model = models.Model(name, arrays['vertices'][vertex_slice], arrays['faces'][face_slice], bounding_radius=float(arrays['radii'][i]))
+
+        bvh_arrays = {}
+        for array_name in bvh.ARRAY_NAMES:
+            bvh_slice = face_slice if array_name == 'face_indices' else node_slice
+            bvh_arrays[array_name] = arrays['bvh_' + array_name][bvh_slice]
+        model.bvh = bvh.BVH.from_arrays(bvh_arrays)
+
+        origin = self.origin + arrays['centres'][i]
+        return gameobjects.GameObj(p.Vector3(*origin.tolist()), name, accel='bvh', do_convex_check=False)
+
+    def unload_tile(self, i:int):
+        """
+        Remove a tile's instance and model
+        """
+        model_instance = self.loaded.pop(i)
+        model_instance.delete()
+        del g.models[model_instance.model.name]
+
+    def update(self, position) -> bool:
+        """
+        Load the tiles near a position and unload old ones if there are too many
+        Returns True if any tiles were loaded or unloaded
+        """
+        changed = False
+
+        near = self.get_tiles_near(position, self.load_radius).tolist()
+        for i in near:
+            if i in self.loaded:
+                self.loaded.move_to_end(i)
+            else:
+                self.loaded[i] = self.load_tile(i)
+                changed = True
+
+        #near tiles were just moved to the end, so anything unloaded here isn't needed
+        near = set(near)
+        while len(self.loaded) > self.max_tiles:
+            i = next(iter(self.loaded))
+            if i in near:
+                break
+            self.unload_tile(i)
+            changed = True
+
+        return changed
+
+    def clear(self):
+        """
+        Unload every tile
+        """
+        for i in list(self.loaded):
+            self.unload_tile(i)
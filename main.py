@@ -2,6 +2,7 @@ import pygame as p
 p.font.init()
 import math as m
 import os
+import random
 
 import global_values as g
 
@@ -15,37 +16,27 @@ import gfx
 import obstacles
 import pickups
 import sounds
+import ray_workers
+import shared_geometry
+import level_tiles
+import profiler
+import inputs
 
+#made in setup
+tutorial_manager:controls.TutorialManager = None
+c_profiler_overlay:controls.ProfilerOverlay = None
 
-#box_model = models.Box((0,0,0), 3, 'red')
-#box_model2 = models.Box((0,0,5), 4, 'blue')
-#box_model3 = models.Box((13,0,0), 6, 'yellow')
-
-p.mixer.init()
-p.display.set_caption('Dark Descent')
-import random
-if random.randint(1,5) == 5:
-    p.display.set_caption('Sub-Optimal')
-
-
-sounds.load_sounds()
-
-cube_model = models.load('cube2.ply', is_convex=True)
-#tri1_model = models.load('tri1.ply')
-#tri_instance = gameobjects.GameObj((10, 0, 0), 'tri1')
-#tri2_model = models.load('tri2.ply')
-fish_model = models.load('shark.ply')
-sphere_model = models.load('sphere1.ply', is_convex=True)
-
-
-
-level_model = models.load('level.ply')
-g.level = gameobjects.GameObj((15, -10, 20), 'level', octree_depth=4, do_convex_check=False)
-
-g.screen = p.display.set_mode((g.WIDTH, g.HEIGHT))
-p.display.set_icon(gfx.li('icon'))
-controls.View3D(p.Rect(200,0,500,500))
+def update_static_geometry():
+    """
+    Load the level tiles near the player, and tell the ray workers if the static instances changed
+    """
+    if g.level_tiles:
+        g.level_tiles.update(g.player)
 
+    #removed geometry is left for the pool to detach, since batches already sent might still be using it
+    removed = []
+    if g.ray_pool and shared_geometry.sync(g.shared_geometry, g.model_instances, removed):
+        g.ray_pool.set_geometry(g.shared_geometry, removed)
 
 g.fullscreen = False
 def toggle_fullscreen():
@@ -59,95 +50,156 @@ def toggle_fullscreen():
     else:
         g.screen = p.display.set_mode((g.WIDTH, g.HEIGHT))
 
+def setup():
+    """
+    Load everything and make the UI, needs doing once before any frames are run
+    """
+    global tutorial_manager, c_profiler_overlay
+
+    #box_model = models.Box((0,0,0), 3, 'red')
+    #box_model2 = models.Box((0,0,5), 4, 'blue')
+    #box_model3 = models.Box((13,0,0), 6, 'yellow')
+
+    p.mixer.init()
+    p.display.set_caption('Dark Descent')
+    if g.REPLAY_INPUT_PATH:
+        g.inputs = inputs.InputReplay(g.REPLAY_INPUT_PATH)
+        g.get_ticks = g.inputs.get_ticks
+        g.SEED = g.inputs.seed
+    if g.SEED is None:
+        g.SEED = random.randrange(2**32)
+    random.seed(g.SEED)
+
+    if random.randint(1,5) == 5:
+        p.display.set_caption('Sub-Optimal')
+
+
+    sounds.load_sounds()
+
+    cube_model = models.load('cube2.ply', is_convex=True)
+    #tri1_model = models.load('tri1.ply')
+    #tri_instance = gameobjects.GameObj((10, 0, 0), 'tri1')
+    #tri2_model = models.load('tri2.ply')
+    fish_model = models.load('shark.ply')
+    sphere_model = models.load('sphere1.ply', is_convex=True)
+
+
+
+    if g.LEVEL_TILE_SIZE:
+        #the tiles near the player are loaded once the player exists
+        g.level_tiles = level_tiles.LevelTiles('level.ply', (15, -10, 20), g.LEVEL_TILE_SIZE)
+    else:
+        level_model = models.load('level.ply')
+        g.level = gameobjects.GameObj((15, -10, 20), 'level', accel='bvh', do_convex_check=False)
+
+    if g.RAY_WORKERS:
+        g.ray_pool = ray_workers.RayWorkerPool(g.RAY_WORKERS)
+
+    g.screen = p.display.set_mode((g.WIDTH, g.HEIGHT))
+    p.display.set_icon(gfx.li('icon'))
+    controls.View3D(p.Rect(200,0,500,500))
+
+    g.game_clock = p.time.Clock()
 
-g.game_clock = p.time.Clock()
+    g.player = players.Player((20, 0, 20))
+    update_static_geometry()
 
-g.player = players.Player((20, 0, 20))
 
+    #BACKGROUNDS
+    controls.Background(p.Rect(0,0,g.WIDTH,g.HEIGHT), gfx.li('win_background'), active_state='win')
+    controls.Background(p.Rect(0,0,g.WIDTH,g.HEIGHT), gfx.li('gameover_background'), active_state='gameover')
+    controls.Background(p.Rect(0,0,g.WIDTH,g.HEIGHT), gfx.li('start_background'), active_state='start')
 
-#BACKGROUNDS
-controls.Background(p.Rect(0,0,g.WIDTH,g.HEIGHT), gfx.li('win_background'), active_state='win')
-controls.Background(p.Rect(0,0,g.WIDTH,g.HEIGHT), gfx.li('gameover_background'), active_state='gameover')
-controls.Background(p.Rect(0,0,g.WIDTH,g.HEIGHT), gfx.li('start_background'), active_state='start')
+    controls.Background(p.Rect(0,0,200,500), gfx.li('background_left'))
+    controls.Background(p.Rect(700,0,200,500), gfx.li('background_right'))
 
-controls.Background(p.Rect(0,0,200,500), gfx.li('background_left'))
-controls.Background(p.Rect(700,0,200,500), gfx.li('background_right'))
+    #SELECTABLE CONTROLS
+    #controls.Button(p.Rect(g.viewport.rect.right+10,10,32,32), gfx.li('button_target'), lambda :  g.player.select_tool('missile') )
+    viewport_right = g.viewport.rect.right
+    rect = p.Rect(viewport_right+48,40,96,48)
+    controls.Button(rect, gfx.li('button_look'), lambda : g.player.select_tool('Beam') )
+    rect = rect.move(0, 52)
+    controls.Button(rect, gfx.li('button_radar'), lambda : g.player.select_tool('Vertical Scanner') )
+    rect = rect.move(0, 52)
+    controls.Button(rect, gfx.li('button_beam'), lambda : g.player.select_tool('Horizontal Scanner') )
+    rect = rect.move(0, 52)
+    controls.Button(rect, gfx.li('button_none'), lambda : (g.player.select_tool(None), g.player.select_point_spawner(None)) )
 
-#SELECTABLE CONTROLS
-#controls.Button(p.Rect(g.viewport.rect.right+10,10,32,32), gfx.li('button_target'), lambda :  g.player.select_tool('missile') )
-viewport_right = g.viewport.rect.right
-rect = p.Rect(viewport_right+48,40,96,48)
-controls.Button(rect, gfx.li('button_look'), lambda : g.player.select_tool('Beam') )
-rect = rect.move(0, 52)
-controls.Button(rect, gfx.li('button_radar'), lambda : g.player.select_tool('Vertical Scanner') )
-rect = rect.move(0, 52)
-controls.Button(rect, gfx.li('button_beam'), lambda : g.player.select_tool('Horizontal Scanner') )
-rect = rect.move(0, 52)
-controls.Button(rect, gfx.li('button_none'), lambda : (g.player.select_tool(None), g.player.select_point_spawner(None)) )
 
+    #POWER BAR
+    rect = p.Rect(20,42,164,15)
+    c_power_bar = controls.Measure(rect, gfx.li('power_bar_segment_on'), gfx.li('power_bar_segment_off'), g.player, 'power', g.player.max_power)
+    c_power_usage_bar = controls.Measure(rect.move(0,20), gfx.li('power_usage'), None, g.player, 'current_drain', 14)
 
-#POWER BAR
-rect = p.Rect(20,42,164,15)
-c_power_bar = controls.Measure(rect, gfx.li('power_bar_segment_on'), gfx.li('power_bar_segment_off'), g.player, 'power', g.player.max_power)
-c_power_usage_bar = controls.Measure(rect.move(0,20), gfx.li('power_usage'), None, g.player, 'current_drain', 14)
+    #POWERED CONTROLS
 
-#POWERED CONTROLS
+    rect = p.Rect(20,116,162,27)
+    c_health_bar = controls.Measure(rect, gfx.li('light_on'), gfx.li('light_off'), g.player, 'health', g.player.max_health)
+    controls.Switch(p.Rect(16,rect.y-30,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_health_bar.set_visible(s), True)
+    #controls.TwoState( p.Rect(16,rect.y+32,32,32), gfx.li('collision_light_on'), gfx.li('collision_light_off'), lambda: g.player.just_collided)
 
-rect = p.Rect(20,116,162,27)
-c_health_bar = controls.Measure(rect, gfx.li('light_on'), gfx.li('light_off'), g.player, 'health', g.player.max_health)
-controls.Switch(p.Rect(16,rect.y-30,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_health_bar.set_visible(s), True)
-#controls.TwoState( p.Rect(16,rect.y+32,32,32), gfx.li('collision_light_on'), gfx.li('collision_light_off'), lambda: g.player.just_collided)
+    #rect = p.Rect(0,128+32,200,64)
+    #def get_coord_info():
+    #    if g.goal:
+    #        goal_dist = str(round( (g.goal-g.player).magnitude(), 1)).zfill(1)
+    #    else:
+    #        goal_dist = '???'
+    #    return f'''
+    #    X {str(round(g.player.x,1)).zfill(1)} Y {str(round(g.player.y,1)).zfill(1)} Z {str(round(g.player.z,1)).zfill(1)}
+    #     Target: {goal_dist} units away.
+    #    '''
+    #c_coords = controls.TextBox(rect, g.fonts['info1'], get_coord_info, padding=0, text_colour='white')
+    #controls.Switch(p.Rect(16,rect.y-16,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_coords.set_visible(s), True)
 
-#rect = p.Rect(0,128+32,200,64)
-#def get_coord_info():
-#    if g.goal:
-#        goal_dist = str(round( (g.goal-g.player).magnitude(), 1)).zfill(1)
-#    else:
-#        goal_dist = '???'
-#    return f'''
-#    X {str(round(g.player.x,1)).zfill(1)} Y {str(round(g.player.y,1)).zfill(1)} Z {str(round(g.player.z,1)).zfill(1)}
-#     Target: {goal_dist} units away.
-#    '''
-#c_coords = controls.TextBox(rect, g.fonts['info1'], get_coord_info, padding=0, text_colour='white')
-#controls.Switch(p.Rect(16,rect.y-16,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_coords.set_visible(s), True)
+    rect = p.Rect(64, 198, 64, 64)
+    c_compass = controls.Compass(rect)
+    controls.Switch(p.Rect(16,rect.y-38,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_compass.set_visible(s), True)
 
-rect = p.Rect(64, 198, 64, 64)
-c_compass = controls.Compass(rect)
-controls.Switch(p.Rect(16,rect.y-38,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_compass.set_visible(s), True)
+    rect = p.Rect(24+16, 336+8, 128, 128)
+    c_radar = controls.Radar(rect)
+    controls.Switch(p.Rect(16,rect.y-52,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_radar.set_visible(s), True)
 
-rect = p.Rect(24+16, 336+8, 128, 128)
-c_radar = controls.Radar(rect)
-controls.Switch(p.Rect(16,rect.y-52,32,16), gfx.li('switch_on'), gfx.li('switch_off'), lambda s:c_radar.set_visible(s), True)
+    powered_controls = {
+        'health_bar':c_health_bar,
+        #'coords':c_coords,
+        'compass':c_compass,
+        'radar':c_radar
+    }
+    g.player.powered_controls = powered_controls
 
-powered_controls = {
-    'health_bar':c_health_bar,
-    #'coords':c_coords,
-    'compass':c_compass,
-    'radar':c_radar
-}
-g.player.powered_controls = powered_controls
+    #MENU BUTTONS
+    controls.Button(p.Rect(g.WIDTH*0.9, g.HEIGHT*0.83, 64, 64), gfx.li('fullscreen_toggle'), toggle_fullscreen, active_state='start')
 
-#MENU BUTTONS
-controls.Button(p.Rect(g.WIDTH*0.9, g.HEIGHT*0.83, 64, 64), gfx.li('fullscreen_toggle'), toggle_fullscreen, active_state='start')
 
+    rect= p.Rect(g.WIDTH*0.5 - 128, g.HEIGHT*0.75, 256, 64)
+    controls.Button(rect, gfx.li('button_start'), lambda: start_game(), active_state='start')
+    controls.Button(rect.move(0,-64), gfx.li('button_menu'), lambda: go_to_start(), active_state='gameover')
+    controls.Button(rect.move(0,-64), gfx.li('button_menu'), lambda: go_to_start(), active_state='win')
 
-rect= p.Rect(g.WIDTH*0.5 - 128, g.HEIGHT*0.75, 256, 64)
-controls.Button(rect, gfx.li('button_start'), lambda: start_game(), active_state='start')
-controls.Button(rect.move(0,-64), gfx.li('button_menu'), lambda: go_to_start(), active_state='gameover')
-controls.Button(rect.move(0,-64), gfx.li('button_menu'), lambda: go_to_start(), active_state='win')
 
 
+    tutorial_manager = controls.TutorialManager()
+    controls.InfoBox(p.Rect(702, 284, 196, 212))
 
-tutorial_manager = controls.TutorialManager()
-controls.InfoBox(p.Rect(702, 284, 196, 212))
+    if g.PROFILE:
+        g.profiler = profiler.Profiler(max_trace_events=1_000_000 if g.PROFILE_PATH and g.PROFILE_PATH.endswith('.json') else 0)
+        #made last so it's drawn over everything else
+        c_profiler_overlay = controls.ProfilerOverlay(g.viewport.rect.copy())
+
+    p.mixer_music.load(os.path.join(g.DIR_SOUND, 'music_main.ogg'))
+
+    if not g.inputs:
+        g.inputs = inputs.LiveInput()
+    if g.RECORD_INPUT_PATH:
+        g.inputs = inputs.InputRecorder(g.inputs, g.RECORD_INPUT_PATH, g.SEED)
 
 def reset_game():
     """
     Clear all old game state and data
     """
     for model_instance in g.model_instances[:]:
-        if model_instance == g.level:
-            #no need to reset level itself
+        if model_instance == g.level or model_instance.is_static:
+            #no need to reset level itself (or its tiles)
             continue
         if model_instance == g.player:
             continue
@@ -157,6 +209,9 @@ def reset_game():
     g.player.reset()
     #tutorial_manager.reset()
 
+    #only the level is static at the moment, so this normally keeps the same blocks and workers
+    update_static_geometry()
+
 
     #FIRST ROOM
     pickups.Health(p.Vector3(12, -13, 92))
@@ -214,8 +269,6 @@ def reset_game():
     #FINAL
     pickups.Goal(p.Vector3(-77, -195-10, 75))
 
-p.mixer_music.load(os.path.join(g.DIR_SOUND, 'music_main.ogg'))
-
 def go_to_start():
     g.states = set(('start',))
 
@@ -255,13 +308,16 @@ def handle_events():
 
 
 def handle_input():
-    g.mx, g.my = p.mouse.get_pos()
-    g.ml, g.mm, g.mr = p.mouse.get_pressed()
+    frame = g.inputs.get_frame()
+    if frame.dt is not None:
+        g.dt = frame.dt
+    g.mx, g.my = frame.mouse_pos
+    g.ml, g.mm, g.mr = frame.mouse_buttons
 
     camera_move_speed = m.pi*0.3 *g.dt
     
     mouse_move_events = 0
-    for ev in p.event.get():
+    for ev in frame.events:
         if ev.type == p.KEYDOWN:
             if ev.key == p.K_SPACE and 'main' in g.states:
                 if g.player.selected_mouse_control == 'look':
@@ -272,6 +328,16 @@ def handle_input():
             if ev.key == p.K_ESCAPE:
                 toggle_fullscreen()
 
+            if ev.key == p.K_F3:
+                #switch between point renderers, so they can be compared
+                g.camera.point_renderer = 'splat' if g.camera.point_renderer == 'blit' else 'blit'
+                if c_profiler_overlay:
+                    #show the new renderer straight away
+                    c_profiler_overlay.last_refresh = -m.inf
+
+            if ev.key == p.K_F4 and g.profiler:
+                c_profiler_overlay.set_visible(not c_profiler_overlay.visible)
+
         if ev.type == p.QUIT:
             g.running = False
 
@@ -287,7 +353,7 @@ def handle_input():
                 g.camera.ax = max(min(g.camera.ax,1.4),-1.4)
 
 
-    g.keys = p.key.get_pressed()
+    g.keys = frame.keys
     move_speed = 20 * g.dt
     
     dt = min(g.dt, 0.5)
@@ -333,14 +399,17 @@ def handle_input():
 
 def update():
     for model_instance in g.model_instances[:]:
-        model_instance.update()
+        with profiler.timer('instance update'):
+            model_instance.update()
 
-    if g.player.selected_tool:
-        g.player.selected_tool.update()
+    with profiler.timer('tool update'):
+        if g.player.selected_tool:
+            g.player.selected_tool.update()
 
     #todo only update one spawner
-    for point_spawner in g.point_spawners:
-        point_spawner.update()
+    with profiler.timer('spawner update'):
+        for point_spawner in g.point_spawners:
+            point_spawner.update()
 
     for hint in g.hints[:]:
         hint.update()
@@ -359,6 +428,8 @@ def update():
 
     g.pressed_buttons.clear()
 
+    update_static_geometry()
+
     g.camera.update_matrices()
 
 def draw():
@@ -373,29 +444,72 @@ def draw():
 
     for control in g.controls:
         if control.visible and control.active_state in g.states:
-            control.draw()
+            with profiler.timer('draw ' + type(control).__name__):
+                control.draw()
 
-    
-
-g.dt = 0
-
-g.running = True
-#start_game()
-#g.player.select_tool('Vertical Scanner')
-while g.running:
+def run_frame():
+    """
+    Run one frame of the game, everything apart from waiting for the next frame and showing it
+    """
     g.screen.fill('black')
     handle_events()
-    handle_input()
-    update()
-    draw()
+    with profiler.timer('input'):
+        handle_input()
+    with profiler.timer('update'):
+        update()
+    with profiler.timer('draw'):
+        draw()
 
     if not g.dt and g.player.selected_tool:
         g.player.selected_tool.use()
 
-    g.dt = min(g.game_clock.tick(60)/1000, 0.4)
+def run():
+    """
+    Run frames until the game is closed
+    """
+    g.dt = 0
+
+    g.running = True
+    #start_game()
+    #g.player.select_tool('Vertical Scanner')
+    while g.running:
+        if g.profiler:
+            g.profiler.start_frame()
 
-    
-    #if p.time.get_ticks() > 10*1000:
-    #    break
+        run_frame()
+
+        #time spent waiting for the next frame
+        with profiler.timer('tick'):
+            g.dt = min(g.game_clock.tick(60)/1000, 0.4)
+
+        
+        #if p.time.get_ticks() > 10*1000:
+        #    break
+
+        with profiler.timer('flip'):
+            p.display.flip()
+
+        if g.profiler:
+            g.profiler.end_frame()
+
+def shutdown():
+    """
+    Write out the profile and input log, and stop the ray workers
+    """
+    if g.RECORD_INPUT_PATH:
+        g.inputs.close()
+
+    if g.profiler and g.PROFILE_PATH:
+        g.profiler.write(g.PROFILE_PATH)
+
+    if g.ray_pool:
+        g.ray_pool.close()
+    shared_geometry.detach_all(g.shared_geometry)
+
+def main():
+    setup()
+    run()
+    shutdown()
 
-    p.display.flip()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
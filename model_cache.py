@@ -0,0 +1,158 @@
+import numpy as np
+import hashlib
+import os
+import shutil
+import warnings
+
+#bump this when what goes in the cache changes, so old caches get rebuilt
+CACHE_VERSION = 1
+#how many acceleration structures are kept for each model file, a new one for every place an instance is put
+#so the least recently used are removed
+MAX_ACCEL_ENTRIES = 8
+
+def get_cache_dir(path:str) -> str:
+    """
+    The cache for a model file is a folder of .npy files next to it
+    """
+    return os.path.splitext(path)[0] + '.cache'
+
+def get_key(path:str) -> str:
+    """
+    Hash of the model file, so the cache is rebuilt whenever the file changes
+    """
+    with open(path, 'rb') as file:
+        return f'{CACHE_VERSION}-{hashlib.sha1(file.read()).hexdigest()}'
+
+def get_accel_key(model_key:str, matrix:np.ndarray, params:tuple) -> str:
+    """
+    Key for the acceleration structure of an instance, which depends on the model, where the instance is and how the structure is built
+    """
+    key = hashlib.sha1(model_key.encode())
+    key.update(np.ascontiguousarray(matrix, dtype=np.float64).tobytes())
+    key.update(repr(params).encode())
+    return key.hexdigest()
+
+def get_tiles_key(model_key:str, tile_size:float) -> str:
+    """
+    Key for a model split into tiles of a given size
+    """
+    return hashlib.sha1(f'{model_key} {tile_size!r}'.encode()).hexdigest()
+
+def read_arrays(cache_dir:str, key:str) -> dict[str, np.ndarray]|None:
+    """
+    Memory map every array in a cache folder, if its key matches
+    """
+    try:
+        with open(os.path.join(cache_dir, 'key.txt')) as file:
+            if file.read() != key:
+                return None
+    except OSError:
+        return None
+
+    arrays = {}
+    for filename in os.listdir(cache_dir):
+        name, extension = os.path.splitext(filename)
+        if extension == '.npy':
+            arrays[name] = np.load(os.path.join(cache_dir, filename), mmap_mode='r')
+
+    return arrays
+
+def write_arrays(cache_dir:str, key:str, arrays:dict[str, np.ndarray]):
+    """
+    Write arrays to a cache folder
+    Failing to write the cache isn't an error, things just get rebuilt next time
+    """
+    key_path = os.path.join(cache_dir, 'key.txt')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+
+        #the key goes last, so a half written cache is never used
+        if os.path.exists(key_path):
+            os.remove(key_path)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(cache_dir, name + '.npy'), np.ascontiguousarray(array))
+
+        with open(key_path, 'w') as file:
+            file.write(key)
+
+    except OSError as e:
+        warnings.warn(f'Could not write cache "{cache_dir}": {e}')
+
+def load(path:str, key:str) -> dict[str, np.ndarray]|None:
+    """
+    Get the cached arrays for a model file, memory mapped so nothing is read until it's used
+    Returns None if there is no cache, or it's out of date
+    """
+    return read_arrays(get_cache_dir(path), key)
+
+def save(path:str, key:str, arrays:dict[str, np.ndarray]):
+    """
+    Write the arrays for a model file to its cache
+    Anything else cached from the model (e.g. acceleration structures) was made from the old file, so it's removed
+    """
+    cache_dir = get_cache_dir(path)
+    if os.path.isdir(cache_dir):
+        for filename in os.listdir(cache_dir):
+            if os.path.isdir(os.path.join(cache_dir, filename)):
+                shutil.rmtree(os.path.join(cache_dir, filename), ignore_errors=True)
+
+    write_arrays(cache_dir, key, arrays)
+
+def load_accel(path:str, accel_key:str) -> dict[str, np.ndarray]|None:
+    """
+    Get the cached acceleration structure arrays of an instance of a model file
+    """
+    accel_dir = os.path.join(get_cache_dir(path), 'accel_' + accel_key)
+    arrays = read_arrays(accel_dir, accel_key)
+    if arrays is not None:
+        #mark it as used, so prune_accel keeps it
+        try:
+            os.utime(os.path.join(accel_dir, 'key.txt'))
+        except OSError:
+            pass
+    return arrays
+
+def save_accel(path:str, accel_key:str, arrays:dict[str, np.ndarray]):
+    """
+    Cache the acceleration structure arrays of an instance, next to the model's own cache
+    """
+    write_arrays(os.path.join(get_cache_dir(path), 'accel_' + accel_key), accel_key, arrays)
+    prune_accel(path)
+
+def prune_accel(path:str, keep:int=MAX_ACCEL_ENTRIES):
+    """
+    Remove all but the most recently used acceleration structures cached for a model file
+    """
+    cache_dir = get_cache_dir(path)
+    try:
+        filenames = os.listdir(cache_dir)
+    except OSError:
+        return
+
+    entries = []
+    for filename in filenames:
+        if filename.startswith('accel_'):
+            accel_dir = os.path.join(cache_dir, filename)
+            try:
+                last_used = os.path.getmtime(os.path.join(accel_dir, 'key.txt'))
+            except OSError:
+                #half written, so it can't be used anyway
+                last_used = 0
+            entries.append( (last_used, accel_dir) )
+
+    entries.sort(reverse=True)
+    for last_used, accel_dir in entries[keep:]:
+        shutil.rmtree(accel_dir, ignore_errors=True)
+
+def load_tiles(path:str, tiles_key:str) -> dict[str, np.ndarray]|None:
+    """
+    Get the cached arrays of a model split into tiles (see level_tiles)
+    """
+    return read_arrays(os.path.join(get_cache_dir(path), 'tiles_' + tiles_key), tiles_key)
+
+def save_tiles(path:str, tiles_key:str, arrays:dict[str, np.ndarray]):
+    """
+    Cache the arrays of a model split into tiles
+    """
+    write_arrays(os.path.join(get_cache_dir(path), 'tiles_' + tiles_key), tiles_key, arrays)
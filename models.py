@@ -4,11 +4,18 @@ import numpy as np
 import math as m
 import warnings
 import os
-from copy import deepcopy
 
 import global_values as g
 import plyfile
 import GJK
+import intersections
+import octrees
+import bvh
+import transforms
+import model_cache
+import ply_reader
+import profiler
+import gfx
 
 class Point(p.Vector3):
     def __init__(self, x, y, z, colour=None):
@@ -42,6 +49,27 @@ class Point(p.Vector3):
             return True
 
 
+class PointView():
+    """
+    Read only, list-like view of a vertex array
+    Points are only created when they are asked for, so nothing needs updating per vertex when the array changes
+    """
+    def __init__(self, array:np.ndarray, colour=None):
+        self.array = array
+        self.colour = colour
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index:int) -> Point:
+        x, y, z = self.array[index, :3].tolist()
+        return Point(x, y, z, colour=self.colour)
+
+    def __iter__(self):
+        for x, y, z in self.array[:, :3].tolist():
+            yield Point(x, y, z, colour=self.colour)
+
+
 class Ray(Point):
     out_of_range_colour = (96, 96, 96)
 
@@ -94,7 +122,11 @@ class Ray(Point):
 
         colliding_models = []
 
-        for model_instance in g.model_instances:
+        end = self.origin + self.direction*self.max_dist
+        lb = (min(self.origin.x, end.x), min(self.origin.y, end.y), min(self.origin.z, end.z))
+        rt = (max(self.origin.x, end.x), max(self.origin.y, end.y), max(self.origin.z, end.z))
+
+        for model_instance in g.spatial_hash.query(lb, rt):
             if model_instance.collision_groups.isdisjoint(self.colliding_groups):
                 continue
 
@@ -126,19 +158,313 @@ class Ray(Point):
         return (None, None)
 
 
-        
+def normalise_rays(origins:np.ndarray, directions:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get ray origins and directions as (N,3) float arrays, with the directions normalised
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    return origins, directions / np.linalg.norm(directions, axis=1)[:, None]
+
+def cast_rays(origins:np.ndarray, directions:np.ndarray, max_dist:float=100, groups=set(('models','rays')), static:bool|None=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Shoot a batch of rays at once, the batched version of Ray
+    origins and directions are (N,3) arrays, directions don't need to be normalised
+    static can be set to only test static instances (True) or only the others (False)
+    Returns the hit points (N,3), hit distances (N,) and the index in g.model_instances of the instance hit (N,)
+    Rays that don't hit anything within max_dist have a distance of inf, an index of -1 and end at max_dist
+    """
+    profiler.count('rays cast', len(origins))
+    with profiler.timer('rays'):
+        origins, directions = normalise_rays(origins, directions)
+        closest_t, closest_ids = get_closest_hits(origins, directions, max_dist, groups, static)
+
+        return get_hit_points(origins, directions, closest_t, max_dist), closest_t, closest_ids
+
+def get_closest_hits(origins:np.ndarray, directions:np.ndarray, max_dist:float=100, groups=set(('models','rays')), static:bool|None=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The ray tests for cast_rays, directions need to be normalised already
+    Returns the hit distances and the indices of the instances hit
+    """
+    ray_count = len(origins)
+    closest_t = np.full(ray_count, np.inf)
+    closest_ids = np.full(ray_count, -1, dtype=np.int64)
+    if not ray_count:
+        return closest_t, closest_ids
+
+    #only instances near the rays need checking
+    ends = origins + directions*max_dist
+    lb = np.minimum(origins, ends).min(axis=0).tolist()
+    rt = np.maximum(origins, ends).max(axis=0).tolist()
+
+    #instances are vectors, so == (and list.index) compares positions, not which instance it is
+    instance_indices = {id(model_instance):i for i, model_instance in enumerate(g.model_instances)}
+
+    for model_instance in g.spatial_hash.query(lb, rt):
+        if model_instance.collision_groups.isdisjoint(groups):
+            continue
+        if static is not None and model_instance.is_static != static:
+            continue
+
+        #only test the rays that could hit the bounding sphere
+        centre = np.array([model_instance.x, model_instance.y, model_instance.z])
+        candidates = np.flatnonzero(intersections.rays_spheres(origins, directions, centre, model_instance.bounding_radius, max_dist))
+        if not len(candidates):
+            continue
+
+        triangles = model_instance.get_face_data().ray_triangles
+        pairs = model_instance.get_ray_face_pairs(origins[candidates], directions[candidates], max_dist)
+        if pairs is None:
+            #small models without an acceleration structure, where testing every face is quickest
+            t, _ = intersections.closest_rays_triangles(origins[candidates], directions[candidates], triangles)
+        else:
+            t = intersections.closest_ray_triangle_pairs(origins[candidates], directions[candidates], triangles, *pairs)
+
+        closer = (t <= max_dist) & (t < closest_t[candidates])
+        closest_t[candidates[closer]] = t[closer]
+        closest_ids[candidates[closer]] = instance_indices[id(model_instance)]
+
+    return closest_t, closest_ids
+
+def get_hit_points(origins:np.ndarray, directions:np.ndarray, closest_t:np.ndarray, max_dist:float=100) -> np.ndarray:
+    """
+    Where each ray ended, rays that missed end at max_dist
+    """
+    hit_dists = np.where(np.isfinite(closest_t), closest_t, max_dist)
+    return origins + directions * hit_dists[:, None]
+
+class PendingRays():
+    """
+    A batch of rays being cast by g.ray_pool
+    The static instances are tested in the pool's workers, and everything else is tested straight away, since it might have moved by the time the workers are done
+    """
+    def __init__(self, origins:np.ndarray, directions:np.ndarray, max_dist:float=100, groups=set(('models','rays'))):
+        self.origins, self.directions = normalise_rays(origins, directions)
+        self.max_dist = max_dist
+        self.groups = groups
+
+        #hit indices are into this copy, so they stay right if instances are added or removed before the result is ready
+        self.model_instances = g.model_instances[:]
+        #by identity, since instances are vectors and == compares their positions
+        self.instance_indices = {id(model_instance):i for i, model_instance in enumerate(self.model_instances)}
+
+        profiler.count('rays cast', len(self.origins))
+        with profiler.timer('rays'):
+            self.closest_t, self.closest_ids = get_closest_hits(self.origins, self.directions, max_dist, groups, static=False)
+        self.job_id = g.ray_pool.submit(self.origins, self.directions, max_dist, groups)
+        #slots are reused once their instance is gone, so keep the ones this batch was sent with
+        self.slot_instances = g.ray_pool.instances[:]
+
+    def get_result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]|None:
+        """
+        Returns None if the workers aren't done yet, otherwise the same as cast_rays, except the indices are into self.model_instances
+        """
+        if not g.ray_pool.has_job(self.job_id):
+            #the workers were closed and the batch went with them, so just cast it here
+            self.model_instances = g.model_instances[:]
+            self.closest_t, self.closest_ids = get_closest_hits(self.origins, self.directions, self.max_dist, self.groups)
+            return get_hit_points(self.origins, self.directions, self.closest_t, self.max_dist), self.closest_t, self.closest_ids
+
+        result = g.ray_pool.get_result(self.job_id)
+        if result is None:
+            return None
+        static_t, static_slots = result
+
+        #static instances come first in the broad phase, so they win ties like they would in cast_rays
+        closer = static_t <= self.closest_t
+        self.closest_t[closer] = static_t[closer]
+        for slot in np.unique(static_slots[closer]).tolist():
+            if slot != -1:
+                self.closest_ids[closer & (static_slots == slot)] = self.instance_indices[id(self.slot_instances[slot])]
+
+        return get_hit_points(self.origins, self.directions, self.closest_t, self.max_dist), self.closest_t, self.closest_ids
+
+    def cancel(self):
+        """
+        Throw away the result
+        """
+        g.ray_pool.cancel(self.job_id)
+
+
+
+
+
+def get_other_index(arr):
+    """
+    Get the index of the triangle vertex that's on its own side of the other triangle's plane
+    """
+    epsilon = 0.000_000_001
+    if (arr[0] * arr[1]) > epsilon :
+        return 2
+    if (arr[0] * arr[2])  > epsilon :
+        return 1
+    if (arr[1] * arr[2])  > epsilon :
+        return 0
+
+    warnings.warn(f'get_other_index first check failed with {arr}, epsilon: {epsilon}')
+
+    #more precise check
+    if (arr[0] <= 0 and arr[1] <= 0 and arr[2] > 0) or (arr[0] > 0 and arr[1] > 0 and arr[2] < 0) :
+        return 2
+    if (arr[0] <= 0 and arr[2] <= 0 and arr[2] > 0) or (arr[0] > 0 and arr[2] > 0 and arr[1] < 0) :
+        return 1
+    if (arr[1] <= 0 and arr[2] <= 0 and arr[0] > 0) or (arr[1] > 0 and arr[2] > 0 and arr[0] < 0) :
+        return 0
+
+    warnings.warn(f'get_other_index second check failed!')
+
+    #just guess and hope it doesn't lead to an error, hopefully we never get here
+    return 0
+
+def get_projection(D, po1, po2, po3, d0, d1, d2):
+    """
+    Get the interval a triangle covers on the planes' intersection line
+    """
+    #project onto plane intersection line
+    proj = [D.dot(po1), D.dot(po2), D.dot(po3)]
+    i = get_other_index([d0, d1, d2])
+    #rearrange vertices
+
+    if i != 0:
+        proj[0], proj[i] = proj[i], proj[0]
+
+        d = [d0, d1, d2]
+        d[0], d[i] = d[i], d[0]
+        d0, d1, d2 = d
+
+    t1 = proj[0] + (proj[1] - proj[0]) * (d0 / (d0 - d1) )
+    t2 = proj[0] + (proj[2] - proj[0]) * (d0 / (d0 - d2) )
+    return t1, t2
+
+def triangles_colliding(a0:p.Vector3, a1:p.Vector3, a2:p.Vector3, normal1:p.Vector3, plane1:float,
+                        b0:p.Vector3, b1:p.Vector3, b2:p.Vector3, normal2:p.Vector3, plane2:float) -> bool:
+    """
+    Check if two triangles are colliding (Moller's interval overlap test)
+    The normals are (v1-v0)x(v2-v0) and the planes are normal.v0, as stored in FaceData
+    """
+    #check SAT
+    sides1 = [plane1 - normal1.dot(b0), plane1 - normal1.dot(b1), plane1 - normal1.dot(b2)]
+
+    #check if we are on the same side
+    if not any(sides1):
+        return False
+    if (sides1[0] < 0) and (sides1[1] < 0) and (sides1[2] < 0):
+        return False
+    if (sides1[0] > 0) and (sides1[1] > 0) and (sides1[2] > 0):
+        return False
+
+    #now the other way around
+    sides2 = [plane2 - normal2.dot(a0), plane2 - normal2.dot(a1), plane2 - normal2.dot(a2)]
+
+    #check if we are on the same side
+    if not any(sides2):
+        return False
+    if (sides2[0] < 0) and (sides2[1] < 0) and (sides2[2] < 0):
+        return False
+    if (sides2[0] > 0) and (sides2[1] > 0) and (sides2[2] > 0):
+        return False
+
+    #get intersection of planes
+    D = normal1.cross(normal2)
+
+    #triangle1
+    t1, t2 = get_projection(D, a0, a1, a2, *sides2)
+    #triangle2
+    t3, t4 = get_projection(D, b0, b1, b2, *sides1)
+
+    if t2 < t1:
+        t1, t2 = t2, t1
+    if t4 < t3:
+        t3, t4 = t4, t3
+
+    if (t1 <= t2 <= t3 <= t4) or (t3 <= t4 <= t1 <= t2):
+        return False
+
+    return True
+
+
+class FaceData():
+    """
+    Cached transformed face data for a model instance, so intersection tests don't recalculate edges and normals
+    Only rebuilt after the instance's vertices actually move
+    """
+    def __init__(self, model_instance):
+        self.model_instance = model_instance
+
+        self.v0:np.ndarray = None
+        self.v1:np.ndarray = None
+        self.v2:np.ndarray = None
+        self.e1:np.ndarray = None
+        self.e2:np.ndarray = None
+        #(v1-v0)x(v2-v0)
+        self.normals:np.ndarray = None
+        #normal.v0, so points on the face satisfy normal.p = plane
+        self.planes:np.ndarray = None
+
+        #everything intersections.rays_triangles needs
+        self.ray_triangles:tuple = None
+
+        self._vectors = None
+        self.dirty = True
+
+    def invalidate(self):
+        """
+        Mark the data as out of date, it will be rebuilt next time it's needed
+        """
+        self.dirty = True
+        self._vectors = None
+
+    def rebuild(self):
+        vertices = self.model_instance.transformed_vertex_array[:, :3]
+        face_array = self.model_instance.model.face_array
+
+        self.v0 = vertices[face_array[:, 0]]
+        self.v1 = vertices[face_array[:, 1]]
+        self.v2 = vertices[face_array[:, 2]]
+        self.e1 = self.v1 - self.v0
+        self.e2 = self.v2 - self.v0
+
+        self.ray_triangles = intersections.prepare_triangles(self.v0, self.e1, self.e2)
+        self.normals = self.ray_triangles[2]
+        self.planes = self.ray_triangles[3]
+
+        self.dirty = False
+
+    def get_triangles(self, face_indices:np.ndarray=None) -> tuple:
+        """
+        Get (v0, v1, v2, normals, planes) for some of the faces, or all of them if face_indices is None
+        This is what intersections.triangles_colliding needs
+        """
+        triangles = (self.v0, self.v1, self.v2, self.normals, self.planes)
+        if face_indices is None:
+            return triangles
+        return tuple(array[face_indices] for array in triangles)
+
+    @property
+    def vectors(self) -> list[tuple]:
+        """
+        The same data as vectors, for the per face tests
+        Each entry is (v0, v1, v2, e1, e2, normal, plane)
+        """
+        if self._vectors is None:
+            self._vectors = [(p.Vector3(v0), p.Vector3(v1), p.Vector3(v2), p.Vector3(e1), p.Vector3(e2), p.Vector3(normal), plane)
+                             for v0, v1, v2, e1, e2, normal, plane in zip(self.v0.tolist(), self.v1.tolist(), self.v2.tolist(),
+                                                                         self.e1.tolist(), self.e2.tolist(), self.normals.tolist(), self.planes.tolist())]
+        return self._vectors
 
 
 class Face():
     """
     Triangular face
     """
-    def __init__(self, model, vertex_indices) -> None:
+    def __init__(self, model, vertex_indices, index:int=0) -> None:
         self.vertex_indices = vertex_indices
         if len(self.vertex_indices) != 3:
             raise Exception(f'Expected 3 vertex face, got {len(self.vertex_indices)}')
 
         self.model = model
+        #position of this face in the model, used to look up cached face data
+        self.index = index
         
         #don't use this, since faces are maintained between model instances
         #self.points: tuple[Point]  = tuple(model.points[i] for i in self.vertex_indices)
@@ -176,126 +502,21 @@ class Face():
         """
         Check if this face is colliding with a triangle
         """
-        #todo optimise
+        a0, a1, a2, e1, e2, normal1, plane1 = model_instance.get_face_data().vectors[self.index]
 
-        def get_other_index(arr):
-            epsilon = 0.000_000_001
-            if (arr[0] * arr[1]) > epsilon :
-                return 2
-            if (arr[0] * arr[2])  > epsilon :
-                return 1
-            if (arr[1] * arr[2])  > epsilon :
-                return 0
+        normal2 = (p1 - p0).cross(p2 - p0)
+        plane2 = normal2.dot(p0)
 
-            warnings.warn(f'get_other_index first check failed with {arr}, epsilon: {epsilon}')
-
-            #more precise check
-            if (arr[0] <= 0 and arr[1] <= 0 and arr[2] > 0) or (arr[0] > 0 and arr[1] > 0 and arr[2] < 0) :
-                return 2
-            if (arr[0] <= 0 and arr[2] <= 0 and arr[2] > 0) or (arr[0] > 0 and arr[2] > 0 and arr[1] < 0) :
-                return 1
-            if (arr[1] <= 0 and arr[2] <= 0 and arr[0] > 0) or (arr[1] > 0 and arr[2] > 0 and arr[0] < 0) :
-                return 0
-
-            warnings.warn(f'get_other_index second check failed!')
-
-            #just guess and hope it doesn't lead to an error, hopefully we never get here
-            return 0
-
-
-            
-        def get_projection(po1, po2, po3, d0, d1, d2):
-            #project onto plane intersection line
-            proj0 = D.dot(po1)
-            proj1 = D.dot(po2)
-            proj2 = D.dot(po3)
-            i = get_other_index([d0, d1, d2])
-            proj = [proj0, proj1, proj2]
-            #rearrange vertices
-
-            if i != 0:
-                temp = proj0
-                proj[0] = proj[i]
-                proj[i] = temp
-
-                d = [d0, d1, d2]
-                temp = d0
-                d[0] = d[i]
-                d[i] = temp
-                d0, d1, d2 = d
-
-            t1 = proj[0] + (proj[1] - proj[0]) * (d0 / (d0 - d1) )
-            t2 = proj[0] + (proj[2] - proj[0]) * (d0 / (d0 - d2) )
-            return t1, t2
-
-
-        #check SAT
-        anchor1 = self.get_point(model_instance, 0)
-
-        edge1 = self.get_point(model_instance, 2) - self.get_point(model_instance, 0)
-        edge2 = self.get_point(model_instance, 1) - self.get_point(model_instance, 0)
-
-        normal1 = (edge1).cross(edge2)
-        d1 = (-normal1).dot( self.get_point(model_instance, 0) )
-
-        sides1 = []
-        for point in [p0, p1, p2]:
-            side = normal1.dot(point) + d1
-
-            sides1.append(side)
-
-        #check if we are on the same side
-        if not any(sides1):
-            return False
-        if (sides1[0] < 0) and (sides1[1] < 0) and (sides1[2] < 0):
-            return False
-        if (sides1[0] > 0) and (sides1[1] > 0) and (sides1[2] > 0):
-            return False
-        
-        #now the other way around
-        anchor2 = p0
-
-        edge1 = p2 - p0
-        edge2 = p1 - p0
-
-        normal2 = (edge1).cross(edge2)
-        d2 = (-normal2).dot( p0 )
-
-        sides2 = []
-        for point in [self.get_point(model_instance, 0), self.get_point(model_instance, 1), self.get_point(model_instance, 2)]:
-            side = normal2.dot(point) + d2
-
-            sides2.append(side)
-
-
-        #check if we are on the same side     
-        if not any(sides2):
-            return False
-        if (sides2[0] < 0) and (sides2[1] < 0) and (sides2[2] < 0):
-            return False
-        if (sides2[0] > 0) and (sides2[1] > 0) and (sides2[2] > 0):
-            return False
-        
-        
-        #get intersection of planes
-        D = normal1.cross(normal2)
-        
-        #triangle1
-        t1, t2 = get_projection(self.get_point(model_instance, 0), self.get_point(model_instance, 1), self.get_point(model_instance, 2), *sides2)
-        #triangle2
-        t3, t4 = get_projection(p0, p1, p2, *sides1)
-        
-        if t2 < t1:
-            t1, t2 = t2, t1
-        if t4 < t3:
-            t3, t4 = t4, t3
-        
-        if (t1 <= t2 <= t3 <= t4) or (t3 <= t4 <= t1 <= t2):
-            return False
+        return triangles_colliding(a0, a1, a2, normal1, plane1, p0, p1, p2, normal2, plane2)
 
-        return True
+    def colliding_face(self, model_instance, face, face_model_instance) -> bool:
+        """
+        Check if this face is colliding with a face of another instance, using the cached data for both
+        """
+        a0, a1, a2, e1, e2, normal1, plane1 = model_instance.get_face_data().vectors[self.index]
+        b0, b1, b2, e1, e2, normal2, plane2 = face_model_instance.get_face_data().vectors[face.index]
 
-    
+        return triangles_colliding(a0, a1, a2, normal1, plane1, b0, b1, b2, normal2, plane2)
 
     def colliding_ray(self, ray:Ray, model_instance): #-> bool|tuple[bool, p.Vector3]:
         """
@@ -303,8 +524,7 @@ class Face():
         """
         #TODO: Cython this at the end
 
-        edge1 = model_instance.points[self.vertex_indices[1]] - model_instance.points[self.vertex_indices[0]]
-        edge2 = model_instance.points[self.vertex_indices[2]] - model_instance.points[self.vertex_indices[0]]
+        v0, v1, v2, edge1, edge2, normal, plane = model_instance.get_face_data().vectors[self.index]
 
         h = ray.direction.cross(edge2)
         a = edge1.dot(h)
@@ -313,7 +533,7 @@ class Face():
             return  None
         
         f = 1.0 / a
-        s = ray.origin - model_instance.points[self.vertex_indices[0]]
+        s = ray.origin - v0
         u = f * s.dot(h)
 
         if (u < 0.0 or u > 1.0):
@@ -339,36 +559,104 @@ class Face():
 
 class Model():
     
-    def __init__(self, name:str, points, faces_data, is_convex:bool=False, colour='red'):
+    def __init__(self, name:str, points, faces_data, is_convex:bool=False, colour='red', bounding_radius:float=None):
+        """
+        points and faces_data can be lists of Points and vertex indices, or (N,3) arrays (see load)
+        """
         self.name = name
-        self.points = points
 
-        point_list = []
-        for point in self.points:
-            if colour and not point.colour:
-                point.colour = colour
-            point_list.append( [point[0], point[1], point[2]] )
+        if isinstance(points, np.ndarray):
+            #points are only made when they're asked for
+            self.point_array = points
+            self.points = PointView(self.point_array, colour)
+        else:
+            self.points = points
 
-        self.point_array = np.array(point_list)
+            point_list = []
+            for point in self.points:
+                if colour and not point.colour:
+                    point.colour = colour
+                point_list.append( [point[0], point[1], point[2]] )
+
+            self.point_array = np.array(point_list)
 
-        self.faces = [Face(self, d) for d in faces_data]
+        #homogeneous copy of the points, shared by every instance of this model and never written to
+        self.vertex_array = np.ones( (len(self.point_array), 4) )
+        self.vertex_array[:, :3] = self.point_array
+        self.vertex_array.flags.writeable = False
+
+        if isinstance(faces_data, np.ndarray):
+            self.faces = [Face(self, d, i) for i,d in enumerate(faces_data.tolist())]
+            self.face_array = faces_data
+        else:
+            self.faces = [Face(self, d, i) for i,d in enumerate(faces_data)]
+            #vertex indices of every face, used for vectorised collision
+            self.face_array = np.array([face.vertex_indices for face in self.faces], dtype=np.int64).reshape(-1, 3)
 
         self.is_convex = is_convex
 
         #create our bounding box
-        self.bounding_radius:float = 0
-        for point in self.points:
-            mag = point.magnitude()
-            if mag > self.bounding_radius:
-                self.bounding_radius = mag
+        if bounding_radius is not None:
+            self.bounding_radius:float = bounding_radius
+        else:
+            self.bounding_radius:float = 0
+            for point in self.points:
+                mag = point.magnitude()
+                if mag > self.bounding_radius:
+                    self.bounding_radius = mag
+
+        #bvh of the faces in model space, instances that aren't rotated can use a moved copy of it
+        self.bvh:bvh.BVH = None
+
+        #the file this model was loaded from and its hash, used to cache instance acceleration structures
+        self.cache_path:str = None
+        self.cache_key:str = None
+
+        #see get_inner_radius
+        self.inner_radius:float = None
+        #see get_point_colours
+        self.point_colours:np.ndarray = None
 
         g.models[self.name] = self
-        self.generate_point_arrays()
+        if not isinstance(self.points, PointView):
+            self.generate_point_arrays()
 
     def generate_point_arrays(self):
         for point in self.points:
             point.update_array()
 
+    def get_point_colours(self) -> np.ndarray:
+        """
+        The rgb colour of each point as an (N,3) array for drawing, made the first time it's needed
+        """
+        if self.point_colours is None:
+            if isinstance(self.points, PointView):
+                #every point has the same colour, so there's no need to make them
+                self.point_colours = np.tile(np.array(gfx.get_rgb(self.points.colour), dtype=np.uint8), (len(self.points), 1))
+            else:
+                self.point_colours = np.array([gfx.get_rgb(point.colour) for point in self.points], dtype=np.uint8).reshape(-1, 3)
+
+        return self.point_colours
+
+    def get_inner_radius(self) -> float:
+        """
+        Radius of the biggest ball around the origin that fits inside the model, so any instance is at least twice this wide in every direction
+        0 if we aren't convex, or the origin isn't inside
+        """
+        if self.inner_radius is None:
+            self.inner_radius = 0.0
+            if self.is_convex and len(self.face_array):
+                v0 = self.point_array[self.face_array[:, 0]]
+                normals = intersections.cross(self.point_array[self.face_array[:, 1]] - v0, self.point_array[self.face_array[:, 2]] - v0)
+                lengths = np.linalg.norm(normals, axis=1)
+                valid = lengths > 0
+                #signed distance from the origin to each face's plane, all the same sign when the origin is inside
+                distances = (normals[valid]*v0[valid]).sum(axis=1) / lengths[valid]
+                if len(distances) and ((distances > 0).all() or (distances < 0).all()):
+                    self.inner_radius = float(np.abs(distances).min())
+
+        return self.inner_radius
+
     
 class AABB():
     """
@@ -589,15 +877,19 @@ class ModelInstance(p.Vector3):
         self.old_az = self.az
 
         self.points = []
-        #store a copy of the model point data in a numpy array for quick access
+        #cached edges/normals of the transformed faces
+        self.face_data = FaceData(self)
+        #the model's (read only) vertex array, shared with every other instance of the model
         self.vertex_array:np.ndarray = None
         #store a copy of the TRANSFORMED model point data so calculations don't need to be repeated
         self.transformed_vertex_array:np.ndarray = None
         self.do_convex_check = True
+        #separating axes from the last GJK against each other instance, keyed by their broad_phase_id
+        self.separating_axes = {}
 
-        self.s_translation:np.matrix = None
-        self.s_mat_rotation:np.matrix = None
-        self.s_mat_full:np.matrix = None
+        #full model matrix, reused between frames
+        self.transform = transforms.Transform()
+        self.s_mat_full:np.ndarray = self.transform.matrix
         
 
         #defines which instances check for collision against this instance
@@ -610,6 +902,11 @@ class ModelInstance(p.Vector3):
 
         self.octree_depth = 0
         self.bounding_AABB = None
+        self.octree:octrees.LinearOctree = None
+
+        #which acceleration structure to use for faces, 'octree' (needs octree_depth) or 'bvh'
+        self.accel = 'octree'
+        self.bvh:bvh.BVH = None
 
         #unlike bounding_AABB, which is only generated for octrees
         #this is a looser box that works with rotation and is only used for octree tests
@@ -619,6 +916,7 @@ class ModelInstance(p.Vector3):
 
         self.deleted = False
         g.model_instances.append(self)
+        g.spatial_hash.insert(self)
 
         self.generate_model_copy()
         self.update_matrices()
@@ -626,7 +924,9 @@ class ModelInstance(p.Vector3):
         
         #if we are using an octree, generate the AABBs for that
         #NOTE: only do this with static model instances
-        if self.octree_depth:
+        if self.accel == 'bvh':
+            self.generate_BVH()
+        elif self.octree_depth:
             self.generate_AABB()
         self.generate_loose_AABB()
 
@@ -643,46 +943,115 @@ class ModelInstance(p.Vector3):
 
         #if octree depth is set, we devide the model using an octree data structure and record which faces are in which nodes
 
-        lb = self.xyz
-        rt = self.xyz
+        vertices = self.transformed_vertex_array[:, :3]
+        origin = np.array([self.x, self.y, self.z])
 
-        for point in self.points:
-            rt.x = max(rt.x, point.x)
-            rt.y = max(rt.y, point.y)
-            rt.z = max(rt.z, point.z)
+        lb = np.minimum(vertices.min(axis=0), origin)
+        rt = np.maximum(vertices.max(axis=0), origin)
 
-            lb.x = min(lb.x, point.x)
-            lb.y = min(lb.y, point.y)
-            lb.z = min(lb.z, point.z)
+        self.bounding_AABB = AABB(p.Vector3(*lb), p.Vector3(*rt))
 
-        self.bounding_AABB = AABB(lb, rt)
+        self.octree = octrees.LinearOctree(lb, rt, self.octree_depth)
 
-        self.bounding_AABB.generate_children(0, self.octree_depth)
-        
-        face_i = 0
-        for face in self.faces:
-            aabb = face.generate_AABB(self)
-            self.bounding_AABB.colliding_AABB_recursive(aabb, face_i)
+        arrays = self.load_accel( ('octree', self.octree_depth) )
+        if arrays:
+            self.octree.leaf_offsets = arrays['leaf_offsets']
+            self.octree.leaf_faces = arrays['leaf_faces']
+        else:
+            #bounding box of every face
+            face_vertices = vertices[self.model.face_array]
+            self.octree.insert_faces(face_vertices.min(axis=1), face_vertices.max(axis=1))
+            self.save_accel( ('octree', self.octree_depth), {'leaf_offsets':self.octree.leaf_offsets, 'leaf_faces':self.octree.leaf_faces})
 
-            face_i += 1
+    def generate_BVH(self):
+        """
+        Generate a BVH for the faces of this model instance
+        NOTE: like the octree, only do this with static model instances
+        """
+        v0, e1, e2 = self.get_triangle_arrays()
 
-    def generate_model_copy(self):
+        if self.model.bvh and not (self.ax or self.ay or self.az):
+            #without rotation the vertices have just been moved, so the model's bvh can be moved too instead of building a new one
+            self.bvh = self.model.bvh.translated( (self.x, self.y, self.z) )
+        else:
+            arrays = self.load_accel( ('bvh',) )
+            if arrays:
+                self.bvh = bvh.BVH.from_arrays(arrays)
+            else:
+                face_vertices = self.transformed_vertex_array[:, :3][self.model.face_array]
+                self.bvh = bvh.BVH(face_vertices.min(axis=1), face_vertices.max(axis=1))
+                self.save_accel( ('bvh',), self.bvh.get_arrays())
+        self.bvh.set_triangles(v0, e1, e2)
+
+    def get_accel_key(self, params:tuple) -> str|None:
         """
-        Copy the model data into this instance so we can manipulate it with matrices
+        Key for caching our acceleration structure, or None if the model didn't come from a file
         """
-        self.points = deepcopy(self.model.points)
+        if not self.model.cache_key:
+            return None
+        return model_cache.get_accel_key(self.model.cache_key, self.s_mat_full, params)
 
-        if self.colour:
-            for point in self.points:
-                point.colour
+    def load_accel(self, params:tuple) -> dict[str, np.ndarray]|None:
+        """
+        Get the arrays of an acceleration structure built by an earlier run, if the model, transform and params all match
+        """
+        accel_key = self.get_accel_key(params)
+        if not accel_key:
+            return None
+        return model_cache.load_accel(self.model.cache_path, accel_key)
+
+    def save_accel(self, params:tuple, arrays:dict[str, np.ndarray]):
+        """
+        Cache the arrays of an acceleration structure so later runs don't need to build it
+        """
+        accel_key = self.get_accel_key(params)
+        if accel_key:
+            model_cache.save_accel(self.model.cache_path, accel_key, arrays)
+
+    def get_face_indices_in_box(self, lb, rt) -> np.ndarray|None:
+        """
+        Get the indices of the faces that could be colliding with a box, using whichever acceleration structure we have
+        Returns None if we don't have one, meaning every face needs checking
+        """
+        if self.bvh:
+            return self.bvh.query_AABB(lb, rt)
+        elif self.octree_depth:
+            return self.octree.query_AABB(lb, rt)
+        return None
 
-        self.vertex_array = np.ones( (len(self.points), 4) )
+    def get_ray_face_pairs(self, origins:np.ndarray, directions:np.ndarray, max_dist:float) -> tuple[np.ndarray, np.ndarray]|None:
+        """
+        Get the (ray index, face index) pairs that could be hitting, for a batch of rays, using whichever acceleration structure we have
+        Returns None if we don't have one, meaning every face needs checking
+        """
+        if self.bvh:
+            return self.bvh.query_rays(origins, directions, max_dist)
+        elif self.octree_depth:
+            return self.octree.query_rays(origins, directions, max_dist)
+        return None
+
+    def get_faces_in_AABB(self, aabb:AABB) -> list[Face]:
+        """
+        Get the faces that could be colliding with a box, using whichever acceleration structure we have
+        """
+        face_indices = self.get_face_indices_in_box(aabb.lb, aabb.rt)
+        if face_indices is None:
+            return self.faces
+
+        return [self.faces[i] for i in face_indices.tolist()]
 
-        for i,point in enumerate(self.points):
-            self.vertex_array[i] = [point.x, point.y, point.z, 1.0]
+    def generate_model_copy(self):
+        """
+        Set up the vertex arrays for this instance
+        The model's vertices are shared, only the transformed ones belong to this instance
+        """
+        self.vertex_array = self.model.vertex_array
         
         self.transformed_vertex_array = self.vertex_array.copy()
 
+        #points are just a view of the transformed vertices, so moving doesn't need to update them
+        self.points = PointView(self.transformed_vertex_array, self.colour)
+
             
 
     def update(self):
@@ -696,11 +1065,12 @@ class ModelInstance(p.Vector3):
         
 
     def update_vertex_array(self):
-        if self.old_origin != self or (self.ax != self.old_ax or self.ay != self.old_ay or self.az != self.old_ay):
-            for i in range(len(self.points)):
-                self.s_mat_full.dot(self.vertex_array[i], out=self.transformed_vertex_array[i])
+        if self.old_origin != self or (self.ax != self.old_ax or self.ay != self.old_ay or self.az != self.old_az):
+            #transform every vertex in one go, (N,4) @ (4,4).T
+            np.matmul(self.vertex_array, self.s_mat_full.T, out=self.transformed_vertex_array)
 
-                self.points[i].update_through_array(self.transformed_vertex_array[i])
+            self.face_data.invalidate()
+            g.spatial_hash.update(self)
             
             self.old_origin.xyz = self.xyz
             self.old_ax = self.ax
@@ -729,41 +1099,55 @@ class ModelInstance(p.Vector3):
         
         #check for convex collision first
         if self.do_convex_check and model_instance.do_convex_check:
-            res = GJK.GJK(self.transformed_vertex_array, model_instance.transformed_vertex_array)
+            key = model_instance.broad_phase_id
+            res = GJK.GJK_closed_form(self.transformed_vertex_array, model_instance.transformed_vertex_array, self.separating_axes.get(key))
             if not res[0]:
+                self.separating_axes[key] = res[2]
                 return False
+
+            self.separating_axes.pop(key, None)
             #if the model IS convex, just return here
-            elif self.is_convex and model_instance.is_convex:
+            if self.is_convex and model_instance.is_convex:
                 model_instance.on_colliding(self)
                 return res[0]
         
         #check for face
-        if model_instance.octree_depth:
-            face_indices = model_instance.bounding_AABB.get_faces_to_test_recursive_AABB(self.loose_bounding_AABB)
-            faces1 = [model_instance.faces[i] for i in face_indices]
-        else:
-            faces1 = model_instance.faces
+        face_indices1 = model_instance.get_face_indices_in_box(self.loose_bounding_AABB.lb, self.loose_bounding_AABB.rt)
+        face_indices2 = self.get_face_indices_in_box(model_instance.loose_bounding_AABB.lb, model_instance.loose_bounding_AABB.rt)
+        if face_indices1 is None:
+            face_indices1 = np.arange(len(model_instance.faces))
+        if face_indices2 is None:
+            face_indices2 = np.arange(len(self.faces))
+
+        if len(face_indices1) * len(face_indices2) >= intersections.MIN_FILTER_PAIRS:
+            #drop the faces with all of the other side's faces on one side of their plane, which is much cheaper than testing them in pairs
+            triangles1 = model_instance.get_face_data().get_triangles(face_indices1)
+            triangles2 = self.get_face_data().get_triangles(face_indices2)
+
+            straddling1 = intersections.faces_straddling(triangles1[3], triangles1[4], np.concatenate(triangles2[:3]))
+            triangles1 = tuple(array[straddling1] for array in triangles1)
+            face_indices1 = face_indices1[straddling1]
+
+            straddling2 = intersections.faces_straddling(triangles2[3], triangles2[4], np.concatenate(triangles1[:3]))
+            triangles2 = tuple(array[straddling2] for array in triangles2)
+            face_indices2 = face_indices2[straddling2]
+
+            if len(face_indices1) * len(face_indices2) >= intersections.MIN_BATCH_PAIRS:
+                #test every pair of faces left in one go
+                if intersections.first_triangles_colliding(triangles1, triangles2):
+                    model_instance.on_colliding(self)
+                    return True
+                return False
 
-        if self.octree_depth:
-            face_indices = self.bounding_AABB.get_faces_to_test_recursive_AABB(model_instance.loose_bounding_AABB)
-            faces2 = [self.faces[i] for i in face_indices]
-        else:
-            faces2 = self.faces
+        faces1 = [model_instance.faces[i] for i in face_indices1.tolist()]
+        faces2 = [self.faces[i] for i in face_indices2.tolist()]
 
-        i = 0
         for face in faces1:
-            p0 = model_instance.points[face.vertex_indices[0]]
-            p1 = model_instance.points[face.vertex_indices[1]]
-            p2 = model_instance.points[face.vertex_indices[2]]
-
-            j = 0
             for self_face in faces2:
-                res = self_face.colliding_triangle(self, p0, p1, p2)
+                res = self_face.colliding_face(self, face, model_instance)
                 if res:
                     model_instance.on_colliding(self)
                     return res
-                j += 1
-            i += 1
 
         return False
     
@@ -771,17 +1155,62 @@ class ModelInstance(p.Vector3):
         """
         Check whether this instance is colliding with any other model instance
         """
-        for model_instance in g.model_instances:
-            if model_instance == self:
-                continue
+        with profiler.timer('collision'):
+            for model_instance in g.spatial_hash.query_instance(self):
+                if model_instance == self:
+                    continue
 
-            if model_instance.collision_groups.isdisjoint(self.colliding_groups):
-                continue
+                if model_instance.collision_groups.isdisjoint(self.colliding_groups):
+                    continue
 
-            res = self.is_colliding_model_instance(model_instance)
-            if res:
-                return model_instance
-        return False
+                profiler.count('collision pairs')
+                res = self.is_colliding_model_instance(model_instance)
+                if res:
+                    return model_instance
+            return False
+
+    def get_time_of_impact(self, vec:p.Vector3, skin:float=0.01) -> float:
+        """
+        Find how much of a move we can make before hitting a static instance (one with a bvh or octree)
+        Returns the safe fraction of vec, stopping skin short of the hit, or 1 if nothing is in the way
+        Our vertices are swept into their faces and their vertices are swept back into our faces,
+        edge to edge contacts are missed, so is_colliding still needs checking afterwards
+        """
+        move = np.array([vec.x, vec.y, vec.z])
+        length = float(np.linalg.norm(move))
+        if length <= 0:
+            return 1.0
+        direction = move / length
+
+        vertices = self.transformed_vertex_array[:, :3]
+        lb = vertices.min(axis=0)
+        rt = vertices.max(axis=0)
+        swept_lb = np.minimum(lb, lb+move).tolist()
+        swept_rt = np.maximum(rt, rt+move).tolist()
+
+        closest = m.inf
+        with profiler.timer('collision'):
+            for model_instance in g.spatial_hash.query(swept_lb, swept_rt):
+                if model_instance == self:
+                    continue
+                if model_instance.collision_groups.isdisjoint(self.colliding_groups):
+                    continue
+                if not model_instance.is_static:
+                    continue
+
+                face_indices = model_instance.get_face_indices_in_box(swept_lb, swept_rt)
+                if not len(face_indices):
+                    continue
+
+                triangles = tuple(array[face_indices] for array in model_instance.get_face_data().ray_triangles)
+                closest = min(closest, intersections.sweep_points_triangles(vertices, direction, triangles))
+
+                other_vertices = model_instance.transformed_vertex_array[np.unique(model_instance.model.face_array[face_indices]), :3]
+                closest = min(closest, intersections.sweep_points_triangles(other_vertices, -direction, self.get_face_data().ray_triangles))
+
+        if closest > length + skin:
+            return 1.0
+        return max(closest - skin, 0.0) / length
 
     def on_colliding(self, collider):
         """
@@ -866,6 +1295,13 @@ class ModelInstance(p.Vector3):
     def bounding_radius(self) -> float:
         return self.model.bounding_radius
 
+    @property
+    def is_static(self) -> bool:
+        """
+        Instances with an acceleration structure never move
+        """
+        return bool(self.bvh or self.octree)
+
     @property
     def is_convex(self):
         return self.model.is_convex
@@ -874,10 +1310,9 @@ class ModelInstance(p.Vector3):
         """
         Update view matrices
         """
-        self.s_translation = self.mat_translation
-        self.s_mat_rotation= self.mat_rotate_x*self.mat_rotate_y*self.mat_rotate_z
-
-        self.s_mat_full = self.s_translation * self.s_mat_rotation 
+        #same as mat_translation * mat_rotate_x * mat_rotate_y * mat_rotate_z, without making any new matrices
+        self.transform.update(self.ax, self.ay, self.az, self.x, self.y, self.z)
+        self.s_mat_full = self.transform.matrix
 
     def colliding_ray_bounding_sphere(self, ray:Ray) -> bool:
         """
@@ -907,13 +1342,20 @@ class ModelInstance(p.Vector3):
 
         if not self.colliding_ray_bounding_sphere(ray):
             return (None, None)
+
+        if self.bvh:
+            #the bvh finds the closest face itself, skipping anything behind the closest hit
+            t, face_index = self.bvh.closest_ray(ray.origin.x, ray.origin.y, ray.origin.z, ray.direction.x, ray.direction.y, ray.direction.z, epsilon=ray.epsilon)
+            if face_index == -1:
+                return (None, None)
+            return (self.faces[face_index], ray.origin + (ray.direction * t))
         
         if self.octree_depth:
-            faces_indices = self.bounding_AABB.get_faces_to_test_recursive_ray_with_frac(ray.origin.x, ray.origin.y, ray.origin.z,
+            faces_indices = self.octree.query_ray_with_frac(ray.origin.x, ray.origin.y, ray.origin.z,
                                                                        1.0/ray.direction.x if ray.direction.x else 0,
                                                                        1.0/ray.direction.y if ray.direction.y else 0,
                                                                        1.0/ray.direction.z if ray.direction.z else 0) #todo precalculate div?
-            faces = [self.faces[i] for i in faces_indices]
+            faces = [self.faces[i] for i in faces_indices.tolist()]
         else:
             faces = self.faces
 
@@ -949,6 +1391,21 @@ class ModelInstance(p.Vector3):
         #else:
         #    return (None, None)
 
+    def get_face_data(self) -> FaceData:
+        """
+        Get the cached face data, rebuilding it if we have moved since it was made
+        """
+        if self.face_data.dirty:
+            self.face_data.rebuild()
+        return self.face_data
+
+    def get_triangle_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the first vertex and the two edges of every transformed face, for vectorised ray tests
+        """
+        face_data = self.get_face_data()
+        return face_data.v0, face_data.e1, face_data.e2
+
     def delete(self):
         """
         Delete this instance from the worls
@@ -956,31 +1413,81 @@ class ModelInstance(p.Vector3):
         if not self.deleted:
             self.deleted = True
             g.model_instances.remove(self)
+            g.spatial_hash.remove(self)
+
+            #forget the separating axes cached against us, or they'd stay around for as long as the other instance does
+            for model_instance in g.model_instances:
+                model_instance.separating_axes.pop(self.broad_phase_id, None)
+            self.separating_axes.clear()
 
             
+def get_bounding_radius(points:np.ndarray) -> float:
+    """
+    Distance of the furthest point from the origin, the same as the loop in Model
+    Written out so it rounds the same way as Vector3.magnitude
+    """
+    if not len(points):
+        return 0.0
+    mags = np.sqrt(points[:, 0]*points[:, 0] + points[:, 1]*points[:, 1] + points[:, 2]*points[:, 2])
+    return max(float(mags.max()), 0.0)
+
+def read_ply(path:str) -> dict[str, np.ndarray]:
+    """
+    Read a model file into the arrays that get cached, including a model space bvh
+    """
+    arrays = ply_reader.read_binary_ply(path)
+    if arrays:
+        points, face_array = arrays
+    else:
+        #anything the fast reader doesn't handle
+        data = plyfile.PlyData.read(path)
+
+        vertices = data['vertex']
+        points = np.column_stack( (vertices['x'], vertices['y'], vertices['z']) ).astype(np.float64)
+
+        faces = list(data['face']['vertex_indices'])
+        for face in faces:
+            if len(face) != 3:
+                raise Exception(f'Expected 3 vertex face, got {len(face)}')
+        face_array = np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+    arrays = {'points':points, 'faces':face_array, 'bounding_radius':np.array(get_bounding_radius(points))}
+
+    face_vertices = points[face_array]
+    model_bvh = bvh.BVH(face_vertices.min(axis=1), face_vertices.max(axis=1))
+    for name, array in model_bvh.get_arrays().items():
+        arrays['bvh_' + name] = array
+
+    return arrays
+
+def load_arrays(path:str) -> tuple[str, dict[str, np.ndarray]]:
+    """
+    Get the key and arrays of a model file, from its cache if that's up to date
+    """
+    key = model_cache.get_key(path)
+    arrays = model_cache.load(path, key)
+    if arrays is None:
+        arrays = read_ply(path)
+        model_cache.save(path, key, arrays)
+    return key, arrays
+
 def load(filename: str, name:str=None, is_convex:bool=False) -> Model:
     """
     Load a model from a file
+    The parsed arrays are cached next to the file (see model_cache), so after the first time they're just memory mapped
     """
-    data = plyfile.PlyData.read(os.path.join(g.DIR_MODELS,filename))
-
-    points = []
-    
-    for vert in data['vertex']:
-        x = vert['x']
-        y = vert['y']
-        z = vert['z']
-        new_point = Point(x,y,z)
-        points.append(new_point)
-
-    faces = []
-    for face in data['face']:
-        new_face = face['vertex_indices']
-        faces.append(new_face)
+    path = os.path.join(g.DIR_MODELS, filename)
+    key, arrays = load_arrays(path)
 
     if not name:
         name = filename.split('.')[0]
-    new_model = Model(name, points, faces, is_convex=is_convex)
+    new_model = Model(name, arrays['points'], arrays['faces'], is_convex=is_convex, bounding_radius=arrays['bounding_radius'].item())
+    if len(new_model.faces):
+        new_model.bvh = bvh.BVH.from_arrays({array_name:arrays['bvh_' + array_name] for array_name in bvh.ARRAY_NAMES})
+    new_model.cache_path = path
+    new_model.cache_key = key
+
+    return new_model
     
 
 class ConvexPolygon(Model):
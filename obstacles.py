@@ -20,7 +20,7 @@ class Obstacle(gameobjects.DestructableGameObj):
 
     def update(self):
         if self.cooling_down:
-            if p.time.get_ticks() - self.last_collided_time >= self.collision_cooldown*1000:
+            if g.get_ticks() - self.last_collided_time >= self.collision_cooldown*1000:
                 self.on_collision_cooldown_ended()
 
     def on_colliding(self, collider):
@@ -30,7 +30,7 @@ class Obstacle(gameobjects.DestructableGameObj):
 
         if collider == g.player:
 
-            current_time = p.time.get_ticks()
+            current_time = g.get_ticks()
             if current_time - self.last_collided_time >= self.collision_cooldown*1000:
                 self.last_collided_time = current_time
                 self.cooling_down = True
@@ -67,10 +67,10 @@ class Mine(Obstacle):
         self.sound_range = 25
 
     def update(self):
-        if p.time.get_ticks() - self.last_sound_time >= self.sound_cooldown*1000:
+        if g.get_ticks() - self.last_sound_time >= self.sound_cooldown*1000:
             if (self - g.player).magnitude() <= self.sound_range:
                 self.play_sound()
-            self.last_sound_time = p.time.get_ticks()
+            self.last_sound_time = g.get_ticks()
 
         return super().update()
 
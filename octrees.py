@@ -0,0 +1,236 @@
+import numpy as np
+import math as m
+
+class LinearOctree():
+    """
+    Fixed depth octree stored in flat numpy arrays instead of a tree of AABB objects
+    Nodes are stored level by level, and within a level by morton code, so the children of node i on one level
+    are nodes 8*i to 8*i+7 on the next level
+    The faces in each leaf are stored CSR style: the faces of leaf i are leaf_faces[leaf_offsets[i]:leaf_offsets[i+1]]
+    """
+    def __init__(self, lb:np.ndarray, rt:np.ndarray, depth:int):
+        self.lb = np.array(lb, dtype=np.float64)
+        self.rt = np.array(rt, dtype=np.float64)
+        self.depth = depth
+
+        #number of leaves along each axis
+        self.grid_size = 2**self.depth
+        self.leaf_size = (self.rt - self.lb) / self.grid_size
+
+        self.lb_list = self.lb.tolist()
+        self.rt_list = self.rt.tolist()
+        self.leaf_size_list = self.leaf_size.tolist()
+
+        #index of the first node on each level
+        self.level_offsets = np.array([(8**level - 1)//7 for level in range(self.depth+2)], dtype=np.int64)
+
+        #[node, lb/rt, axis]
+        self.node_bounds = np.empty( (self.level_offsets[-1], 2, 3) )
+        self.generate_nodes()
+
+        #morton code of every leaf, indexed by grid coordinates
+        grid = np.indices( (self.grid_size,)*3 ).reshape(3, -1).T
+        self.leaf_codes = LinearOctree.encode_morton(grid, self.depth).reshape( (self.grid_size,)*3 )
+
+        self.leaf_offsets = np.zeros(8**self.depth + 1, dtype=np.int64)
+        self.leaf_faces = np.zeros(0, dtype=np.int64)
+
+    def __str__(self):
+        return f'LinearOctree {self.lb} -> {self.rt} depth {self.depth}'
+
+    @property
+    def leaf_count(self) -> int:
+        return 8**self.depth
+
+    @staticmethod
+    def get_child_offsets() -> np.ndarray:
+        """
+        Grid offsets of the 8 children of a node, in morton order
+        """
+        k = np.arange(8)
+        return np.stack([k & 1, (k >> 1) & 1, (k >> 2) & 1], axis=1)
+
+    @staticmethod
+    def encode_morton(coords:np.ndarray, depth:int) -> np.ndarray:
+        """
+        Interleave the bits of (N,3) integer grid coordinates into morton codes
+        """
+        codes = np.zeros(len(coords), dtype=np.int64)
+        for bit in range(depth):
+            for axis in range(3):
+                codes |= ((coords[:, axis] >> bit) & 1) << (3*bit + axis)
+        return codes
+
+    def generate_nodes(self):
+        """
+        Generate the bounds of every node, level by level
+        """
+        child_offsets = LinearOctree.get_child_offsets()
+
+        coords = np.zeros( (1, 3), dtype=np.int64)
+        for level in range(self.depth+1):
+            cells = 2**level
+            size = (self.rt - self.lb) / cells
+
+            start = self.level_offsets[level]
+            end = self.level_offsets[level+1]
+            self.node_bounds[start:end, 0] = self.lb + coords*size
+            #make sure the outermost nodes line up with the root exactly
+            self.node_bounds[start:end, 1] = np.where(coords+1 == cells, self.rt, self.lb + (coords+1)*size)
+
+            coords = ((coords[:, None, :]*2) + child_offsets[None, :, :]).reshape(-1, 3)
+
+    def get_leaf_ranges(self, lbs:np.ndarray, rts:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the inclusive range of leaf grid coordinates that (N,3) boxes touch along each axis
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            low = np.ceil((lbs - self.lb) / self.leaf_size - 1)
+            high = np.floor((rts - self.lb) / self.leaf_size)
+
+        #flat axes only have one cell
+        flat = self.leaf_size <= 0
+        low[:, flat] = 0
+        high[:, flat] = 0
+
+        low = np.clip(np.nan_to_num(low), 0, self.grid_size-1).astype(np.int64)
+        high = np.clip(np.nan_to_num(high), 0, self.grid_size-1).astype(np.int64)
+        return low, high
+
+    def get_leaves_in_ranges(self, low:np.ndarray, high:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Expand (N,3) inclusive leaf coordinate ranges into leaf morton codes
+        Returns the codes and the index of the range each code came from
+        """
+        extent = np.maximum(high - low + 1, 0)
+        counts = extent[:, 0] * extent[:, 1] * extent[:, 2]
+
+        owners = np.repeat(np.arange(len(low)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        nx = extent[owners, 0]
+        ny = extent[owners, 1]
+        codes = self.leaf_codes[low[owners, 0] + local % nx,
+                                low[owners, 1] + (local // nx) % ny,
+                                low[owners, 2] + local // (nx*ny)]
+
+        return codes, owners
+
+    def insert_faces(self, face_lbs:np.ndarray, face_rts:np.ndarray):
+        """
+        Record which leaves each face's bounding box is in
+        """
+        low, high = self.get_leaf_ranges(face_lbs, face_rts)
+        codes, face_indices = self.get_leaves_in_ranges(low, high)
+
+        order = np.lexsort((face_indices, codes))
+        self.leaf_faces = face_indices[order]
+        self.leaf_offsets = np.zeros(self.leaf_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=self.leaf_count), out=self.leaf_offsets[1:])
+
+    def get_leaf_faces(self, codes:np.ndarray) -> np.ndarray:
+        """
+        Get the unique face indices stored in a set of leaves
+        """
+        starts = self.leaf_offsets[codes]
+        counts = self.leaf_offsets[codes+1] - starts
+        total = counts.sum()
+        if not total:
+            return np.zeros(0, dtype=np.int64)
+
+        local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.unique(self.leaf_faces[np.repeat(starts, counts) + local])
+
+    def query_ray_with_frac(self, ox, oy, oz, dirfracx, dirfracy, dirfracz) -> np.ndarray:
+        """
+        Get the face indices a ray could be colliding with
+        Same slab test as AABB.colliding_ray_with_frac, but done a whole level of nodes at a time
+        """
+        origin = np.array([ox, oy, oz])
+        dirfrac = np.array([dirfracx, dirfracy, dirfracz])
+
+        codes = np.zeros(1, dtype=np.int64)
+        for level in range(self.depth+1):
+            bounds = self.node_bounds[self.level_offsets[level] + codes]
+
+            t1 = (bounds[:, 0] - origin)*dirfrac
+            t2 = (bounds[:, 1] - origin)*dirfrac
+
+            tmin = np.minimum(t1, t2).max(axis=1)
+            tmax = np.maximum(t1, t2).min(axis=1)
+
+            codes = codes[(tmax >= 0) & (tmin <= tmax)]
+            if not len(codes):
+                return np.zeros(0, dtype=np.int64)
+
+            if level < self.depth:
+                codes = (codes[:, None]*8 + np.arange(8)).ravel()
+
+        return self.get_leaf_faces(codes)
+
+    def query_rays(self, origins:np.ndarray, directions:np.ndarray, max_t:float=m.inf) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get every (ray, face) pair that could be hitting, for a batch of (N,3) rays
+        Like query_ray_with_frac, but with (ray, node) pairs so the whole batch goes down a level at a time
+        Returns the ray indices and face indices of the pairs, each pair only once
+        """
+        #avoid inf*0 giving nan in the slab test
+        fracs = 1.0/np.where(directions == 0, 1e-30, directions)
+
+        rays = np.arange(len(origins), dtype=np.int64)
+        codes = np.zeros(len(origins), dtype=np.int64)
+        for level in range(self.depth+1):
+            bounds = self.node_bounds[self.level_offsets[level] + codes]
+            ray_origins = origins[rays]
+            ray_fracs = fracs[rays]
+
+            t1 = (bounds[:, 0] - ray_origins)*ray_fracs
+            t2 = (bounds[:, 1] - ray_origins)*ray_fracs
+
+            tmin = np.minimum(t1, t2).max(axis=1)
+            tmax = np.maximum(t1, t2).min(axis=1)
+
+            hit = (tmax >= 0) & (tmin <= tmax) & (tmin <= max_t)
+            rays = rays[hit]
+            codes = codes[hit]
+
+            if level < self.depth:
+                rays = np.repeat(rays, 8)
+                codes = (codes[:, None]*8 + np.arange(8)).ravel()
+
+        starts = self.leaf_offsets[codes]
+        counts = self.leaf_offsets[codes+1] - starts
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        rays = np.repeat(rays, counts)
+        faces = self.leaf_faces[np.repeat(starts, counts) + local]
+        if not len(faces):
+            return rays, faces
+
+        #faces in more than one leaf would be tested more than once
+        face_count = int(self.leaf_faces.max()) + 1
+        pairs = np.unique(rays*face_count + faces)
+        return pairs // face_count, pairs % face_count
+
+    def query_AABB(self, lb, rt) -> np.ndarray:
+        """
+        Get the face indices a box could be colliding with
+        """
+        #this is called for single small boxes, so plain floats are quicker than numpy here
+        ranges = []
+        for axis in range(3):
+            root_lb = self.lb_list[axis]
+            #check the root first, since the leaf ranges are clipped to it
+            if lb[axis] > self.rt_list[axis] or rt[axis] < root_lb:
+                return np.zeros(0, dtype=np.int64)
+
+            size = self.leaf_size_list[axis]
+            if size <= 0:
+                ranges.append(slice(0, 1))
+                continue
+
+            low = min(max(m.ceil((lb[axis] - root_lb) / size - 1), 0), self.grid_size-1)
+            high = min(max(m.floor((rt[axis] - root_lb) / size), 0), self.grid_size-1)
+            ranges.append(slice(low, high+1))
+
+        codes = self.leaf_codes[ranges[0], ranges[1], ranges[2]].ravel()
+        return self.get_leaf_faces(codes)
@@ -53,7 +53,7 @@ class Goal(Pickup):
 
     def update(self):
         if self.reached_timestamp and not self.fully_reached:
-            if p.time.get_ticks() - self.reached_timestamp >= self.win_time*1000:
+            if g.get_ticks() - self.reached_timestamp >= self.win_time*1000:
                 self.win()
 
 
@@ -74,6 +74,6 @@ class Goal(Pickup):
             g.player.power += 3
             g.player.health = g.player.max_health
 
-            self.reached_timestamp = p.time.get_ticks()
+            self.reached_timestamp = g.get_ticks()
             #return super().on_pickup()
     
\ No newline at end of file
@@ -39,7 +39,7 @@ class Tool():
         """
 
         if self.cooldown:
-            current_time = p.time.get_ticks()
+            current_time = g.get_ticks()
             if (current_time - self.last_used) >= self.cooldown*1000:
                 self.last_used = current_time
                 print('time',(current_time - self.last_used), self.last_used, current_time)
@@ -51,7 +51,7 @@ class Tool():
 class Player(gameobjects.DestructableGameObj):
     def __init__(self, origin: p.Vector3) -> None:
         self.start = p.Vector3(origin).copy()
-        super().__init__(origin, 'cube2', collision_groups=set(), colour='gray')
+        super().__init__(origin, 'cube2', collision_groups=set(), colour='gray', continuous_collision=True)
 
         g.camera = cameras.Camera()
 
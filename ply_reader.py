@@ -0,0 +1,94 @@
+import numpy as np
+
+#ply property types -> little endian numpy types
+PLY_TYPES = {
+    'char':'i1', 'int8':'i1',
+    'uchar':'u1', 'uint8':'u1',
+    'short':'<i2', 'int16':'<i2',
+    'ushort':'<u2', 'uint16':'<u2',
+    'int':'<i4', 'int32':'<i4',
+    'uint':'<u4', 'uint32':'<u4',
+    'float':'<f4', 'float32':'<f4',
+    'double':'<f8', 'float64':'<f8',
+}
+
+def read_header(data:bytes) -> tuple[str, list[tuple], int]|None:
+    """
+    Get the format, the elements as (name, count, properties) and where the body starts
+    Properties are (name, type) or (name, count type, item type) for lists
+    """
+    end = data.find(b'end_header')
+    if not data.startswith(b'ply') or end == -1:
+        return None
+    body_start = data.find(b'\n', end) + 1
+
+    file_format = None
+    elements = []
+    for line in data[:end].decode('ascii', errors='replace').splitlines():
+        words = line.split()
+        if not words:
+            continue
+
+        if words[0] == 'format':
+            file_format = words[1]
+        elif words[0] == 'element':
+            elements.append( (words[1], int(words[2]), []) )
+        elif words[0] == 'property' and elements:
+            if words[1] == 'list':
+                elements[-1][2].append( (words[4], words[2], words[3]) )
+            else:
+                elements[-1][2].append( (words[2], words[1]) )
+
+    return file_format, elements, body_start
+
+def read_binary_ply(path:str) -> tuple[np.ndarray, np.ndarray]|None:
+    """
+    Read the vertex positions (N,3) and triangle indices (F,3) of a binary little endian ply straight into arrays
+    Returns None for anything else (ascii, big endian, extra list properties, faces that aren't triangles) so it can be read the slow way
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    header = read_header(data)
+    if not header:
+        return None
+    file_format, elements, offset = header
+    if file_format != 'binary_little_endian':
+        return None
+
+    points = None
+    faces = None
+    for name, count, properties in elements:
+        if name == 'face':
+            #only the usual single list of vertex indices, with every face a triangle
+            if len(properties) != 1 or len(properties[0]) != 3:
+                return None
+            _, count_type, index_type = properties[0]
+            if count_type not in PLY_TYPES or index_type not in PLY_TYPES:
+                return None
+
+            dtype = np.dtype([('count', PLY_TYPES[count_type]), ('indices', PLY_TYPES[index_type], (3,))])
+            face_data = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            if (face_data['count'] != 3).any():
+                return None
+
+            faces = face_data['indices'].astype(np.int64)
+
+        else:
+            #lists have a different length per element, so we can't step over them
+            if any(len(prop) != 2 or prop[1] not in PLY_TYPES for prop in properties):
+                return None
+
+            dtype = np.dtype([(prop_name, PLY_TYPES[prop_type]) for prop_name, prop_type in properties])
+            element_data = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
+            if name == 'vertex':
+                if not {'x', 'y', 'z'} <= set(dtype.names):
+                    return None
+                points = np.column_stack( (element_data['x'], element_data['y'], element_data['z']) ).astype(np.float64)
+
+        offset += dtype.itemsize * count
+
+    if points is None or faces is None:
+        return None
+    return points, faces
@@ -1,80 +1,181 @@
 import pygame as p
+import numpy as np
 import math as m
 
 import models
 import global_values as g
+import gfx
 
 import random as r
 
+class PointCloud():
+    """
+    Ring buffer of points stored as arrays rather than Point objects
+    Once it's full, new points overwrite the oldest ones
+    """
+    def __init__(self, max_points:int) -> None:
+        self.max_points = max_points
+
+        self.positions = np.zeros( (self.max_points, 3), dtype=np.float32)
+        self.colours = np.zeros( (self.max_points, 3), dtype=np.uint8)
+        #-1 means the point is never deleted
+        self.delete_timestamps = np.full(self.max_points, -1, dtype=np.int64)
+        #broad_phase_id of the instance the point is on, -1 for nothing
+        self.hit_ids = np.full(self.max_points, -1, dtype=np.int64)
+
+        #number of points stored, and where the next one goes
+        self.count = 0
+        self.head = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        """
+        Remove all the points
+        """
+        self.delete_timestamps.fill(-1)
+        self.hit_ids.fill(-1)
+        self.count = 0
+        self.head = 0
+
+    def add(self, positions:np.ndarray, colours:np.ndarray, delete_timestamps:np.ndarray, hit_ids:np.ndarray):
+        """
+        Add a batch of points, wrapping around the end of the buffer
+        """
+        count = len(positions)
+        start = 0
+        while start < count:
+            end = min(count, start + self.max_points - self.head)
+            slots = slice(self.head, self.head + end - start)
+
+            self.positions[slots] = positions[start:end]
+            self.colours[slots] = colours[start:end]
+            self.delete_timestamps[slots] = delete_timestamps[start:end]
+            self.hit_ids[slots] = hit_ids[start:end]
+
+            self.head = (self.head + end - start) % self.max_points
+            self.count = min(self.count + end - start, self.max_points)
+            start = end
+
+
 class PointSpawner():
     """
     Base class for radar/lidar stuff
     """
     def __init__(self, max_points:int) -> None:
         self.max_points = max_points
-        #TODO use set?
-        self.points_list: list[models.Point] = [None for i in range(self.max_points)]
-        self.point_count = 0
-        self.current_i = 0
+        self.points = PointCloud(self.max_points)
 
         self.delete_time = 1.0
 
+        #send rays to g.ray_pool if there is one, the results are added in update once they're ready
+        self.use_ray_pool = False
+        self.pending_rays:list[models.PendingRays] = []
+
         g.point_spawners.append(self)
 
+    @property
+    def point_count(self) -> int:
+        return self.points.count
+
     def clear(self):
         """
         Clear all the recorded point data for this spawner
         """
-        self.points_list: list[models.Point] = [None for i in range(self.max_points)]
-        self.point_count = 0
-        self.current_i = 0
+        self.points.clear()
+
+        for pending_rays in self.pending_rays:
+            pending_rays.cancel()
+        self.pending_rays.clear()
 
     def shoot_ray(self, x:int, y:int):
         """
         Shoot a single ray out of the camera at a point on the viewport and record the result
         """
+        self.shoot_rays([x], [y])
+
+    def shoot_rays(self, xs:list[float], ys:list[float]):
+        """
+        Shoot a batch of rays out of the camera at points on the viewport and record the results
+        """
+        if not len(xs):
+            return
 
         #1 -> 500 (far)
         #-1 -> 400 (far - near?)
-        ray_vec = p.Vector3(x + g.viewport.x, y + g.viewport.y, 100)#g.WIDTH/2, g.HEIGHT/2, 2)
+        ray_vecs = np.empty( (len(xs), 3) )
+        ray_vecs[:, 0] = xs
+        ray_vecs[:, 0] += g.viewport.x
+        ray_vecs[:, 1] = ys
+        ray_vecs[:, 1] += g.viewport.y
+        ray_vecs[:, 2] = 100
 
-        #proj = g.camera.get_projected(ray_vec, return_vec=False)
+        camera_pos = np.array([g.camera.x, g.camera.y, g.camera.z])
 
-        world_ray_vec = g.camera.get_unprojected( ray_vec )
-        direction_vec = world_ray_vec - g.camera
+        world_ray_vecs = g.camera.get_unprojected_array(ray_vecs)
+        directions = world_ray_vecs - camera_pos
 
-        world_point = models.Ray(g.camera.x, g.camera.y, g.camera.z, direction_vec, colour='white')
+        origins = np.broadcast_to(camera_pos, directions.shape)
+        if self.use_ray_pool and g.ray_pool:
+            self.pending_rays.append(models.PendingRays(origins, directions))
+            return
 
-        if world_point.colour == 'yellow':
-            world_point.delete_timestamp = p.time.get_ticks() + (self.delete_time*1000)
+        hit_points, hit_dists, hit_indices = models.cast_rays(origins, directions)
+        self.add_hits(hit_points, hit_indices)
 
-        
-        self.add_point(world_point)
+    def add_hits(self, hit_points:np.ndarray, hit_indices:np.ndarray, model_instances:list=None):
+        """
+        Add the results of a ray cast as points, coloured by what they hit
+        hit_indices are into model_instances, which is g.model_instances by default
+        """
+        if model_instances is None:
+            model_instances = g.model_instances
+
+        colours = np.empty( (len(hit_points), 3), dtype=np.uint8)
+        delete_timestamps = np.full(len(hit_points), -1, dtype=np.int64)
+        hit_ids = np.full(len(hit_points), -1, dtype=np.int64)
+
+        #everything about a point comes from what it hit, so only look at each instance once
+        current_time = g.get_ticks()
+        unique_indices, inverse = np.unique(hit_indices, return_inverse=True)
+        for i, hit_index in enumerate(unique_indices.tolist()):
+            hits = inverse.ravel() == i
+            if hit_index == -1:
+                colour = models.Ray.out_of_range_colour
+            else:
+                model_instance = model_instances[hit_index]
+                colour = model_instance.colour or 'white'
+                hit_ids[hits] = model_instance.broad_phase_id
+
+            colours[hits] = gfx.get_rgb(colour)
+            if colour == 'yellow':
+                delete_timestamps[hits] = current_time + (self.delete_time*1000)
+
+        self.points.add(hit_points, colours, delete_timestamps, hit_ids)
 
     def add_point(self, point:models.Point):
         """
         Add a new point to this spawner
         """
-        #TODO would this be better if the point was premade and the positions were passed in?
-
-        if point.res and point.res.colour:
-           point.colour = point.res.colour
-
-
-        self.points_list[self.current_i] = point
-        self.current_i = (self.current_i+1)%self.max_points
-
-        self.point_count = max(self.point_count, self.current_i)
+        self.points.add(np.array([[point.x, point.y, point.z]]), np.array([gfx.get_rgb(point.colour)]), np.array([point.delete_timestamp]), np.array([-1]))
 
     def update(self):
-        pass
+        #add finished batches in the order they were sent
+        while self.pending_rays:
+            result = self.pending_rays[0].get_result()
+            if result is None:
+                break
+
+            pending_rays = self.pending_rays.pop(0)
+            hit_points, hit_dists, hit_indices = result
+            self.add_hits(hit_points, hit_indices, pending_rays.model_instances)
 
 
     def draw(self):
-        for i in range(self.point_count):
-            point = self.points_list[i]
-            g.camera.project_and_draw_point(point)
-            #g.camera.draw_point(g.camera.project_point(point))
+        #project every point in one go, skipping the ones past their delete time
+        count = self.points.count
+        g.camera.project_points(self.points.positions[:count], self.points.colours[:count], self.points.delete_timestamps[:count])
     #    if not point:
     #        continue
     #    
@@ -85,6 +186,7 @@ class SmallRangePointSpawner(PointSpawner):
 
     def shoot_ray(self):
         x,y = g.mx - g.viewport.x, g.my - g.viewport.y
+        xs, ys = [], []
         for i in range(5):
             
             #x = int(g.WIDTH/2)
@@ -99,8 +201,10 @@ class SmallRangePointSpawner(PointSpawner):
             x += mx
             y += my
 
-            
-            super().shoot_ray(x,y)
+            xs.append(x)
+            ys.append(y)
+
+        self.shoot_rays(xs, ys)
 
 class BurstPointSpawner(PointSpawner):
     def __init__(self) -> None:
@@ -115,12 +219,20 @@ class BurstPointSpawner(PointSpawner):
         
         self.burst_cooldown = 6.0
         self.last_burst_time = -self.burst_cooldown*1000
+
+        self.use_ray_pool = True
         
 
     def update_burst(self):
         if self.bursting:
             #figure out how many rays to shoot this frame
             burst_amount = self.max_points * g.dt / self.burst_time
+            if self.use_ray_pool and g.ray_pool:
+                #the workers don't hold up the frame, so the whole burst can go at once
+                #the next one starts after the cooldown, rather than straight away like a spread out burst
+                burst_amount = self.max_points - self.burst_shot_count
+                self.last_burst_time = g.get_ticks()
+                self.bursting = False
             if self.burst_shot_count + burst_amount > self.max_points:
                 #this will be the last burst frame
                 burst_amount = self.max_points - self.burst_shot_count
@@ -128,9 +240,10 @@ class BurstPointSpawner(PointSpawner):
             
             pixels = g.viewport.w * g.viewport.h
             
-
+            xs, ys = [], []
             for i in range(int(burst_amount)):
-                super().shoot_ray(self.burst_state_x,self.burst_state_y)
+                xs.append(self.burst_state_x)
+                ys.append(self.burst_state_y)
 
                 self.burst_step = 534 + r.randint(-5,5)
                 self.burst_state_x += self.burst_step
@@ -140,9 +253,11 @@ class BurstPointSpawner(PointSpawner):
                     if self.burst_state_y >= g.viewport.h:
                         self.burst_state_y -= g.viewport.h
 
+            self.shoot_rays(xs, ys)
+
             self.burst_shot_count += burst_amount
         else:
-            if p.time.get_ticks() - self.last_burst_time >= self.burst_cooldown*1000:
+            if g.get_ticks() - self.last_burst_time >= self.burst_cooldown*1000:
                 self.start_burst()
 
     def start_burst(self):
@@ -171,8 +286,12 @@ class BeamSpawner(PointSpawner):
         x = self.x*g.viewport.w
 
         h_rand = int(30*g.dt)
+        xs, ys = [], []
         for i in range(int(self.max_points*self.h_speed*g.dt) ):
-            self.shoot_ray(x+r.randint(-h_rand,h_rand) ,r.randint(0,g.viewport.h))
+            xs.append(x+r.randint(-h_rand,h_rand))
+            ys.append(r.randint(0,g.viewport.h))
+
+        self.shoot_rays(xs, ys)
 
     
 
@@ -0,0 +1,193 @@
+import time
+import json
+import csv
+import os
+import numpy as np
+from collections import deque
+
+import global_values as g
+
+class Timer():
+    """
+    Times a block of code with "with", adding it to the profiler when the block ends
+    """
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler:'Profiler', name:str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, self.start, time.perf_counter())
+
+
+class NullTimer():
+    """
+    Used when profiling is off, so timed code costs (almost) nothing
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+NULL_TIMER = NullTimer()
+
+def timer(name:str) -> Timer|NullTimer:
+    """
+    Time a block of code under a name, if we're profiling
+    e.g. with profiler.timer('collision'):
+    """
+    if g.profiler:
+        return Timer(g.profiler, name)
+    return NULL_TIMER
+
+def count(name:str, amount:int=1):
+    """
+    Add to a per frame counter (e.g. rays cast), if we're profiling
+    """
+    if g.profiler:
+        g.profiler.count(name, amount)
+
+
+class Profiler():
+    """
+    Collects how long each named block of code takes per frame
+    Keeps the last history frames of every name for percentiles, and optionally every timed block for a Chrome trace
+    Times include anything timed inside them (e.g. collision is part of instance update)
+    Counters (e.g. rays cast) are kept per frame in the same way
+    """
+    def __init__(self, history:int=600, max_trace_events:int=0):
+        self.history = history
+        self.max_trace_events = max_trace_events
+
+        self.start_time = time.perf_counter()
+        self.frame_start = self.start_time
+        self.frame_count = 0
+
+        #name -> seconds and calls so far this frame
+        self.current_times:dict[str, float] = {}
+        self.current_calls:dict[str, int] = {}
+
+        #name -> ms per frame, and calls per frame, for the last history frames
+        self.frame_times:dict[str, deque] = {}
+        self.frame_calls:dict[str, deque] = {}
+
+        #name -> count so far this frame, and the counts for the last history frames
+        self.current_counts:dict[str, int] = {}
+        self.frame_counts:dict[str, deque] = {}
+
+        #(name, start, duration) of every timed block, in seconds since start_time
+        self.trace_events:list[tuple[str, float, float]] = []
+        self.dropped_trace_events = 0
+
+    def timer(self, name:str) -> Timer:
+        return Timer(self, name)
+
+    def add(self, name:str, start:float, end:float):
+        """
+        Record a timed block
+        """
+        self.current_times[name] = self.current_times.get(name, 0.0) + (end - start)
+        self.current_calls[name] = self.current_calls.get(name, 0) + 1
+
+        if self.max_trace_events:
+            if len(self.trace_events) < self.max_trace_events:
+                self.trace_events.append( (name, start - self.start_time, end - start) )
+            else:
+                self.dropped_trace_events += 1
+
+    def count(self, name:str, amount:int=1):
+        """
+        Add to a counter
+        """
+        self.current_counts[name] = self.current_counts.get(name, 0) + amount
+
+    def start_frame(self):
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """
+        Store this frame's totals
+        Names that weren't timed this frame get a 0, so percentiles are per frame rather than per call
+        """
+        self.add('frame', self.frame_start, time.perf_counter())
+        self.frame_count += 1
+
+        for name in self.current_times:
+            if name not in self.frame_times:
+                #fill in the frames before this name was first timed
+                self.frame_times[name] = deque([0.0]*min(self.frame_count-1, self.history), maxlen=self.history)
+                self.frame_calls[name] = deque([0]*min(self.frame_count-1, self.history), maxlen=self.history)
+
+        for name, times in self.frame_times.items():
+            times.append(self.current_times.get(name, 0.0)*1000)
+            self.frame_calls[name].append(self.current_calls.get(name, 0))
+
+        for name in self.current_counts:
+            if name not in self.frame_counts:
+                self.frame_counts[name] = deque([0]*min(self.frame_count-1, self.history), maxlen=self.history)
+        for name, counts in self.frame_counts.items():
+            counts.append(self.current_counts.get(name, 0))
+
+        self.current_times.clear()
+        self.current_calls.clear()
+        self.current_counts.clear()
+
+    def get_stats(self, percentiles=(50, 95, 99)) -> list[tuple]:
+        """
+        Get (name, mean calls per frame, mean ms, *percentile ms, max ms) for every name, slowest p95 first with the whole frame at the top
+        """
+        stats = []
+        for name, times in self.frame_times.items():
+            times = np.array(times)
+            stats.append( (name, float(np.mean(self.frame_calls[name])), float(times.mean()), *np.percentile(times, percentiles).tolist(), float(times.max())) )
+
+        stats.sort(key=lambda stat: (stat[0] != 'frame', -stat[4]))
+        return stats
+
+    def get_counts(self) -> list[tuple[str, float, int]]:
+        """
+        Get (name, mean per frame, max per frame) for every counter
+        """
+        return [(name, float(np.mean(counts)), int(np.max(counts))) for name, counts in sorted(self.frame_counts.items())]
+
+    def write_csv(self, path:str):
+        """
+        Write the stats of every name to a csv file
+        """
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow( ('name', 'calls_per_frame', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms') )
+            for stat in self.get_stats():
+                writer.writerow( (stat[0], *[round(val, 4) for val in stat[1:]]) )
+
+            writer.writerow( () )
+            writer.writerow( ('counter', 'mean_per_frame', 'max_per_frame') )
+            for name, mean, max_count in self.get_counts():
+                writer.writerow( (name, round(mean, 4), max_count) )
+
+    def write_trace(self, path:str):
+        """
+        Write every timed block as a Chrome trace, which can be opened in chrome://tracing or Perfetto
+        """
+        events = [{'name':name, 'ph':'X', 'ts':start*1_000_000, 'dur':duration*1_000_000, 'pid':0, 'tid':0}
+                  for name, start, duration in self.trace_events]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents':events, 'displayTimeUnit':'ms', 'otherData':{'dropped_events':self.dropped_trace_events}}, file)
+
+    def write(self, path:str):
+        """
+        Write a Chrome trace for .json files, otherwise a csv of the stats
+        """
+        if os.path.splitext(path)[1].lower() == '.json':
+            self.write_trace(path)
+        else:
+            self.write_csv(path)
@@ -0,0 +1,220 @@
+import numpy as np
+import multiprocessing as mp
+import signal
+
+import intersections
+import shared_geometry
+
+#NOTE: this module is imported by the worker processes, so it shouldn't import anything that needs pygame
+
+#each worker attaches to a slot's geometry the first time a batch needs it
+#slot -> (handle, SharedGeometry, (triangles, bvh or octree, centre, bounding radius))
+worker_slots:dict[int, tuple] = {}
+
+def init_worker():
+    """
+    Set up a worker, this is only done once per worker
+    """
+    #a forked worker keeps the handler SDL puts on SIGTERM, which would stop terminate from working
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def release_slot(slot:int):
+    """
+    Detach a worker from a slot's geometry
+    """
+    handle, geometry, instance = worker_slots.pop(slot)
+    #the tree and triangles are views onto the block, so they need to go before it's closed
+    del instance
+    geometry.detach()
+
+def get_slot(slot:int, handle:str) -> tuple|None:
+    """
+    Get the instance in a slot, attaching to its geometry if this worker hasn't yet
+    Returns None if the geometry has already been freed, i.e. the instance was removed after the batch was sent
+    """
+    if slot in worker_slots:
+        if worker_slots[slot][0] == handle:
+            return worker_slots[slot][2]
+        release_slot(slot)
+
+    try:
+        geometry = shared_geometry.attach(handle)
+    except FileNotFoundError:
+        return None
+
+    #the triangles are views onto the shared block, exported from the main process's FaceData so hits match its own exactly
+    instance = (geometry.get_triangles(), geometry.get_accel(), np.array(geometry.info['position']), geometry.info['bounding_radius'])
+    worker_slots[slot] = (handle, geometry, instance)
+    return instance
+
+def cast_rays(origins:np.ndarray, directions:np.ndarray, max_dist:float, slots:list[int], handles:list[str|None]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Run in a worker, the static part of models.cast_rays
+    directions need to be normalised already
+    slots are the ones to test, handles is every slot's geometry when the batch was sent (None for a free slot)
+    Returns the hit distances (inf for a miss) and the slot of the instance hit (-1 for a miss)
+    """
+    #let go of geometry that's been removed or replaced since this worker's last batch
+    for slot in list(worker_slots):
+        if slot >= len(handles) or worker_slots[slot][0] != handles[slot]:
+            release_slot(slot)
+
+    ray_count = len(origins)
+    closest_t = np.full(ray_count, np.inf)
+    closest_slots = np.full(ray_count, -1, dtype=np.int64)
+
+    for slot in slots:
+        instance = get_slot(slot, handles[slot])
+        if instance is None:
+            continue
+        triangles, tree, centre, radius = instance
+
+        candidates = np.flatnonzero(intersections.rays_spheres(origins, directions, centre, radius, max_dist))
+        if not len(candidates):
+            continue
+
+        #the same tests as models.get_closest_hits
+        if tree is None:
+            t, _ = intersections.closest_rays_triangles(origins[candidates], directions[candidates], triangles)
+        else:
+            pairs = tree.query_rays(origins[candidates], directions[candidates], max_dist)
+            t = intersections.closest_ray_triangle_pairs(origins[candidates], directions[candidates], triangles, *pairs)
+
+        closer = (t <= max_dist) & (t < closest_t[candidates])
+        closest_t[candidates[closer]] = t[closer]
+        closest_slots[candidates[closer]] = slot
+
+    return closest_t, closest_slots
+
+def get_context():
+    """
+    Fork where we can, so workers don't need to import the game again
+    NOTE: with spawn, the main script is run again in every worker, so it needs a __main__ guard
+    """
+    if 'fork' in mp.get_all_start_methods():
+        return mp.get_context('fork')
+    return mp.get_context('spawn')
+
+
+class RayWorkerPool():
+    """
+    Casts batches of rays against the static instances (the ones with a bvh or octree) in other processes
+    Each batch is sent off with submit and picked up with get_result on a later frame
+    Anything that moves isn't known by the workers, so it needs testing separately (see models.PendingRays)
+    The workers keep running when the static instances change, each instance keeps its slot while it exists so batches already sent stay valid
+    """
+    def __init__(self, worker_count:int=2):
+        self.worker_count = worker_count
+
+        self.pool = None
+        #static instances and the handles of their geometry, indexed by slot, None for a free slot
+        self.instances = []
+        self.handles = []
+        #broad_phase_id of each slot's instance, batches test slots in this order so ties go the same way as in cast_rays
+        self.keys = []
+        self.free_slots = []
+        #(first job id sent without it, geometry) for removed geometry that earlier batches might still need
+        self.retired = []
+
+        #job id -> AsyncResult
+        self.jobs = {}
+        self.next_job_id = 0
+
+    def set_geometry(self, geometries:dict[int, shared_geometry.SharedGeometry], removed:list[shared_geometry.SharedGeometry]=[]):
+        """
+        Give the workers the shared geometry of the static instances (see shared_geometry.sync), starting them the first time
+        Slots of removed geometry are freed for reuse and new geometry is put in a free slot, the workers attach to it when a batch first needs it
+        removed is geometry that was taken out of geometries but not detached, the pool detaches it once no batch sent before now needs it
+        """
+        self.retired += [(self.next_job_id, geometry) for geometry in removed]
+        self.release_retired()
+
+        if not self.pool:
+            self.pool = get_context().Pool(self.worker_count, initializer=init_worker)
+
+        handles = {geometry.handle:key for key, geometry in geometries.items()}
+        for slot, handle in enumerate(self.handles):
+            if handle is not None and handle not in handles:
+                self.instances[slot] = self.handles[slot] = self.keys[slot] = None
+                self.free_slots.append(slot)
+
+        known = set(self.handles)
+        for handle, key in handles.items():
+            if handle in known:
+                continue
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = len(self.handles)
+                self.instances.append(None)
+                self.handles.append(None)
+                self.keys.append(None)
+            self.instances[slot] = geometries[key].model_instance
+            self.handles[slot] = handle
+            self.keys[slot] = key
+
+    def submit(self, origins:np.ndarray, directions:np.ndarray, max_dist:float=100, groups=set(('models','rays'))) -> int:
+        """
+        Send a batch of rays to the workers, directions need to be normalised already
+        Returns a job id for get_result
+        """
+        #instances deleted since the last set_geometry are skipped, their slot is freed at the next one
+        slots = [slot for slot, model_instance in enumerate(self.instances)
+                 if model_instance is not None and not model_instance.deleted and not model_instance.collision_groups.isdisjoint(groups)]
+        slots.sort(key=self.keys.__getitem__)
+
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        self.jobs[job_id] = self.pool.apply_async(cast_rays, (origins, directions, max_dist, slots, self.handles[:]))
+        return job_id
+
+    def has_job(self, job_id:int) -> bool:
+        """
+        Whether a batch is still waiting to be picked up, batches are dropped when the workers are closed
+        """
+        return job_id in self.jobs
+
+    def get_result(self, job_id:int) -> tuple[np.ndarray, np.ndarray]|None:
+        """
+        Get the hit distances and instance slots of a batch, or None if it isn't done yet
+        """
+        job = self.jobs[job_id]
+        if not job.ready():
+            return None
+
+        del self.jobs[job_id]
+        self.release_retired()
+        return job.get()
+
+    def cancel(self, job_id:int):
+        """
+        Forget about a batch, it will still finish but the result is thrown away
+        """
+        self.jobs.pop(job_id, None)
+        self.release_retired()
+
+    def release_retired(self):
+        """
+        Detach removed geometry once every batch sent before it was removed has been picked up or cancelled
+        """
+        oldest_job_id = min(self.jobs, default=self.next_job_id)
+        for job_id, geometry in self.retired:
+            if job_id <= oldest_job_id:
+                geometry.detach()
+        self.retired = [(job_id, geometry) for job_id, geometry in self.retired if job_id > oldest_job_id]
+
+    def close(self):
+        """
+        Stop the workers, the shared geometry itself is left alone
+        """
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        self.jobs.clear()
+        self.release_retired()
+        self.instances.clear()
+        self.handles.clear()
+        self.keys.clear()
+        self.free_slots.clear()
@@ -0,0 +1,208 @@
+import sys
+import json
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+import bvh
+import octrees
+
+#NOTE: like ray_workers, this is imported by worker processes, so it shouldn't import anything that needs pygame
+
+#every array in a block starts on a multiple of this
+ALIGNMENT = 64
+#a block starts with the size of its header, then the header (the layout and info as json), then the arrays
+HEADER_SIZE = np.dtype('<u8')
+
+#names of the arrays in FaceData.ray_triangles (see intersections.prepare_triangles), exported so workers don't redo them
+TRIANGLE_NAMES = ('e1', 'e2', 'normals', 'planes', 'e2_cross_v0', 'v0_cross_e1')
+
+class SharedGeometry():
+    """
+    The arrays of a static model instance (vertices, faces, prepared triangles and its bvh or octree) in one shared memory block
+    Every array is a numpy view straight onto the block, so attaching to it doesn't copy anything
+    The block describes its own layout, so the name is all another process needs to attach
+    The process that exported it owns the block and unlinks it when detaching, other processes just close their handle
+    """
+    def __init__(self, memory:shared_memory.SharedMemory, layout:dict[str, tuple], info:dict, owner:bool=False, model_instance=None):
+        self.memory = memory
+        #name -> (offset, shape, dtype)
+        self.layout = layout
+        #plain values needed alongside the arrays, e.g. position and bounding radius
+        self.info = info
+        self.owner = owner
+        #only set in the process that exported it
+        self.model_instance = model_instance
+
+        self.arrays:dict[str, np.ndarray] = {name: np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+                                             for name, (offset, shape, dtype) in layout.items()}
+
+    def __str__(self):
+        return f'SharedGeometry {self.memory.name} {", ".join(self.arrays)}'
+
+    def __getitem__(self, name:str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __contains__(self, name:str) -> bool:
+        return name in self.arrays
+
+    def get_triangles(self) -> tuple:
+        """
+        The exported FaceData.ray_triangles, for intersections.rays_triangles
+        """
+        return tuple(self.arrays['triangles_' + name] for name in TRIANGLE_NAMES)
+
+    def get_accel(self) -> bvh.BVH|octrees.LinearOctree|None:
+        """
+        Rebuild the exported bvh or octree around the shared arrays, without building it again
+        """
+        if self.info['accel'] == 'bvh':
+            return bvh.BVH.from_arrays({name:self.arrays['bvh_' + name] for name in bvh.ARRAY_NAMES})
+
+        if self.info['accel'] == 'octree':
+            tree = octrees.LinearOctree(self.info['octree_lb'], self.info['octree_rt'], self.info['octree_depth'])
+            tree.leaf_offsets = self.arrays['octree_leaf_offsets']
+            tree.leaf_faces = self.arrays['octree_leaf_faces']
+            return tree
+
+        return None
+
+    @property
+    def handle(self) -> str:
+        """
+        Everything attach needs, small enough to send to a worker with every batch
+        """
+        return self.memory.name
+
+    def detach(self):
+        """
+        Close this process's handle on the block, and free the block if we own it
+        NOTE: any other views onto the arrays need to be gone first
+        """
+        if self.memory is None:
+            return
+
+        self.arrays.clear()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
+
+
+def get_instance_arrays(model_instance) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Get the arrays and info of a static model instance that get exported
+    """
+    arrays = {
+        'vertices':model_instance.transformed_vertex_array[:, :3],
+        'faces':model_instance.model.face_array,
+    }
+    info = {
+        'position':(model_instance.x, model_instance.y, model_instance.z),
+        'bounding_radius':model_instance.bounding_radius,
+        'accel':None,
+    }
+
+    for name, array in zip(TRIANGLE_NAMES, model_instance.get_face_data().ray_triangles):
+        arrays['triangles_' + name] = array
+
+    if model_instance.bvh:
+        tree = model_instance.bvh
+        info['accel'] = 'bvh'
+        for name in bvh.ARRAY_NAMES:
+            arrays['bvh_' + name] = getattr(tree, name)
+
+    elif model_instance.octree:
+        tree = model_instance.octree
+        info['accel'] = 'octree'
+        info['octree_depth'] = tree.depth
+        info['octree_lb'] = tree.lb_list
+        info['octree_rt'] = tree.rt_list
+        for name in ('node_bounds', 'level_offsets', 'leaf_codes', 'leaf_offsets', 'leaf_faces'):
+            arrays['octree_' + name] = getattr(tree, name)
+
+    return arrays, info
+
+def export(model_instance) -> SharedGeometry:
+    """
+    Copy a static model instance into a new shared memory block
+    """
+    arrays, info = get_instance_arrays(model_instance)
+
+    #offsets from the end of the header, which can't be measured until they're in it
+    layout = {}
+    size = 0
+    for name, array in arrays.items():
+        offset = -(-size // ALIGNMENT) * ALIGNMENT
+        layout[name] = (offset, array.shape, array.dtype.str)
+        size = offset + array.nbytes
+
+    header = json.dumps({'layout':layout, 'info':info}).encode()
+    start = -(-(HEADER_SIZE.itemsize + len(header)) // ALIGNMENT) * ALIGNMENT
+    layout = {name:(offset + start, shape, dtype) for name, (offset, shape, dtype) in layout.items()}
+
+    memory = shared_memory.SharedMemory(create=True, size=start + size)
+    memory.buf[:HEADER_SIZE.itemsize] = np.array(len(header), dtype=HEADER_SIZE).tobytes()
+    memory.buf[HEADER_SIZE.itemsize:HEADER_SIZE.itemsize + len(header)] = header
+    geometry = SharedGeometry(memory, layout, info, owner=True, model_instance=model_instance)
+    for name, array in arrays.items():
+        geometry[name][...] = array
+
+    return geometry
+
+def attach(name:str) -> SharedGeometry:
+    """
+    Attach to a block exported by another process, using its handle (the block's name)
+    The block isn't registered with the resource tracker, since it belongs to the exporter, which unlinks it
+    Raises FileNotFoundError if the exporter has already freed it
+    """
+    if sys.version_info >= (3, 13):
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        #before 3.13 attaching always registers, and workers share the exporter's tracker, so unregistering afterwards
+        #would also drop the exporter's own registration, instead don't register at all
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            memory = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+    header_size = int(np.frombuffer(memory.buf, dtype=HEADER_SIZE, count=1)[0])
+    header = json.loads(bytes(memory.buf[HEADER_SIZE.itemsize:HEADER_SIZE.itemsize + header_size]))
+    start = -(-(HEADER_SIZE.itemsize + header_size) // ALIGNMENT) * ALIGNMENT
+    layout = {name:(offset + start, tuple(shape), dtype) for name, (offset, shape, dtype) in header['layout'].items()}
+
+    return SharedGeometry(memory, layout, header['info'])
+
+def sync(geometries:dict[int, SharedGeometry], model_instances:list, removed:list[SharedGeometry]|None=None) -> bool:
+    """
+    Export every static instance that isn't exported yet, and detach the ones whose instance has been deleted
+    geometries is keyed by broad_phase_id
+    If removed is given, removed geometry is added to it instead of being detached, for when something may still be reading it
+    Returns True if anything changed, so anything using the old set knows to update
+    """
+    changed = False
+
+    static_instances = {model_instance.broad_phase_id:model_instance for model_instance in model_instances if model_instance.is_static}
+    for key in list(geometries):
+        if geometries[key].model_instance is not static_instances.get(key):
+            if removed is None:
+                geometries.pop(key).detach()
+            else:
+                removed.append(geometries.pop(key))
+            changed = True
+
+    for key, model_instance in static_instances.items():
+        if key not in geometries:
+            geometries[key] = export(model_instance)
+            changed = True
+
+    return changed
+
+def detach_all(geometries:dict[int, SharedGeometry]):
+    """
+    Detach every exported block
+    """
+    for geometry in geometries.values():
+        geometry.detach()
+    geometries.clear()
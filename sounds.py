@@ -83,7 +83,7 @@ class WorldSound(p.Vector3):
 
         
 
-        self.creation_timestamp = p.time.get_ticks()
+        self.creation_timestamp = g.get_ticks()
 
         self.deleted = False
         g.world_sounds.append(self)
@@ -104,7 +104,7 @@ class WorldSound(p.Vector3):
         #todo add an option for set_source_location here?
         self.channel.set_volume(vol)
 
-        if p.time.get_ticks() - self.creation_timestamp > self.sound.get_length()*1000:
+        if g.get_ticks() - self.creation_timestamp > self.sound.get_length()*1000:
             self.delete()
 
     def delete(self):
@@ -0,0 +1,101 @@
+import numpy as np
+import math as m
+
+def set_rotation(out:np.ndarray, ax:float, ay:float, az:float):
+    """
+    Write the rotation mat_rotate_x*mat_rotate_y*mat_rotate_z into the top left 3x3 of out
+    """
+    cx, sx = m.cos(ax), m.sin(ax)
+    cy, sy = m.cos(ay), m.sin(ay)
+    cz, sz = m.cos(az), m.sin(az)
+
+    out[0, 0] = cy*cz
+    out[0, 1] = -cy*sz
+    out[0, 2] = sy
+
+    out[1, 0] = cx*sz + sx*sy*cz
+    out[1, 1] = cx*cz - sx*sy*sz
+    out[1, 2] = -sx*cy
+
+    out[2, 0] = sx*sz - cx*sy*cz
+    out[2, 1] = sx*cz + cx*sy*sz
+    out[2, 2] = cx*cy
+
+
+class Transform():
+    """
+    Model transform (translation * rotation) kept in one reused ndarray
+    Only recalculated when the angles or position change
+    """
+    def __init__(self):
+        self.matrix = np.identity(4)
+        self.key = None
+
+    def update(self, ax:float, ay:float, az:float, x:float, y:float, z:float) -> bool:
+        """
+        Update the matrix, returns whether anything changed
+        """
+        key = (ax, ay, az, x, y, z)
+        if key == self.key:
+            return False
+        self.key = key
+
+        set_rotation(self.matrix, ax, ay, az)
+        self.matrix[0, 3] = x
+        self.matrix[1, 3] = y
+        self.matrix[2, 3] = z
+        return True
+
+
+class CameraTransform():
+    """
+    Camera transform (projection * rotation * inverse translation) and its inverse, kept in reused ndarrays
+    The inverse is worked out directly from the rotation and projection rather than with a general inverse
+    """
+    def __init__(self):
+        self.rotation = np.identity(4)
+        self.matrix = np.identity(4)
+        self.inverse = np.identity(4)
+        self.key = None
+
+    def update(self, ax:float, ay:float, az:float, x:float, y:float, z:float, near:float, far:float) -> bool:
+        """
+        Update the matrices, returns whether anything changed
+        """
+        key = (ax, ay, az, x, y, z, near, far)
+        if key == self.key:
+            return False
+        self.key = key
+
+        set_rotation(self.rotation, ax, ay, az)
+        rot = self.rotation[:3, :3]
+        pos = np.array([x, y, z])
+
+        #same values as Camera.mat_projection
+        v1 = -(far+near)/(far-near)
+        v2 = (-2*far*near)/(far-near)
+
+        #rotation * translation(-pos) is [R | -R.pos]
+        translated = -(rot @ pos)
+
+        full = self.matrix
+        full[0, :3] = near*rot[0]
+        full[0, 3] = near*translated[0]
+        full[1, :3] = near*rot[1]
+        full[1, 3] = near*translated[1]
+        full[2, :3] = v1*rot[2]
+        full[2, 3] = v1*translated[2] + v2
+        full[3, :3] = -rot[2]
+        full[3, 3] = -translated[2]
+
+        #inverse is translation(pos) * R^T * projection^-1
+        inv = self.inverse
+        inv[:3, 0] = rot[0]/near
+        inv[:3, 1] = rot[1]/near
+        inv[:3, 2] = pos/v2
+        inv[:3, 3] = -rot[2] + pos*(v1/v2)
+        inv[3, 0] = 0
+        inv[3, 1] = 0
+        inv[3, 2] = 1/v2
+        inv[3, 3] = v1/v2
+        return True